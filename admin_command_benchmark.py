@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Compare the cost of routing DMs to admin commands before and after the command registry
+
+Usage: python admin_command_benchmark.py [--dms 20000] [--workspaces 200]
+
+Routes a mix of DMs (mostly export requests, some admin commands from admins
+and from other users) the way handle_admin_request used to, with a chain of
+startswith checks after loading the workspace for every DM, and with
+admin_commands.py's compiled regex, which only loads the workspace to
+authorize an admin-only command. Handlers aren't run. Workspaces are written to
+a temporary directory, so ./data/workspaces.pickle isn't touched.
+"""
+import argparse
+import logging
+import os
+import pickle
+import random
+import tempfile
+import time
+from workspace_store import get_workspace_info
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+# The checks handle_admin_request made, in its order
+LEGACY_ADMIN_ONLY_PREFIXES = ("keep apart", "set channel format", "set announcement", "set auto-add", "set model tier", "profile", "always include", "remove from always include")
+LEGACY_COMMAND_PREFIXES = ("always include", "remove from always include", "keep apart", "keep together", "remove keep apart", "remove keep together", "set auto-add", "set model tier", "profile", "set channel format", "set announcement")
+
+SAMPLE_DMS = [
+    "<#C0123ABCD|check-ins-2024-01>",
+    "<#C0123ABCD|check-ins-2024-01> from 2024-01-01 to 2024-01-15 as csv",
+    "<#C0123ABCD|check-ins-2024-01> <#C0456EFGH|check-ins-2024-02>",
+    "months 2024-01 to 2024-06",
+    "hi! how do I get my check-ins?",
+    "keep apart <@U0AAAA> <@U0BBBB>",
+    "remove keep together <@U0AAAA> <@U0BBBB>",
+    "set announcement text Welcome to the new month!",
+    "set auto-add on",
+    "king me",
+    "123456",
+]
+
+
+def legacy_route(event: dict):
+    text = event.get("text", "").strip().lower()
+    if text == "king me":
+        return "king me"
+    if text.isdigit() and len(text) == 6:
+        return "passcode"
+    workspace = get_workspace_info(event["team"])
+    if not workspace or "admins" not in workspace or event["user"] not in workspace["admins"]:
+        if any(text.startswith(prefix) for prefix in LEGACY_ADMIN_ONLY_PREFIXES):
+            return "not admin"
+        return None
+    for prefix in LEGACY_COMMAND_PREFIXES:
+        if text.startswith(prefix):
+            return prefix
+    return None
+
+
+def registry_route(event: dict, registry, is_admin):
+    command, end = registry.match(event.get("text", "").strip().lower())
+    if command is None:
+        return None
+    if command.admin_only and not is_admin(event["team"], event["user"]):
+        return "not admin"
+    return command.phrase
+
+
+def write_workspaces(count: int):
+    os.makedirs("data", exist_ok=True)
+    workspaces = {
+        f"T{i:08d}": {"team_id": f"T{i:08d}", "admins": [f"U{i:08d}"], "incompatible_pairs": [[f"U{j}", f"U{j + 1}"] for j in range(20)]}
+        for i in range(count)
+    }
+    with open("data/workspaces.pickle", "wb") as f:
+        pickle.dump(workspaces, f)
+
+
+def time_routing(route, events: list) -> float:
+    """Mean microseconds to route one DM"""
+    start = time.perf_counter()
+    for event in events:
+        route(event)
+    return (time.perf_counter() - start) / len(events) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dms", type=int, default=20000)
+    parser.add_argument("--workspaces", type=int, default=200)
+    args = parser.parse_args()
+
+    # Registers the bot's admin commands
+    import app
+    from admin_commands import registry
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir(tmp)
+        write_workspaces(args.workspaces)
+        random.seed(0)
+        teams = [random.randrange(args.workspaces) for _ in range(args.dms)]
+        # Half the DMs are from the workspace's admin
+        events = [
+            {"team": f"T{team:08d}", "user": random.choice([f"U{team:08d}", "U99999999"]), "text": random.choice(SAMPLE_DMS)}
+            for team in teams
+        ]
+        # Both pick the same command for admins; "set announcement" is split into one command per subcommand
+        for event in events[:200]:
+            before, after = legacy_route(event), registry_route(event, registry, app.is_workspace_admin)
+            if event["user"] != "U99999999" and (before is None) != (after is None) or before and not after.startswith(before):
+                raise RuntimeError(f"Routes differ for {event['text']}: {before}, {after}")
+        legacy = time_routing(legacy_route, events)
+        compiled = time_routing(lambda event: registry_route(event, registry, app.is_workspace_admin), events)
+        # Matching alone, as if every DM came from an admin of a workspace already in memory
+        legacy_match = time_routing(lambda event: next((p for p in LEGACY_COMMAND_PREFIXES if event["text"].strip().lower().startswith(p)), None), events)
+        compiled_match = time_routing(lambda event: registry.match(event["text"].strip().lower()), events)
+    logging.info(f"{len(registry.commands())} commands, {args.dms} DMs, {args.workspaces} workspaces")
+    logging.info(f"startswith chain, workspace loaded for every DM: {legacy:8.1f} µs per DM ({legacy_match:.2f} µs matching)")
+    logging.info(f"compiled registry, workspace loaded to authorize: {compiled:8.1f} µs per DM ({compiled_match:.2f} µs matching)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import logging
+import re
+
+# Admin commands sent to the bot by DM, e.g. "keep apart @user1 @user2".
+#
+# Commands are registered with @admin_command, which is also how to add a new
+# one: give the phrase the DM starts with, the arguments it takes and whether
+# only workspace admins may use it. dispatch_admin_command finds the command
+# with one compiled regex, checks authorization once, parses the arguments and
+# calls the handler with them.
+
+ADMIN_ONLY_MESSAGE = "❌ Only administrators can use this command."
+
+
+class CommandUsageError(Exception):
+    """Raised by argument parsers and handlers; its message is sent back to the user"""
+
+
+class AdminCommand:
+    def __init__(self, phrase: str, handler, args: tuple, admin_only: bool, exact: bool, pattern: str):
+        self.phrase = phrase
+        self.handler = handler
+        self.args = args
+        self.admin_only = admin_only
+        self.exact = exact
+        self.pattern = pattern
+
+
+def user_mentions(count: int = None, usage: str = ""):
+    """Argument: IDs of the users mentioned in the DM, like <@U123ABC>; exactly count, or at least one"""
+    def parse(event, rest):
+        mentions = re.findall(r'<@([A-Z0-9]+)>', event["text"])
+        if (count is None and not mentions) or (count is not None and len(mentions) != count):
+            raise CommandUsageError(usage)
+        return mentions
+    return parse
+
+
+def channel_mention(usage: str = ""):
+    """Argument: ID of the first channel mentioned in the DM, like <#C123ABC|general>"""
+    def parse(event, rest):
+        match = re.search(r'<#([A-Z0-9]+)\|?[^>]*>', event["text"])
+        if not match:
+            raise CommandUsageError(usage)
+        return match.group(1)
+    return parse
+
+
+def rest_of_text(lower: bool = False, required: bool = False, usage: str = ""):
+    """Argument: what the DM says after the command, as typed or lowercased"""
+    def parse(event, rest):
+        rest = rest.strip()
+        if required and not rest:
+            raise CommandUsageError(usage)
+        return rest.lower() if lower else rest
+    return parse
+
+
+class AdminCommandRegistry:
+    """Admin commands, matched against DMs with one regex compiled from all of them
+
+    Longer phrases are tried first, so "remove keep apart" wins over
+    "keep apart" and "set announcement tag" over "set announcement".
+    """
+
+    def __init__(self):
+        self._commands = []
+        self._regex = None
+        self._by_group = {}
+
+    def register(self, phrase: str, handler, args: tuple = (), admin_only: bool = True, exact: bool = False, pattern: str = None):
+        self._commands.append(AdminCommand(phrase, handler, args, admin_only, exact, pattern))
+        self._regex = None
+
+    def _compile(self):
+        alternatives = []
+        self._by_group = {}
+        for i, command in enumerate(sorted(self._commands, key=lambda command: -len(command.phrase))):
+            if command.pattern:
+                body = f"(?:{command.pattern})$"
+            elif command.exact:
+                body = re.escape(command.phrase) + "$"
+            else:
+                # The phrase, then the end of the DM or a space, mention or other non-word character
+                body = re.escape(command.phrase) + r"(?![\w-])"
+            alternatives.append(f"(?P<c{i}>{body})")
+            self._by_group[f"c{i}"] = command
+        self._regex = re.compile("|".join(alternatives) or "(?!)")
+
+    def match(self, text: str):
+        """The command a DM's stripped, lowercased text asks for, and the original text after it, or (None, None)"""
+        if self._regex is None:
+            self._compile()
+        match = self._regex.match(text)
+        if not match:
+            return None, None
+        return self._by_group[match.lastgroup], match.end()
+
+    def commands(self) -> list:
+        return list(self._commands)
+
+
+registry = AdminCommandRegistry()
+
+
+def admin_command(phrase: str, args: tuple = (), admin_only: bool = True, exact: bool = False, pattern: str = None):
+    """Register the decorated function as the handler of DMs starting with phrase
+
+    The handler is called as handler(client, event, logger, *parsed_args).
+
+    Args:
+        phrase: Lowercase words the DM starts with
+        args: Argument parsers, like user_mentions(2), applied in order
+        admin_only: Whether only the workspace's admins may use the command
+        exact: Whether the DM must be exactly phrase
+        pattern: Regex the whole lowercased DM must match, instead of phrase
+    """
+    def register(handler):
+        registry.register(phrase, handler, args, admin_only, exact, pattern)
+        return handler
+    return register
+
+
+def reply(client, event, text: str):
+    client.chat_postMessage(channel=event["channel"], text=text)
+
+
+def dispatch_admin_command(client, event, logger, is_admin) -> bool:
+    """Run the admin command a DM asks for, if any
+
+    Args:
+        is_admin: Called as is_admin(team_id, user_id), only for admin-only commands
+
+    Returns:
+        bool: Whether the DM was an admin command, allowed or not
+    """
+    text = event.get("text", "")
+    stripped = text.strip()
+    command, end = registry.match(stripped.lower())
+    if command is None:
+        return False
+    if command.admin_only and not is_admin(event["team"], event["user"]):
+        reply(client, event, ADMIN_ONLY_MESSAGE)
+        return True
+    # Phrases are ASCII, so the matched part is as long in the original text
+    rest = stripped[end:]
+    try:
+        args = [parse(event, rest) for parse in command.args]
+        command.handler(client, event, logger, *args)
+    except CommandUsageError as e:
+        reply(client, event, str(e))
+    except Exception as e:
+        logging.error(f"Error handling admin command {command.phrase}: {repr(e)}")
+    return True
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from workspace_store import update_announcement_tag
+
+# Message text shared by the cron job and the home tab. Keep this module free of
+# import-time side effects: it is imported by every web worker.
+
+# Month-specific emojis for signup messages
+MONTH_EMOJIS = {
+    "January": ":snowflake:",  # Snowflake for winter
+    "February": ":heart:",  # Hearts for Valentine's Day
+    "March": ":four_leaf_clover:",  # Four leaf clover for St. Patrick's Day
+    "April": ":cherry_blossom:",  # Cherry blossom for spring
+    "May": ":tulip:",  # Tulip for spring flowers
+    "June": ":sunny:",  # Sunny for summer
+    "July": ":beach_with_umbrella:",  # Beach umbrella for summer vacation
+    "August": ":palm_tree:",  # Palm tree for summer
+    "September": ":fallen_leaf:",  # Fallen leaf for autumn
+    "October": ":jack_o_lantern:",  # Jack o'lantern for Halloween
+    "November": ":maple_leaf:",  # Maple leaf for fall
+    "December": ":christmas_tree:"  # Christmas tree for holidays
+}
+
+def get_pt_time():
+    """Get current time in PT (UTC-8, ignoring daylight savings)"""
+    return datetime.utcnow() - timedelta(hours=8)
+
+def build_announcement_message(workspace_info: dict):
+    """Build the announcement message for the monthly signup"""
+    
+    # Get the next month
+    now = get_pt_time()
+    next_month = (now.replace(day=1) + timedelta(days=32)).replace(day=1)
+    next_month_name = next_month.strftime("%B")
+    
+    # Get the month-specific emoji
+    month_emoji = MONTH_EMOJIS.get(next_month_name, ":calendar:")  # Default to calendar if month not found
+    
+    # Get the custom announcement text
+    custom_text = workspace_info.get("custom_announcement_text", "")
+    if not custom_text:
+        custom_text = ""
+
+    # Get the tag type
+    tag_type = workspace_info.get("announcement_tag", "channel")
+    if not tag_type:
+        tag_type = "channel"
+        update_announcement_tag(workspace_info["team_id"], tag_type)
+    # Create the message
+    message = f"It's almost {next_month_name}! {month_emoji} <!{tag_type}> Please react to this message if you want to opt in for {next_month_name}. {custom_text}\n\n:sun_with_face: If you would like to try daily checkins\n:star2: If you would like to do weekly checkins (in the same channel)"
+    
+    return message
+
+def build_intro_message(users: list, month: str, admins: list = None):
+    """Build the intro message for the checkin channels"""
+    users_text = " ".join([f"<@{user}>" for user in users])
+    
+    # Build admin mentions text
+    admin_text = ""
+    if admins:
+        admin_mentions = " ".join([f"<@{admin}>" for admin in admins])
+        admin_text = f"* This group is administered by {admin_mentions}. Feel free to message them with any questions or concerns."
+    
+    message = (
+        f"Welcome to {month}! {MONTH_EMOJIS[month]} {users_text}\n\n"
+        f"Let's do introductions here in thread. You can be as brief or long as you like. Share any of: who you might mention in your check ins, what's been on your mind lately, or what you'd like to get done in the short or long term. (pasting your intro from a previous month is fine too!)\n\n"
+        f"General info about this group:\n"
+        f"* The aim is to create a supportive group of close-knit friends, not to make people feel bad about their productivity level\n"
+        f"* We share our intentions for the day and how our previous day went, often along with a little journalling. The format is casual and flexible, and i'm happy for you to use this group in a way that feels most useful to you. Some people post daily and others weekly.\n"
+        f"* If you don't end up posting anything by the 10th of the month I will bump you out of this month's group, just to make sure nobody feels weird about people reading without posting. I'll send out reminders to people who haven't posted around the 7th.\n"
+        f"* If you want to get the text of all your checkins from a month, message me just the name of the channel, like `#2025-february-1` (but in plain text; the channel should turn into a blue link). Note that ONLY MESSAGES FROM THE PAST 90 DAYS ARE SAVED on our Free Slack plan.\n"
+        f"{admin_text}\n"
+        f"* If you read someone else's message, leave an emoji react! :slightly_smiling_face: I will leave some initial emoji reacts on each message to foster more human to human interaction.\n"
+        f"*While it's OK to share that you know someone through this group, _please keep information you learn about people here confidential_. For many of us this is our diary.*"
+    )
+    return message
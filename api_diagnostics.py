@@ -6,9 +6,11 @@ from datetime import datetime
 from slack_bolt import App
 from slack_bolt.oauth.oauth_settings import OAuthSettings
 from slack_sdk.errors import SlackApiError
-from slack_sdk.oauth.installation_store import FileInstallationStore
-from slack_sdk.oauth.state_store import FileOAuthStateStore
 import tokens
+from installation_stores import build_installation_store
+from state_stores import build_state_store
+from slack_clients import PooledWebClient, SlackClientPool
+from user_directory import get_user_directory
 
 # Set up logging
 logging.basicConfig(
@@ -42,8 +44,8 @@ oauth_settings = OAuthSettings(
         "users:read",
         "team:read"
     ],
-    installation_store=FileInstallationStore(base_dir="./data/installations"),
-    state_store=FileOAuthStateStore(expiration_seconds=600, base_dir="./data/states")
+    installation_store=build_installation_store(),
+    state_store=build_state_store()
 )
 
 app = App(
@@ -51,6 +53,8 @@ app = App(
     oauth_settings=oauth_settings
 )
 
+client_pool = SlackClientPool(app.installation_store)
+
 def run_api_diagnostics(client, workspace_id):
     """
     Run comprehensive API diagnostics to debug permission issues
@@ -94,15 +98,12 @@ def run_api_diagnostics(client, workspace_id):
         except Exception as e:
             logging.error("conversations.list failed: {}".format(e))
         
-        # 3.2 Test users.list
+        # 3.2 Test users.list, loading the user directory used by the checks below
+        directory = get_user_directory()
         try:
             logging.info("\nTesting users.list...")
-            result = client.users_list(limit=5)
-            logging.info("users.list result: {}".format(result["ok"]))
-            if result["members"]:
-                logging.info("  Found users: {}".format(len(result["members"])))
-                for user in result["members"][:3]:  # Show up to 3 users
-                    logging.info("  - {} ({})".format(user["name"], user["id"]))
+            count = directory.load(workspace_id, client)
+            logging.info("  Found users: {}".format(count))
         except Exception as e:
             logging.error("users.list failed: {}".format(e))
             
@@ -139,12 +140,8 @@ def run_api_diagnostics(client, workspace_id):
                 try:
                     logging.info("Testing user invitation...")
                     # Get the first admin user
-                    users = client.users_list()
-                    admin_user = None
-                    for user in users["members"]:
-                        if user.get("is_admin", False) and not user.get("is_bot", False):
-                            admin_user = user["id"]
-                            break
+                    admins = directory.workspace_admins(workspace_id)
+                    admin_user = admins[0]["user_id"] if admins else None
                     
                     if admin_user:
                         invite_result = client.conversations_invite(
@@ -217,11 +214,7 @@ def run_api_diagnostics(client, workspace_id):
         # 4. Check workspace admins
         try:
             logging.info("\nChecking workspace admins...")
-            admin_users = []
-            users_list = client.users_list()
-            for user in users_list["members"]:
-                if user.get("is_admin", False):
-                    admin_users.append(user.get("name", "unknown") + " (" + user.get("id", "unknown") + ")")
+            admin_users = [f"{user['name']} ({user['user_id']})" for user in directory.workspace_admins(workspace_id)]
             
             logging.info("Workspace admins: {}".format(", ".join(admin_users)))
         except Exception as e:
@@ -243,8 +236,7 @@ def main():
             team_id = install.team_id
             try:
                 # Create client from installation's bot token
-                client = app.client
-                client.token = install.bot_token
+                client = PooledWebClient(token=install.bot_token)
                 auth = client.auth_test()
                 logging.info("  - {} ({}): Team Name: {}".format(team_id, auth.get("team_id"), auth.get("team")))
             except Exception as e:
@@ -257,21 +249,11 @@ def main():
     workspace_id = sys.argv[1]
     logging.info("Running diagnostics for workspace ID: {}".format(workspace_id))
     
-    # Get installation for this workspace
-    installation = app.installation_store.find_installation(
-        team_id=workspace_id,
-        enterprise_id=None,
-        is_enterprise_install=False
-    )
-    
-    if not installation:
-        logging.error("No installation found for workspace {}".format(workspace_id))
+    # Get a client with this workspace's bot token
+    client = client_pool.get_client(workspace_id)
+    if not client:
         return
     
-    # Create client from installation's bot token
-    client = app.client
-    client.token = installation.bot_token
-    
     # Run API diagnostics for this workspace
     run_api_diagnostics(client, workspace_id)
 
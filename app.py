@@ -1,18 +1,36 @@
 import importlib
+import os
 import re
 import string
 import random
-from datetime import datetime, date, timedelta
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
 from anthropic import Anthropic
-from slack_bolt import App
+from slack_bolt import App, BoltResponse
+from slack_sdk import WebClient
 from slack_bolt.oauth.oauth_settings import OAuthSettings
-from slack_sdk.oauth.installation_store import FileInstallationStore
-from slack_sdk.oauth.state_store import FileOAuthStateStore
+from slack_bolt.oauth.callback_options import CallbackOptions
+from slack_bolt.authorization.authorize import InstallationStoreAuthorize
 from slack_sdk.models.blocks import SectionBlock, DividerBlock
 from slack_sdk.models.blocks.basic_components import MarkdownTextObject
 import logging
-from workspace_store import get_workspace_info, ensure_workspace_exists, update_workspace_admins, generate_admin_passcode, verify_admin_passcode, add_incompatible_pair, add_compatible_pair, remove_compatible_pair, remove_incompatible_pair, update_channel_format, update_announcement_channel, update_custom_announcement, update_announcement_tag, update_auto_add_setting, update_announcement_timestamp, add_always_include_user, remove_always_include_user, get_emoji_optout_users
+from workspace_store import get_workspace_info, ensure_workspace_exists, update_workspace_admins, generate_admin_passcode, verify_admin_passcode, add_incompatible_pair, add_compatible_pair, remove_compatible_pair, remove_incompatible_pair, update_channel_format, update_announcement_channel, update_custom_announcement, update_announcement_tag, update_auto_add_setting, update_announcement_timestamp, add_always_include_user, remove_always_include_user, get_emoji_optout_users, update_model_tier, update_team_metadata, refresh_team_metadata, bump_settings_version
 from home_tab import register_home_tab_handlers
+from message_preprocessing import preprocess_check_in
+from installation_stores import build_installation_store
+from state_stores import build_state_store
+from model_routing import DEFAULT_MODEL, EMOJI_SYSTEM_PROMPT, choose_model, track_model_call
+from metrics import record_event, record_dropped_event, register_queue, timed
+from slack_clients import SlackClientPool, instrument_client, upload_file
+from tracing import span
+from user_directory import get_user_directory
+from exports import describe_date_range, export_bundle, extract_channels, find_month_channels, iter_archived_check_ins, parse_date_range, parse_month_range
+from checkin_archive import get_archive
+from export_writers import parse_export_format, write_check_ins
+from admin_commands import CommandUsageError, admin_command, channel_mention, dispatch_admin_command, reply, rest_of_text, user_mentions
+from export_jobs import MAX_QUEUED_JOBS_PER_USER, get_export_queue, start_export_workers, wake_export_workers
+from profiling import profiled, start_profiling, stop_profiling, get_session
 
 # Add this near the top of your file
 logging.basicConfig(
@@ -22,11 +40,33 @@ logging.basicConfig(
 
 tokens = importlib.import_module("tokens")
 
+# Route emoji requests between models by message size and workspace tier; off uses DEFAULT_MODEL for everything
+MODEL_ROUTING_ENABLED = getattr(tokens, "model_routing_enabled", False)
+
+# Point these at mock_slack.py to run the bot offline, e.g. for load tests
+SLACK_API_URL = getattr(tokens, "slack_api_url", "https://slack.com/api/")
+ANTHROPIC_BASE_URL = getattr(tokens, "anthropic_base_url", None)
+
 
 ai_client = Anthropic(
     api_key=tokens.anthropic_key,
+    base_url=ANTHROPIC_BASE_URL,
 )
 
+installation_store = build_installation_store()
+state_store = build_state_store()
+
+def save_installed_team(args):
+  # Store the workspace with its name, domain and enterprise as soon as the app is installed
+  installation = args.installation
+  if installation.team_id:
+    ensure_workspace_exists(installation.team_id, team_name=installation.team_name)
+    refresh_team_metadata(installation.team_id, WebClient(token=installation.bot_token, base_url=SLACK_API_URL))
+  return args.default.success(args)
+
+def install_failed(args):
+  return args.default.failure(args)
+
 oauth_settings = OAuthSettings(
     client_id=tokens.client_id,
     client_secret=tokens.client_secret,
@@ -48,15 +88,62 @@ oauth_settings = OAuthSettings(
         "users:read",
         "team:read"
     ],
-    installation_store=FileInstallationStore(base_dir="./data/installations"),
-    state_store=FileOAuthStateStore(expiration_seconds=600, base_dir="./data/states")
+    installation_store=installation_store,
+    state_store=state_store,
+    callback_options=CallbackOptions(success=save_installed_team, failure=install_failed)
 )
 
+# Same as Bolt's default authorize, but remembers auth.test results instead of calling it on every event
+authorize = InstallationStoreAuthorize(
+    logger=logging.getLogger("slack_bolt.App"),
+    installation_store=installation_store,
+    client_id=tokens.client_id,
+    client_secret=tokens.client_secret,
+    cache_enabled=True,
+)
+
+# Bolt's default, created here so its backlog can be reported in /metrics
+listener_executor = ThreadPoolExecutor(max_workers=5)
+register_queue("listeners", lambda: listener_executor._work_queue.qsize())
+register_queue("export_jobs", lambda: get_export_queue().queued_count())
+
+# Export jobs run outside of any request, so they get clients from the installation store
+export_client_pool = SlackClientPool(installation_store, base_url=SLACK_API_URL)
+export_logger = logging.getLogger("export_jobs")
+
 app = App(
     signing_secret=tokens.client_signing_secret,
     oauth_settings=oauth_settings,
+    authorize=authorize,
+    # Bolt copies this client's base_url into the client it creates for each request
+    client=WebClient(base_url=SLACK_API_URL),
+    listener_executor=listener_executor,
     name="check-in-bot"
 )
+# Delete stored installations (and their cached copies) on app_uninstalled / tokens_revoked
+app.enable_token_revocation_listeners()
+
+@app.middleware
+def count_requests(body, next):
+  record_event(body)
+  return next()
+
+@app.middleware
+def drop_ignorable_events(body, next):
+  # Acknowledge events the bot never acts on before any listener, store or Slack call runs
+  reason = ignorable_reason(body)
+  if reason:
+    if reason in ("message_changed", "message_deleted"):
+      archive_message_change(body)
+    record_dropped_event(reason)
+    return BoltResponse(status=200, body="")
+  return next()
+
+@app.middleware
+def record_slack_api_calls(context, next):
+  # Bolt creates a plain WebClient for each request; swap in one that records its calls for /metrics
+  context["client"] = instrument_client(context.client)
+  return next()
 
 
 MONTHS = [
@@ -85,6 +172,39 @@ def is_dm(event):
   if "channel_type" in event.keys() and event["channel_type"] == "im":
     return True
 
+def ignorable_reason(body):
+  """Why a request can be dropped without running any listener, or None
+
+  Only checks the payload itself, so it's cheap enough to run on every event.
+  """
+  event = body.get("event") or {}
+  if body.get("type") != "event_callback" or event.get("type") != "message":
+    return None
+  subtype = event.get("subtype")
+  if subtype in ("message_changed", "message_deleted"):
+    return subtype
+  if subtype == "bot_message" or event.get("bot_id"):
+    return "bot_message"
+  if subtype in NO_REACT_EVENTS:
+    return subtype
+  if event.get("hidden"):
+    return "hidden"
+  # DMs without text still get a reply explaining what the bot can do
+  if "text" not in event and not is_dm(event):
+    return "no_text"
+  return None
+
+def archive_message_change(body):
+  """Apply an edit or deletion to the archived message, so exports answered from the archive match Slack"""
+  event = body["event"]
+  team_id = event.get("team") or body.get("team_id")
+  if not team_id or not event.get("channel"):
+    return
+  try:
+    get_archive().record_change(team_id, event["channel"], event)
+  except Exception as e:
+    logging.error(f"Error archiving {event.get('subtype')} in {event['channel']}: {repr(e)}")
+
 def extract_channel(message):
   # Handle Slack's channel mention format: <#C12345|channel-name>
   if message.startswith("<#") and ">" in message:
@@ -98,62 +218,152 @@ def extract_channel(message):
     return message
   return ""
 
-def get_check_ins(client, event, logger, channel_id):
+def get_check_ins(client, event, logger, channel_id, oldest=None, latest=None, export_format="txt", job=None):
   try:
     channel_info = client.conversations_info(
       channel=channel_id,
     )
     channel_name = channel_info.data['channel']['name']
-    message_data = client.conversations_history(
-      channel=channel_id,
-      limit=10
-    )
-    check_in_entries = []
-    parse_messages(check_in_entries, message_data, event['user'])
-    while message_data["has_more"]:
-      cursor = message_data["response_metadata"]["next_cursor"]
-      message_data = client.conversations_history(
-        channel=channel_id,
-        limit=10,
-        cursor=cursor,
+    check_ins = iter_archived_check_ins(client, event['team'], channel_id, event['user'], oldest, latest, job=job)
+    date_range = describe_date_range(oldest, latest)
+    # written and uploaded a check-in at a time, so long histories don't fill the worker's memory
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, f"{channel_name}_check-ins.{export_format}")
+      with open(path, "w", encoding="utf-8", newline="") as file:
+        write_check_ins(file, check_ins, export_format, title=f"{channel_name} entries")
+      upload_file(
+        client,
+        path,
+        channel=event["channel"],
+        title=f"{channel_name} entries",
+        initial_comment=f"Here are all the entries you wrote in {channel_name}{date_range}:",
       )
-      parse_messages(check_in_entries, message_data, event['user'])
-    # put entries in chronological order
-    check_in_entries.reverse()
-    check_ins_string = "\n\n".join(entry for entry in check_in_entries)
-    client.files_upload_v2(
-      channel=event["channel"],
-      title=f"{channel_name} entries",
-      filename=f"{channel_name}_check-ins.txt",
-      content=check_ins_string,
-      initial_comment=f"Here are all the entries you wrote in {channel_name}:",
-    )
+    if job:
+      job.report_progress(client, f"Your export from {channel_name}{date_range} is done!", force=True)
   except Exception as e:
     logger.error(f"Error getting entries from channel: {repr(e)}")
+    text = "Sorry, I wasn't able to get your entries from that channel. I need to be added to a channel to be able to see it. Can you check to make sure I'm there, under Integrations?"
+    if job:
+      # the job is recorded as failed, with the user told in its progress message
+      job.report_progress(client, text, force=True)
+      raise
     try:
+      client.chat_postMessage(channel=event["channel"], text=text)
+    except Exception as e:
+      logger.error(f"Error posting about inability to get entries from channel: {repr(e)}")
+
+def get_check_ins_bundle(client, event, logger, channels, oldest=None, latest=None, export_format="txt", job=None):
+  """Upload a zip of the user's check-ins and thread replies from several channels, with a progress message per channel"""
+  date_range = describe_date_range(oldest, latest)
+  try:
+    if job:
+      job.report_progress(client, f"Getting your entries from {len(channels)} channels{date_range}. I'll let you know as each one is done.", force=True)
+    else:
       client.chat_postMessage(
         channel=event["channel"],
-        text="Sorry, I wasn't able to get your entries from that channel. I need to be added to a channel to be able to see it. Can you check to make sure I'm there, under Integrations?"
+        text=f"Getting your entries from {len(channels)} channels{date_range}. I'll let you know as each one is done."
       )
+    # channels a resumed job had already finished count as done
+    finished = len(job.checkpoint.get("channels", {})) if job else 0
+
+    def report_channel(channel, check_ins, error):
+      nonlocal finished
+      finished += 1
+      name = f"#{channel['name']}" if "name" in channel else f"<#{channel['id']}>"
+      if error:
+        text = f"I couldn't get your entries from {name}, so it's not in the zip. I need to be added to a channel to be able to see it."
+      else:
+        text = f"Got {len(check_ins)} entries from {name} ({finished}/{len(channels)})"
+      client.chat_postMessage(channel=event["channel"], text=text)
+
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, "check-ins.zip")
+      total = export_bundle(client, event["team"], event["user"], channels, path, oldest, latest, report_channel, export_format, job)
+      upload_file(
+        client,
+        path,
+        channel=event["channel"],
+        title="check-in entries",
+        initial_comment=f"Here are all {total} entries you wrote in those channels{date_range}, including thread replies, one file per channel:",
+      )
+  except Exception as e:
+    logger.error(f"Error exporting entries from several channels: {repr(e)}")
+    text = "Sorry, I wasn't able to put together your entries from those channels. Please try again in a few minutes."
+    if job:
+      job.report_progress(client, text, force=True)
+      raise
+    try:
+      client.chat_postMessage(channel=event["channel"], text=text)
     except Exception as e:
-      logger.error(f"Error posting about inability to get entries from channel: {repr(e)}")
+      logger.error(f"Error posting about inability to export several channels: {repr(e)}")
 
-def parse_messages(check_in_entries, message_data, user):
-  # threaded replies are not included in conversation history by default
-  messages = message_data["messages"]
-  for message in messages:
-    if message["user"] == user:
-      if "subtype" not in message.keys() or message["subtype"] != "channel_join":
-        timestamp = int(message["ts"].split(".")[0])
-        readable_date = datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-        check_in_entries.append(message["text"])
-        check_in_entries.append(readable_date)
+def queue_export(client, event, logger, params):
+  """Queue an export job (see export_jobs.py) and tell the user right away; the job edits that message as it goes"""
+  date_range = describe_date_range(params.get("oldest"), params.get("latest"))
+  try:
+    ack = client.chat_postMessage(
+      channel=event["channel"],
+      text=f"Got it! I'm putting together your entries{date_range}. I'll update this message as I go."
+    )
+    job_id = get_export_queue().submit(event["team"], event["user"], event["channel"], params, progress_ts=ack["ts"])
+    if job_id is None:
+      client.chat_update(
+        channel=event["channel"],
+        ts=ack["ts"],
+        text=f"You already have {MAX_QUEUED_JOBS_PER_USER} exports waiting. Please try again once they've arrived."
+      )
+      return
+    logger.info(f"Queued export job {job_id} for {event['user']}")
+    start_export_workers(run_export_job, report_abandoned_export)
+    wake_export_workers()
+  except Exception as e:
+    logger.error(f"Error queueing export: {repr(e)}")
+
+def run_export_job(job):
+  client = export_client_pool.get_client(job.team_id)
+  if client is None:
+    raise RuntimeError(f"No installation for {job.team_id}")
+  # what the export functions need from the DM that asked for it
+  event = {"team": job.team_id, "user": job.user_id, "channel": job.channel_id}
+  params = job.params
+  if params["kind"] == "bundle":
+    get_check_ins_bundle(client, event, export_logger, params["channels"], params["oldest"], params["latest"], params["format"], job)
+  else:
+    get_check_ins(client, event, export_logger, params["channel_id"], params["oldest"], params["latest"], params["format"], job)
+
+def report_abandoned_export(job):
+  client = export_client_pool.get_client(job.team_id)
+  if client is not None:
+    job.report_progress(client, "Sorry, your export kept getting interrupted, so I've stopped trying. Please ask me again in a few minutes.", force=True)
+
+def is_intro_thread_parent(parent_message):
+  # the welcome message asking for intros in thread starts with "Welcome to <Month>!"
+  if parent_message.startswith("Welcome to"):
+    words = parent_message.split()
+    if len(words) > 3 and words[2].translate(str.maketrans('', '', string.punctuation)) in MONTHS:
+      return True
+  return False
+
+def parse_emoji_reply(reply, logger):
+  reply = reply.strip().strip(":")
+  emojis = re.split(r':\s*:*', reply)
+
+  # Filter out empty strings and validate emoji names
+  valid_emojis = [emoji for emoji in emojis if emoji and len(emoji) > 0]
+
+  if not valid_emojis:
+    logger.error(f"No valid emojis extracted from Claude response: {reply}")
+    return None
+
+  return valid_emojis
 
 def should_react(client, event, logger):
   # don't react to messages in announcement channel
-  ensure_workspace_exists(event["team"], client)
-  logger.info(f"DEBUG: get_workspace_info(event['team']): {get_workspace_info(event['team'])}")
-  if "announcement_channel" in get_workspace_info(event['team']) and event["channel"] == get_workspace_info(event['team'])["announcement_channel"]:
+  with span("load_workspace"):
+    ensure_workspace_exists(event["team"], client)
+    workspace_info = get_workspace_info(event['team'])
+  logger.info(f"DEBUG: get_workspace_info(event['team']): {workspace_info}")
+  if "announcement_channel" in workspace_info and event["channel"] == workspace_info["announcement_channel"]:
     return False
   if "text" not in event.keys():
     return False
@@ -173,46 +383,46 @@ def should_react(client, event, logger):
       ts=event["thread_ts"],
       limit=1,
     )
-    parent_message = parent["messages"][0]["text"]
     # we want to emoji react to introduction messages in the welcome thread
-    if parent_message.startswith("Welcome to"):
-      words = parent_message.split()
-      if len(words) > 3 and words[2].translate(str.maketrans('', '', string.punctuation)) in MONTHS:
-        return True
+    if is_intro_thread_parent(parent["messages"][0]["text"]):
+      return True
   except Exception as e:
     logger.error(f"Error checking if threaded message is an intro: {repr(e)}")
   return False
 
-def get_emojis(client, event, logger):
+def get_emojis(client, event, logger, stage_span=None):
+  text = preprocess_check_in(event["text"])
+  if stage_span:
+    stage_span.set(text_chars=len(event["text"]), preprocessed_chars=len(text))
+  if not text:
+    logger.info("Nothing left to react to after preprocessing message")
+    return None
+  model = DEFAULT_MODEL
+  if MODEL_ROUTING_ENABLED:
+    workspace = get_workspace_info(event["team"]) or {}
+    model = choose_model(text, workspace.get("model_tier"))
   try:
-    message = ai_client.messages.create(
-        model="claude-sonnet-4-6",
-        max_tokens=200,
-        system="You are an emoji assistant. You respond to all messages with a single line representing four unique emojis, formatted for Slack. The emojis should represent things mentioned in the messages, with only zero or one emojis representing sentiment. Note that text surrounded by ~ or where the line starts or ends with a negative emoji like :no_pedestrians: or :heavy_multiplication_x: means that the task mentioned there was not completed - please exclude these lines from your emoji output. If the messages express deep sadness or high stress or mention anything related to death of people or animals, please use :people_hugging: to express comfort instead of something more specific for that part of the text. For example if someone's relative died please react with a hug instead of with an emoji representing the relative or death. Also, please use ungendered emojis, for example, :cook: is preferred over :female-cook: or :male-cook:",
-        messages=[
-          {
-            "role": "user",
-            "content": event["text"]
-          },
-        ],
-    )
+    with track_model_call(model) as usage, span("claude", model=model) as claude_span:
+      message = ai_client.messages.create(
+          model=model,
+          max_tokens=200,
+          system=EMOJI_SYSTEM_PROMPT,
+          messages=[
+            {
+              "role": "user",
+              "content": text
+            },
+          ],
+      )
+      usage["input_tokens"] = message.usage.input_tokens
+      usage["output_tokens"] = message.usage.output_tokens
+      claude_span.set(input_tokens=message.usage.input_tokens, output_tokens=message.usage.output_tokens)
     # Validate response structure
     if not message.content or not message.content[0].text:
       logger.error("Empty or invalid response from Claude")
       return None
 
-    reply = message.content[0].text
-    reply = reply.strip().strip(":")
-    emojis = re.split(r':\s*:*', reply)
-
-    # Filter out empty strings and validate emoji names
-    valid_emojis = [emoji for emoji in emojis if emoji and len(emoji) > 0]
-
-    if not valid_emojis:
-      logger.error(f"No valid emojis extracted from Claude response: {reply}")
-      return None
-
-    return valid_emojis
+    return parse_emoji_reply(message.content[0].text, logger)
   except Exception as e:
     logger.error(f"Error getting emojis from Claude: {repr(e)}")
     return None
@@ -232,360 +442,246 @@ def post_emojis(client, event, logger, emojis):
     except Exception as e:
       logger.error(f"Error publishing {emoji} emoji react: {repr(e)}")
 
+def is_workspace_admin(team_id, user_id):
+  workspace = get_workspace_info(team_id)
+  return bool(workspace) and user_id in workspace.get("admins", [])
+
 def handle_admin_request(client, event, logger):
-    """Handle 'king me' messages and admin verification"""
-    logger.info(f"RUTH DEBUG: received admin request")
-    text = event.get("text", "").strip().lower()
-
-    if text == "king me":
-        passcode = generate_admin_passcode(event["team"], event["user"])
-        logger.info(f"Generating admin passcode for {event['user']} in team {event['team']}: {passcode}")
-        client.chat_postMessage(
-            channel=event["channel"],
-            text=f"Please verify that you want to become an administrator by replying with the passcode seen in the server logs."
-        )
-        return True
-    # Check if it's a passcode verification attempt
-    if text.isdigit() and len(text) == 6:
-        if verify_admin_passcode(event["team"], event["user"], text):
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="✅ Verification successful! You are now an administrator."
-            )
-        else:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="❌ Invalid or expired passcode. Please try 'king me' again if you want to become an administrator."
-            )
-        return True
-    
-    # Check if user is an admin for admin-only commands
-    workspace = get_workspace_info(event["team"])
-    if not workspace or "admins" not in workspace or event["user"] not in workspace["admins"]:
-        if text.startswith("keep apart") or text.startswith("set channel format") or text.startswith("set announcement") or text.startswith("set auto-add") or text.startswith("always include") or text.startswith("remove from always include"):
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="❌ Only administrators can use this command."
-            )
-            return True
-        return False
-    
-    # Handle always include commands
-    if text.startswith("always include"):
-        # Extract user IDs from mentions (format: <@U123ABC>)
-        mentions = re.findall(r'<@([A-Z0-9]+)>', event["text"])
-        if len(mentions) == 0:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="❌ Please mention at least one user to always include, like: always include @user1 @user2"
-            )
-            return True
-            
-        success_messages = []
-        error_messages = []
-        for user_id in mentions:
-            success, message = add_always_include_user(event["team"], user_id)
-            if success:
-                success_messages.append(message)
-            else:
-                error_messages.append(message)
-        
-        response = ""
-        if success_messages:
-            response += "✅ " + "\n".join(success_messages) + "\n"
-        if error_messages:
-            response += "❌ " + "\n".join(error_messages)
-            
-        client.chat_postMessage(
-            channel=event["channel"],
-            text=response.strip()
-        )
-        return True
-    
-    # Handle remove from always include commands
-    if text.startswith("remove from always include"):
-        # Extract user IDs from mentions (format: <@U123ABC>)
-        mentions = re.findall(r'<@([A-Z0-9]+)>', event["text"])
-        if len(mentions) == 0:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="❌ Please mention at least one user to remove from always include list, like: remove from always include @user1 @user2"
-            )
-            return True
-            
-        success_messages = []
-        error_messages = []
-        for user_id in mentions:
-            success, message = remove_always_include_user(event["team"], user_id)
-            if success:
-                success_messages.append(message)
-            else:
-                error_messages.append(message)
-        
-        response = ""
-        if success_messages:
-            response += "✅ " + "\n".join(success_messages) + "\n"
-        if error_messages:
-            response += "❌ " + "\n".join(error_messages)
-            
-        client.chat_postMessage(
-            channel=event["channel"],
-            text=response.strip()
-        )
-        return True
-    
-    # Handle keep apart command
-    if text.startswith("keep apart"):
-        # Extract user IDs from mentions (format: <@U123ABC>)
-        mentions = re.findall(r'<@([A-Z0-9]+)>', event["text"])
-        if len(mentions) != 2:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="Please mention exactly two users to keep apart, like: keep apart @user1 @user2"
-            )
-            return True
-
-        success, error = add_incompatible_pair(event["team"], mentions[0], mentions[1])
-        if success:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text=f"<@{mentions[0]}> and <@{mentions[1]}> will be kept apart in future check-in groups."
-            )
-        else:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text=f"Could not add keep-apart rule: {error}"
-            )
-        return True
-
-    # Handle keep together command
-    if text.startswith("keep together"):
-        # Extract user IDs from mentions (format: <@U123ABC>)
-        mentions = re.findall(r'<@([A-Z0-9]+)>', event["text"])
-        if len(mentions) != 2:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="Please mention exactly two users to keep together, like: keep together @user1 @user2"
-            )
-            return True
-
-        success, error = add_compatible_pair(event["team"], mentions[0], mentions[1])
-        if success:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text=f"<@{mentions[0]}> and <@{mentions[1]}> will be kept together in future check-in groups."
-            )
-        else:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text=f"Could not add keep-together rule: {error}"
-            )
-        return True
-
-    # Handle remove keep apart command
-    if text.startswith("remove keep apart"):
-        mentions = re.findall(r'<@([A-Z0-9]+)>', event["text"])
-        if len(mentions) != 2:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="Please mention exactly two users to remove from keep-apart, like: remove keep apart @user1 @user2"
-            )
-            return True
-
-        success, message = remove_incompatible_pair(event["team"], mentions[0], mentions[1])
-        client.chat_postMessage(channel=event["channel"], text=message)
-        return True
-
-    # Handle remove keep together command
-    if text.startswith("remove keep together"):
-        mentions = re.findall(r'<@([A-Z0-9]+)>', event["text"])
-        if len(mentions) != 2:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="Please mention exactly two users to remove from keep-together, like: remove keep together @user1 @user2"
-            )
-            return True
-
-        success, message = remove_compatible_pair(event["team"], mentions[0], mentions[1])
-        client.chat_postMessage(channel=event["channel"], text=message)
-        return True
-
-    # Handle auto-add setting
-    if text.startswith("set auto-add"):
-        setting = text[len("set auto-add"):].strip().lower()
-        
-        if setting == "on" or setting == "enable" or setting == "true":
-            update_auto_add_setting(event["team"], True)
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="✅ Auto-add active users has been *enabled*. Users who posted in the previous month's channels will be automatically added to new channels."
-            )
-            return True
-        elif setting == "off" or setting == "disable" or setting == "false":
-            update_auto_add_setting(event["team"], False)
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="✅ Auto-add active users has been *disabled*. Users will need to explicitly opt-in via reactions to be added to new channels."
-            )
-            return True
-        else:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="❌ Invalid auto-add setting. Please use `set auto-add on` or `set auto-add off`."
-            )
-            return True
-    
-    # Handle set format command
-    if text.startswith("set channel format"):
-        new_format = event["text"][len("set channel format"):].strip()
-        if not new_format:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="❌ Please provide a format string, like: `set channel format check-ins-[year]-[month]` or `set channel format builders-standups-[year]-[month]`"
-            )
-        success, error = update_channel_format(event["team"], new_format)
-        if success:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text=f"✅ Channel format updated to: {new_format}"
-            )
-        else:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text=f"❌ Invalid format: {error}\nFormat must include [year] and [month]."
-            )
-        return True
-            
-    if text.startswith("set announcement"):
-        command_text = event["text"][len("set announcement"):].strip()
-        announcement_command = command_text.split()[0]
-        if announcement_command == "channel":
-            # Extract channel ID from mention (format: <#C123ABC>)
-            channel_mention = re.search(r'<#([A-Z0-9]+)\|?[^>]*>', event["text"])
-            if not channel_mention:
-                client.chat_postMessage(
-                    channel=event["channel"],
-                    text="❌ Please mention a channel, like: set announcement #general"
-                )
-                return True
-                
-            channel_id = channel_mention.group(1)
-            if update_announcement_channel(event["team"], channel_id):
-                client.chat_postMessage(
-                    channel=event["channel"],
-                    text=f"✅ Announcement channel set to <#{channel_id}>"
-                )
-            else:
-                client.chat_postMessage(
-                    channel=event["channel"],
-                    text="❌ Failed to update announcement channel."
-                )
-            return True
-        elif announcement_command == "link":
-            # Extract a Slack message link
-            # Format should be like: https://team-name.slack.com/archives/C0123456789/p1234567890123456
-            link_pattern = re.search(r'(https?://[^/]+/archives/([A-Z0-9]+)/p(\d+))', event["text"])
-            if not link_pattern:
-                client.chat_postMessage(
-                    channel=event["channel"],
-                    text="❌ Please provide a valid Slack message link. Example: set announcement link https://workspace.slack.com/archives/C0123456789/p1234567890123456"
-                )
-                return True
-                
-            message_link = link_pattern.group(1)
-            channel_id = link_pattern.group(2)
-            message_ts = link_pattern.group(3)
-            
-            # Convert the timestamp format from Slack link to Slack API format
-            # Slack links use format p1234567890123456, but the API needs 1234567890.123456
-            if len(message_ts) >= 13:  # Ensure enough digits
-                message_ts = message_ts[:10] + "." + message_ts[10:]
-            
-            # Update the workspace info with the announcement timestamp
-            update_announcement_timestamp(event["team"], channel_id, message_ts)
-            
-            client.chat_postMessage(
-                channel=event["channel"],
-                text=f"✅ Last announcement message has been set to: <{message_link}|View announcement>"
-            )
-            return True
-        elif announcement_command == "tag":
-            try:
-
-                # Extract the announcement text from the command
-                tag_type = command_text[len("tag"):].strip()
-                if not tag_type or (tag_type != "here" and tag_type != "channel"):
-                    client.chat_postMessage(
-                        channel=event["channel"], text="❌ Please provide the kind of tagging you want your announcement to do. Either here or channel. Usage: `set announcement tag here` or `set announcement tag channel`"
-                    )
-                    return True
-
-                update_announcement_tag(event["team"], tag_type)
-                
-                client.chat_postMessage(
-                    channel=event["channel"],
-                    text=f"✅ Custom announcement tag has been updated to {tag_type}!"
-                )
-                
-            except Exception as e:
-                logging.error(f"Error setting announcement tag: {e}")
-                client.chat_postMessage(
-                    channel=event["channel"],
-                    text="❌ Sorry, there was an error setting the announcement tag: {e}"
-                )
-
-        elif announcement_command == "text":
-            new_text = command_text[len("text"):].strip()
-            if not new_text:
-                client.chat_postMessage(
-                    channel=event["channel"],
-                    text="❌ Please provide a text, like: set announcement text [Your text here]"
-                )
-                return True
-                
-            update_custom_announcement(event["team"], new_text)
-            client.chat_postMessage(
-                channel=event["channel"],
-                text=f"✅ Announcement text set to {new_text}"
-            )
-        else:
-            client.chat_postMessage(
-                channel=event["channel"],
-                text="❌ Invalid announcement command. Valid commands are channel, tag, and text."
-            )
-        return True
-    return False
+  """Handle 'king me' messages, admin verification and admin commands (see admin_commands.py)"""
+  logger.info(f"RUTH DEBUG: received admin request")
+  return dispatch_admin_command(client, event, logger, is_workspace_admin)
+
+def reply_with_results(client, event, results):
+  # results of a command applied to each mentioned user, as (success, message)
+  success_messages = [message for success, message in results if success]
+  error_messages = [message for success, message in results if not success]
+  response = ""
+  if success_messages:
+    response += "✅ " + "\n".join(success_messages) + "\n"
+  if error_messages:
+    response += "❌ " + "\n".join(error_messages)
+  reply(client, event, response.strip())
+
+@admin_command("king me", admin_only=False, exact=True)
+def king_me(client, event, logger):
+  passcode = generate_admin_passcode(event["team"], event["user"])
+  logger.info(f"Generating admin passcode for {event['user']} in team {event['team']}: {passcode}")
+  reply(client, event, "Please verify that you want to become an administrator by replying with the passcode seen in the server logs.")
+
+@admin_command("passcode", admin_only=False, pattern=r"\d{6}")
+def verify_passcode(client, event, logger):
+  if verify_admin_passcode(event["team"], event["user"], event["text"].strip()):
+    reply(client, event, "✅ Verification successful! You are now an administrator.")
+  else:
+    reply(client, event, "❌ Invalid or expired passcode. Please try 'king me' again if you want to become an administrator.")
+
+@admin_command("always include", args=[user_mentions(usage="❌ Please mention at least one user to always include, like: always include @user1 @user2")])
+def always_include(client, event, logger, user_ids):
+  reply_with_results(client, event, [add_always_include_user(event["team"], user_id) for user_id in user_ids])
+
+@admin_command("remove from always include", args=[user_mentions(usage="❌ Please mention at least one user to remove from always include list, like: remove from always include @user1 @user2")])
+def remove_from_always_include(client, event, logger, user_ids):
+  reply_with_results(client, event, [remove_always_include_user(event["team"], user_id) for user_id in user_ids])
+
+@admin_command("keep apart", args=[user_mentions(2, usage="Please mention exactly two users to keep apart, like: keep apart @user1 @user2")])
+def keep_apart(client, event, logger, user_ids):
+  success, error = add_incompatible_pair(event["team"], user_ids[0], user_ids[1])
+  if success:
+    reply(client, event, f"<@{user_ids[0]}> and <@{user_ids[1]}> will be kept apart in future check-in groups.")
+  else:
+    reply(client, event, f"Could not add keep-apart rule: {error}")
+
+@admin_command("keep together", args=[user_mentions(2, usage="Please mention exactly two users to keep together, like: keep together @user1 @user2")])
+def keep_together(client, event, logger, user_ids):
+  success, error = add_compatible_pair(event["team"], user_ids[0], user_ids[1])
+  if success:
+    reply(client, event, f"<@{user_ids[0]}> and <@{user_ids[1]}> will be kept together in future check-in groups.")
+  else:
+    reply(client, event, f"Could not add keep-together rule: {error}")
+
+@admin_command("remove keep apart", args=[user_mentions(2, usage="Please mention exactly two users to remove from keep-apart, like: remove keep apart @user1 @user2")])
+def remove_keep_apart(client, event, logger, user_ids):
+  success, message = remove_incompatible_pair(event["team"], user_ids[0], user_ids[1])
+  reply(client, event, message)
+
+@admin_command("remove keep together", args=[user_mentions(2, usage="Please mention exactly two users to remove from keep-together, like: remove keep together @user1 @user2")])
+def remove_keep_together(client, event, logger, user_ids):
+  success, message = remove_compatible_pair(event["team"], user_ids[0], user_ids[1])
+  reply(client, event, message)
+
+@admin_command("set auto-add", args=[rest_of_text(lower=True)])
+def set_auto_add(client, event, logger, setting):
+  if setting in ("on", "enable", "true"):
+    update_auto_add_setting(event["team"], True)
+    reply(client, event, "✅ Auto-add active users has been *enabled*. Users who posted in the previous month's channels will be automatically added to new channels.")
+  elif setting in ("off", "disable", "false"):
+    update_auto_add_setting(event["team"], False)
+    reply(client, event, "✅ Auto-add active users has been *disabled*. Users will need to explicitly opt-in via reactions to be added to new channels.")
+  else:
+    reply(client, event, "❌ Invalid auto-add setting. Please use `set auto-add on` or `set auto-add off`.")
+
+@admin_command("set model tier", args=[rest_of_text(lower=True)])
+def set_model_tier(client, event, logger, tier):
+  success, error = update_model_tier(event["team"], tier)
+  if success:
+    reply(client, event, f"✅ Emoji reaction model tier set to *{tier}*.")
+  else:
+    reply(client, event, f"❌ {error}. Use `set model tier fast`, `set model tier balanced` or `set model tier best`.")
+
+# profile events N, profile seconds N, profile stop
+@admin_command("profile", args=[rest_of_text(lower=True)])
+def profile(client, event, logger, args):
+  args = args.split()
+  if args == ["stop"]:
+    if get_session() is not None:
+      stop_profiling()
+      return
+    response = "Profiling isn't running in this worker."
+  elif len(args) == 2 and args[0] in ("events", "seconds") and args[1].isdigit():
+    count = int(args[1])
+    if args[0] == "events":
+      success, response = start_profiling(client, event["channel"], max_events=count)
+    else:
+      success, response = start_profiling(client, event["channel"], max_seconds=count)
+    response = ("✅ " if success else "❌ ") + response
+  else:
+    response = "❌ Use `profile events 50` to profile the next 50 events, `profile seconds 60` to profile for a minute, or `profile stop`."
+  reply(client, event, response)
+
+@admin_command("set channel format", args=[rest_of_text(required=True, usage="❌ Please provide a format string, like: `set channel format check-ins-[year]-[month]` or `set channel format builders-standups-[year]-[month]`")])
+def set_channel_format(client, event, logger, new_format):
+  success, error = update_channel_format(event["team"], new_format)
+  if success:
+    reply(client, event, f"✅ Channel format updated to: {new_format}")
+  else:
+    reply(client, event, f"❌ Invalid format: {error}\nFormat must include [year] and [month].")
+
+@admin_command("set announcement channel", args=[channel_mention(usage="❌ Please mention a channel, like: set announcement #general")])
+def set_announcement_channel(client, event, logger, channel_id):
+  if update_announcement_channel(event["team"], channel_id):
+    reply(client, event, f"✅ Announcement channel set to <#{channel_id}>")
+  else:
+    reply(client, event, "❌ Failed to update announcement channel.")
+
+@admin_command("set announcement link")
+def set_announcement_link(client, event, logger):
+  # Format should be like: https://team-name.slack.com/archives/C0123456789/p1234567890123456
+  link_pattern = re.search(r'(https?://[^/]+/archives/([A-Z0-9]+)/p(\d+))', event["text"])
+  if not link_pattern:
+    raise CommandUsageError("❌ Please provide a valid Slack message link. Example: set announcement link https://workspace.slack.com/archives/C0123456789/p1234567890123456")
+  message_link = link_pattern.group(1)
+  channel_id = link_pattern.group(2)
+  message_ts = link_pattern.group(3)
+  # Slack links use format p1234567890123456, but the API needs 1234567890.123456
+  if len(message_ts) >= 13:
+    message_ts = message_ts[:10] + "." + message_ts[10:]
+  update_announcement_timestamp(event["team"], channel_id, message_ts)
+  reply(client, event, f"✅ Last announcement message has been set to: <{message_link}|View announcement>")
+
+@admin_command("set announcement tag", args=[rest_of_text()])
+def set_announcement_tag(client, event, logger, tag_type):
+  if tag_type not in ("here", "channel"):
+    raise CommandUsageError("❌ Please provide the kind of tagging you want your announcement to do. Either here or channel. Usage: `set announcement tag here` or `set announcement tag channel`")
+  try:
+    update_announcement_tag(event["team"], tag_type)
+    reply(client, event, f"✅ Custom announcement tag has been updated to {tag_type}!")
+  except Exception as e:
+    logging.error(f"Error setting announcement tag: {e}")
+    reply(client, event, f"❌ Sorry, there was an error setting the announcement tag: {e}")
+
+@admin_command("set announcement text", args=[rest_of_text(required=True, usage="❌ Please provide a text, like: set announcement text [Your text here]")])
+def set_announcement_text(client, event, logger, new_text):
+  update_custom_announcement(event["team"], new_text)
+  reply(client, event, f"✅ Announcement text set to {new_text}")
+
+@admin_command("set announcement")
+def set_announcement(client, event, logger):
+  # none of the set announcement subcommands above matched
+  reply(client, event, "❌ Invalid announcement command. Valid commands are channel, link, tag, and text.")
+
+def respond_to_dm(client, event, logger):
+  # Check for admin requests first
+  logger.info(f"RUTH DEBUG: received DM")
+  if handle_admin_request(client, event, logger):
+      return
+
+  channel_id = extract_channel(event['text'])
+  channel_ids = extract_channels(event['text'])
+  try:
+    months = parse_month_range(event['text'])
+    oldest, latest = parse_date_range(event['text']) if channel_id or months else (None, None)
+    export_format = parse_export_format(event['text'])
+  except ValueError:
+    client.chat_postMessage(
+      channel=event["channel"],
+      text="Sorry, I couldn't read those dates. Please write days as YYYY-MM-DD, like `from 2024-01-01 to 2024-03-31`, and months as YYYY-MM, like `months 2024-01 to 2024-06`."
+    )
+    return
+  # exports run in the background, so this listener's thread is free again right away
+  params = {"oldest": oldest, "latest": latest, "format": export_format}
+  if months:
+    channel_format = get_workspace_info(event["team"]).get("channel_format", "check-ins-[year]-[month]")
+    channels = find_month_channels(client, channel_format, months)
+    if channels:
+      queue_export(client, event, logger, dict(params, kind="bundle", channels=[{"id": channel["id"], "name": channel["name"]} for channel in channels]))
+    else:
+      client.chat_postMessage(channel=event["channel"], text="Sorry, I couldn't find any check-in channels for those months.")
+  elif len(channel_ids) > 1:
+    queue_export(client, event, logger, dict(params, kind="bundle", channels=[{"id": channel_id} for channel_id in channel_ids]))
+  # need to get the channel name for the month
+  elif channel_id:
+    queue_export(client, event, logger, dict(params, kind="channel", channel_id=channel_id))
+  else:
+    try:
+      client.chat_postMessage(
+        channel=event["channel"],
+        text="Sorry, I don't understand. You can send me the name of a channel (starting with #) and I will respond with a text file that has all your check-in entries from that channel. Add `from YYYY-MM-DD` and/or `to YYYY-MM-DD` to only get entries from those dates. To get a zip of your entries and thread replies from several channels, mention them all, or send `months YYYY-MM to YYYY-MM` or `year YYYY`. Add `as md`, `as csv` or `as json` for other file formats."
+      )
+    except Exception as e:
+      logger.error(f"Error posting about inability to parse channel: {repr(e)}")
 
 @app.event("reaction_added")
 def handle_reaction_added(body, logger):
   pass
 
+@app.event("team_rename")
+def handle_team_rename(context, event):
+  update_team_metadata(context.team_id, team_name=event["name"])
+
+@app.event("team_domain_change")
+def handle_team_domain_change(context, event):
+  update_team_metadata(context.team_id, domain=event["domain"])
+
+@app.event("user_change")
+@app.event("team_join")
+def update_user_directory(context, event):
+  # keeps names and admin status current without calling users.info
+  if get_user_directory().save_user(context.team_id, event["user"]):
+    # home views leave out deactivated admins
+    bump_settings_version(context.team_id)
+
 @app.event("message")
+@timed("respond_to_message")
+@profiled
 def respond_to_message(client, event, logger):
-  # direct messages to the bot are only used for extracting check ins
-  if is_dm(event):
-    # Check for admin requests first
-    logger.info(f"RUTH DEBUG: received DM")
-    if handle_admin_request(client, event, logger):
-        return
-    
-    channel_id = extract_channel(event['text'])
-    # need to get the channel name for the month
-    if channel_id:
-      get_check_ins(client, event, logger, channel_id)
-    else:
-      try:
-        client.chat_postMessage(
-          channel=event["channel"],
-          text="Sorry, I don't understand. You can send me the name of a channel (starting with #) and I will respond with a text file that has all your check-in entries from that channel."
-        )
-      except Exception as e:
-        logger.error(f"Error posting about inability to parse channel: {repr(e)}")
-    return
-  if should_react(client, event, logger):
-    emojis = get_emojis(client, event, logger)
-    if emojis is not None:
-      post_emojis(client, event, logger, emojis)
+  with span("message", team=event.get("team"), channel=event.get("channel"), subtype=event.get("subtype", ""), dm=bool(is_dm(event))):
+    # direct messages to the bot are only used for extracting check ins
+    if is_dm(event):
+      respond_to_dm(client, event, logger)
+      return
+    if event.get("team"):
+      with span("archive"):
+        get_archive().record_messages(event["team"], event["channel"], [event])
+    with span("should_react") as stage_span:
+      react = should_react(client, event, logger)
+      stage_span.set(react=react)
+    if react:
+      with span("get_emojis") as stage_span:
+        emojis = get_emojis(client, event, logger, stage_span)
+        stage_span.set(emojis=len(emojis or []))
+      if emojis is not None:
+        with span("post_emojis", emojis=len(emojis)):
+          post_emojis(client, event, logger, emojis)
 
 
 
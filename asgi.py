@@ -0,0 +1,14 @@
+from slack_bolt.adapter.asgi.async_handler import AsyncSlackRequestHandler
+from async_app import app as bolt_app
+from async_home_tab import register_async_home_tab_handlers
+
+# Register home tab handlers
+register_async_home_tab_handlers(bolt_app)
+
+# ASGI app serving /slack/events, e.g.
+# gunicorn -k uvicorn.workers.UvicornWorker --workers 2 --bind 127.0.0.1:3000 asgi:application
+application = AsyncSlackRequestHandler(bolt_app)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(application, port=3000)
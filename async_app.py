@@ -0,0 +1,201 @@
+import asyncio
+import importlib
+import logging
+from anthropic import AsyncAnthropic
+from slack_bolt.async_app import AsyncApp
+from slack_bolt.response import BoltResponse
+from slack_bolt.oauth.async_oauth_settings import AsyncOAuthSettings
+from slack_bolt.oauth.async_callback_options import AsyncCallbackOptions
+from slack_bolt.authorization.async_authorize import AsyncInstallationStoreAuthorize
+from slack_sdk import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
+from workspace_store import get_workspace_info, async_ensure_workspace_exists, ensure_workspace_exists, update_team_metadata, async_refresh_team_metadata, bump_settings_version
+from message_preprocessing import preprocess_check_in
+from model_routing import DEFAULT_MODEL, EMOJI_SYSTEM_PROMPT, choose_model, track_model_call
+from tracing import span
+from user_directory import get_user_directory
+from checkin_archive import get_archive
+from metrics import record_dropped_event
+from app import oauth_settings, installation_store, state_store, SLACK_API_URL, ANTHROPIC_BASE_URL, NO_REACT_EVENTS, MODEL_ROUTING_ENABLED, archive_message_change, ignorable_reason, is_dm, is_intro_thread_parent, parse_emoji_reply, respond_to_dm
+
+# Async counterparts of the handlers in app.py, served by asgi.py. Slack and
+# Claude calls are awaited so one process can have many events in flight;
+# DM commands and exports still run the sync code from app.py in a thread.
+
+tokens = importlib.import_module("tokens")
+
+ai_client = AsyncAnthropic(
+    api_key=tokens.anthropic_key,
+    base_url=ANTHROPIC_BASE_URL,
+)
+
+async def save_installed_team(args):
+  installation = args.installation
+  if installation.team_id:
+    await asyncio.to_thread(ensure_workspace_exists, installation.team_id, None, installation.team_name)
+    await async_refresh_team_metadata(installation.team_id, AsyncWebClient(token=installation.bot_token, base_url=SLACK_API_URL))
+  return await args.default.success(args)
+
+async def install_failed(args):
+  return await args.default.failure(args)
+
+async_oauth_settings = AsyncOAuthSettings(
+    client_id=tokens.client_id,
+    client_secret=tokens.client_secret,
+    scopes=oauth_settings.scopes,
+    installation_store=installation_store,
+    state_store=state_store,
+    callback_options=AsyncCallbackOptions(success=save_installed_team, failure=install_failed)
+)
+
+app = AsyncApp(
+    signing_secret=tokens.client_signing_secret,
+    oauth_settings=async_oauth_settings,
+    client=AsyncWebClient(base_url=SLACK_API_URL),
+    authorize=AsyncInstallationStoreAuthorize(
+        logger=logging.getLogger("slack_bolt.AsyncApp"),
+        installation_store=installation_store,
+        client_id=tokens.client_id,
+        client_secret=tokens.client_secret,
+        cache_enabled=True,
+    ),
+    name="check-in-bot"
+)
+app.enable_token_revocation_listeners()
+
+@app.middleware
+async def drop_ignorable_events(body, next):
+  # Same fast path as app.py
+  reason = ignorable_reason(body)
+  if reason:
+    if reason in ("message_changed", "message_deleted"):
+      await asyncio.to_thread(archive_message_change, body)
+    record_dropped_event(reason)
+    return BoltResponse(status=200, body="")
+  return await next()
+
+async def should_react(client, event, logger):
+  # don't react to messages in announcement channel
+  await async_ensure_workspace_exists(event["team"], client)
+  # the store is a pickle read from disk, so it's loaded off the event loop
+  workspace_info = await asyncio.to_thread(get_workspace_info, event["team"])
+  if "announcement_channel" in workspace_info and event["channel"] == workspace_info["announcement_channel"]:
+    return False
+  if "text" not in event.keys():
+    return False
+  if "subtype" in event and event["subtype"] in NO_REACT_EVENTS:
+    return False
+  def user_opted_out():
+    return event.get("user") in workspace_info.get("emoji_optout_users", [])
+
+  if "thread_ts" not in event.keys():
+    return not user_opted_out()
+  if ("subtype" in event and event["subtype"] == "thread_broadcast"):
+    return not user_opted_out()
+  # get parent message from thread_ts and check if it's the welcome message asking for intros in thread
+  try:
+    parent = await client.conversations_replies(
+      channel=event["channel"],
+      ts=event["thread_ts"],
+      limit=1,
+    )
+    if is_intro_thread_parent(parent["messages"][0]["text"]):
+      return True
+  except Exception as e:
+    logger.error(f"Error checking if threaded message is an intro: {repr(e)}")
+  return False
+
+async def get_emojis(event, logger):
+  text = preprocess_check_in(event["text"])
+  if not text:
+    logger.info("Nothing left to react to after preprocessing message")
+    return None
+  model = DEFAULT_MODEL
+  if MODEL_ROUTING_ENABLED:
+    workspace = await asyncio.to_thread(get_workspace_info, event["team"]) or {}
+    model = choose_model(text, workspace.get("model_tier"))
+  try:
+    with track_model_call(model) as usage, span("claude", model=model) as claude_span:
+      message = await ai_client.messages.create(
+          model=model,
+          max_tokens=200,
+          system=EMOJI_SYSTEM_PROMPT,
+          messages=[
+            {
+              "role": "user",
+              "content": text
+            },
+          ],
+      )
+      usage["input_tokens"] = message.usage.input_tokens
+      usage["output_tokens"] = message.usage.output_tokens
+      claude_span.set(input_tokens=message.usage.input_tokens, output_tokens=message.usage.output_tokens)
+    # Validate response structure
+    if not message.content or not message.content[0].text:
+      logger.error("Empty or invalid response from Claude")
+      return None
+
+    return parse_emoji_reply(message.content[0].text, logger)
+  except Exception as e:
+    logger.error(f"Error getting emojis from Claude: {repr(e)}")
+    return None
+
+async def post_emojis(client, event, logger, emojis):
+  async def add_reaction(emoji):
+    try:
+      await client.reactions_add(
+        channel=event["channel"],
+        timestamp=event["ts"],
+        name=f"{emoji}",
+      )
+      return True
+    except Exception as e:
+      logger.error(f"Error publishing {emoji} emoji react: {repr(e)}")
+      return False
+
+  # add up to 5 reactions at once, moving on to the next emojis if some fail
+  emoji_limit = 5
+  remaining = list(emojis)
+  while emoji_limit > 0 and remaining:
+    batch, remaining = remaining[:emoji_limit], remaining[emoji_limit:]
+    results = await asyncio.gather(*(add_reaction(emoji) for emoji in batch))
+    emoji_limit -= sum(results)
+
+@app.event("reaction_added")
+async def handle_reaction_added(body, logger):
+  pass
+
+@app.event("team_rename")
+async def handle_team_rename(context, event):
+  await asyncio.to_thread(update_team_metadata, context.team_id, team_name=event["name"])
+
+@app.event("team_domain_change")
+async def handle_team_domain_change(context, event):
+  await asyncio.to_thread(update_team_metadata, context.team_id, domain=event["domain"])
+
+@app.event("user_change")
+@app.event("team_join")
+async def update_user_directory(context, event):
+  if await asyncio.to_thread(get_user_directory().save_user, context.team_id, event["user"]):
+    await asyncio.to_thread(bump_settings_version, context.team_id)
+
+@app.event("message")
+async def respond_to_message(client, event, logger):
+  with span("message", team=event.get("team"), channel=event.get("channel"), subtype=event.get("subtype", ""), dm=bool(is_dm(event))):
+    # direct messages to the bot are only used for extracting check ins
+    if is_dm(event):
+      await asyncio.to_thread(respond_to_dm, WebClient(token=client.token, base_url=SLACK_API_URL), event, logger)
+      return
+    if event.get("team"):
+      with span("archive"):
+        await asyncio.to_thread(get_archive().record_messages, event["team"], event["channel"], [event])
+    with span("should_react") as stage_span:
+      react = await should_react(client, event, logger)
+      stage_span.set(react=react)
+    if react:
+      with span("get_emojis", text_chars=len(event["text"])) as stage_span:
+        emojis = await get_emojis(event, logger)
+        stage_span.set(emojis=len(emojis or []))
+      if emojis is not None:
+        with span("post_emojis", emojis=len(emojis)):
+          await post_emojis(client, event, logger, emojis)
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import traceback
+from slack_sdk.errors import SlackApiError
+from workspace_store import get_workspace_info, add_emoji_optout_user, remove_emoji_optout_user, get_emoji_optout_users, async_ensure_workspace_exists
+from user_directory import get_user_directory
+from home_tab import PUBLISH_WINDOW_SECONDS, build_home_view, cache_home_view, get_cached_home_view, home_view_role, home_view_version
+
+async def get_home_view(user_id: str, team_id: str, client) -> dict:
+    """Async version of home_tab.get_home_view for an AsyncWebClient"""
+    await async_ensure_workspace_exists(team_id, client)
+    workspace_info = await asyncio.to_thread(get_workspace_info, team_id)
+    if not workspace_info:
+        return build_home_view(user_id, workspace_info, [])
+    role = home_view_role(user_id, workspace_info)
+    version = home_view_version(workspace_info)
+    view = get_cached_home_view(team_id, role, version)
+    if view is not None:
+        return view
+
+    # Leave out admins who have since been deactivated
+    directory = get_user_directory()
+    admin_ids = await asyncio.to_thread(
+        lambda: [admin_id for admin_id in workspace_info["admins"] if not directory.is_deleted(team_id, admin_id)]
+    )
+    view = build_home_view(user_id, workspace_info, admin_ids)
+    cache_home_view(team_id, role, version, view)
+    return view
+
+async def publish_home_view(client, user_id: str, team_id: str, view_hash: str = None):
+    """Async version of home_tab.publish_home_view for an AsyncWebClient"""
+    view = await get_home_view(user_id, team_id, client)
+    try:
+        result = await client.views_publish(user_id=user_id, view=view, hash=view_hash)
+    except SlackApiError as e:
+        if e.response.get("error") != "hash_conflict":
+            raise
+        logging.info(f"Home tab for {user_id} changed since it was rendered, rendering again")
+        view = await get_home_view(user_id, team_id, client)
+        result = await client.views_publish(user_id=user_id, view=view)
+    return result.get("view", {}).get("hash")
+
+def toggle_emoji_optout(team_id: str, user_id: str):
+    """Opt a user out of emoji reactions, or back in; blocks on the workspace store, so run it in a thread"""
+    if user_id in get_emoji_optout_users(team_id):
+        remove_emoji_optout_user(team_id, user_id)
+    else:
+        add_emoji_optout_user(team_id, user_id)
+
+class AsyncHomeTabPublisher:
+    """Async version of home_tab.HomeTabPublisher; everything runs on the event loop, so no lock is needed"""
+
+    def __init__(self, window: float = PUBLISH_WINDOW_SECONDS):
+        self.window = window
+        self._open = {}
+        self._pending = {}
+        self._windows = set()
+
+    async def publish(self, client, user_id: str, team_id: str, view_hash: str = None):
+        key = (team_id, user_id)
+        if key in self._open:
+            self._pending[key] = (client, view_hash)
+            return
+        self._open[key] = None
+        await self._publish(key, client, view_hash)
+
+    async def _publish(self, key: tuple, client, view_hash: str):
+        team_id, user_id = key
+        try:
+            self._open[key] = await publish_home_view(client, user_id, team_id, view_hash)
+        except Exception as e:
+            logging.error(f"Error publishing home tab for {user_id}: {repr(e)}")
+            self._open[key] = None
+        task = asyncio.create_task(self._close_window(key))
+        self._windows.add(task)
+        task.add_done_callback(self._windows.discard)
+
+    async def _close_window(self, key: tuple):
+        await asyncio.sleep(self.window)
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            del self._open[key]
+            return
+        client, view_hash = pending
+        await self._publish(key, client, self._open[key] or view_hash)
+
+home_tab_publisher = AsyncHomeTabPublisher()
+
+def register_async_home_tab_handlers(app):
+    """Register the home tab event handlers on an AsyncApp"""
+
+    @app.event("app_home_opened")
+    async def update_home_tab(client, context, event, logger):
+        """Handle app home opened events"""
+        try:
+            # Check the event type
+            if event["tab"] != "home":
+                return
+            logger.info(f"Publishing home view for user {event['user']}")
+
+            await home_tab_publisher.publish(client, event["user"], context.team_id, event.get("view", {}).get("hash"))
+        except Exception as e:
+            logger.error(f"Error publishing home tab: {str(e)}")
+            logger.error(f"Full error details:\n{traceback.format_exc()}")
+            logger.error(f"Event object: {event}")
+
+    @app.action("toggle_emoji_optout")
+    async def handle_toggle_emoji_optout(ack, body, client, logger):
+        """Handle emoji reaction opt-out toggle button"""
+        await ack()
+        user_id = body["user"]["id"]
+        team_id = body["team"]["id"]
+
+        await asyncio.to_thread(toggle_emoji_optout, team_id, user_id)
+
+        await home_tab_publisher.publish(client, user_id, team_id, body.get("view", {}).get("hash"))
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Compare first-request latency of a cold-started and a warm-started web worker
+
+Usage: python boot_benchmark.py --team TEAM_ID --channel CHANNEL_ID [--requests N] [--port 3100]
+
+Starts `gunicorn --workers 1 wsgi:application` twice on a spare port: once
+without gunicorn.conf.py (no preload or warmup, how the service used to run)
+and once with it. For each, logs how long the worker took to answer, the
+latency of the first Slack event and the median of the ones after it. Events
+are channel_join messages for TEAM_ID, which the bot acknowledges without
+calling Claude, so TEAM_ID must have an installation in ./data/installations.
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+from load_test import build_event, sign_request
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+BOOT_TIMEOUT_SECONDS = 120
+
+def wait_for_server(base_url: str, process) -> float:
+    """Seconds until the worker answers /readyz"""
+    start = time.perf_counter()
+    while time.perf_counter() - start < BOOT_TIMEOUT_SECONDS:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited while starting")
+        try:
+            if requests.get(f"{base_url}/readyz", timeout=1).status_code in (200, 503):
+                return time.perf_counter() - start
+        except (requests.ConnectionError, requests.Timeout):
+            # The master accepts connections before the worker has imported the app
+            pass
+        time.sleep(0.05)
+    raise RuntimeError("gunicorn didn't start in time")
+
+def time_events(base_url: str, signing_secret: str, team_id: str, channel_id: str, count: int) -> list:
+    latencies = []
+    for i in range(count):
+        body = json.dumps(build_event(team_id, channel_id, f"UBOOT{i:05d}", "ignored"))
+        start = time.perf_counter()
+        # A new connection per request, like Slack's
+        requests.post(f"{base_url}/slack/events", data=body, headers=sign_request(signing_secret, body), timeout=60)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def measure(name: str, config: str, args, signing_secret: str):
+    base_url = f"http://127.0.0.1:{args.port}"
+    command = [sys.executable, "-m", "gunicorn", "--workers", "1", "--bind", f"127.0.0.1:{args.port}", "wsgi:application"]
+    if config:
+        command[3:3] = ["--config", config]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        boot = wait_for_server(base_url, process)
+        latencies = time_events(base_url, signing_secret, args.team, args.channel, args.requests)
+        logging.info("{}: answering after {:.2f}s, first event {:.0f} ms, median after that {:.0f} ms".format(
+            name, boot, latencies[0] * 1000, statistics.median(latencies[1:]) * 1000))
+    finally:
+        process.terminate()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--team", required=True)
+    parser.add_argument("--channel", required=True)
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--port", type=int, default=3100)
+    args = parser.parse_args()
+    signing_secret = importlib.import_module("tokens").client_signing_secret
+
+    with tempfile.NamedTemporaryFile("w", suffix=".py") as empty_config:
+        measure("cold start", empty_config.name, args, signing_secret)
+    measure("warm start (gunicorn.conf.py)", os.path.abspath("gunicorn.conf.py"), args, signing_secret)
+
+if __name__ == "__main__":
+    main()
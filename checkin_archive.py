@@ -0,0 +1,162 @@
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from sqlite_connections import sqlite_connection
+
+CHECKINS_DATABASE = "./data/checkins.db"
+
+
+def archivable(message: dict) -> bool:
+    """Whether a channel message belongs in the archive: what exports include from conversations.history
+
+    Thread replies are left out unless they were also sent to the channel, as
+    history doesn't include them either.
+    """
+    if not message.get("user") or "text" not in message or message.get("hidden"):
+        return False
+    if message.get("subtype") == "channel_join":
+        return False
+    return "thread_ts" not in message or message.get("subtype") == "thread_broadcast" or message["thread_ts"] == message["ts"]
+
+
+class CheckInArchive:
+    """Channel messages, kept locally so exports don't have to download history again
+
+    Messages are added as the bot receives them and when exports fetch history
+    from Slack. For each channel, the archive also remembers one window of
+    time it is known to have every message for (its coverage), which only
+    grows as exports fetch history that overlaps or touches it. Messages stay
+    after Slack stops returning them, e.g. after 90 days on the Free plan,
+    and are edited or deleted along with the channel's messages.
+    Safe to share between threads and gunicorn workers.
+    """
+
+    def __init__(self, database: str = CHECKINS_DATABASE):
+        self.database = database
+        self._local = threading.local()
+        Path(database).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "create table if not exists messages ("
+                "team_id text not null, channel_id text not null, user_id text not null, ts text not null, text text not null, "
+                "primary key (team_id, channel_id, user_id, ts)) without rowid"
+            )
+            conn.execute(
+                "create table if not exists coverage ("
+                "team_id text not null, channel_id text not null, covered_from real not null, covered_to real not null, "
+                "primary key (team_id, channel_id))"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite_connection(self._local, self.database)
+
+    def record_messages(self, team_id: str, channel_id: str, messages: list) -> int:
+        """Add or update archivable messages from an event or a page of history
+
+        Returns:
+            int: Number of messages archived
+        """
+        rows = [(team_id, channel_id, m["user"], m["ts"], m["text"]) for m in messages if archivable(m)]
+        if rows:
+            with self._connect() as conn:
+                conn.executemany("insert or replace into messages (team_id, channel_id, user_id, ts, text) values (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def record_change(self, team_id: str, channel_id: str, event: dict) -> int:
+        """Apply a message_changed or message_deleted event to the archived message, so exports show what Slack does
+
+        Returns:
+            int: Number of archived messages updated or deleted
+        """
+        subtype = event.get("subtype")
+        if subtype == "message_changed":
+            message = event.get("message") or {}
+            ts = message.get("ts") or (event.get("previous_message") or {}).get("ts")
+            # A thread parent deleted while it has replies turns into a tombstone instead
+            deleted = message.get("subtype") == "tombstone"
+        elif subtype == "message_deleted":
+            ts = event.get("deleted_ts") or (event.get("previous_message") or {}).get("ts")
+            deleted = True
+        else:
+            return 0
+        if not ts:
+            return 0
+        with self._connect() as conn:
+            if deleted:
+                cursor = conn.execute("delete from messages where team_id = ? and channel_id = ? and ts = ?", (team_id, channel_id, ts))
+            else:
+                cursor = conn.execute(
+                    "update messages set text = ? where team_id = ? and channel_id = ? and ts = ?", (message.get("text", ""), team_id, channel_id, ts)
+                )
+        return cursor.rowcount
+
+    def coverage(self, team_id: str, channel_id: str):
+        """(covered_from, covered_to) timestamps between which every message is archived, or None"""
+        return self._connect().execute(
+            "select covered_from, covered_to from coverage where team_id = ? and channel_id = ?", (team_id, channel_id)
+        ).fetchone()
+
+    def missing_windows(self, team_id: str, channel_id: str, oldest: float = None, latest: float = None) -> list:
+        """(oldest, latest) windows to fetch from Slack so the archive covers oldest to latest
+
+        Windows always touch the current coverage, so it stays one window: asking
+        for a week long before it also fetches everything in between.
+        """
+        oldest = oldest or 0.0
+        latest = min(latest or time.time(), time.time())
+        covered = self.coverage(team_id, channel_id)
+        if covered is None:
+            return [(oldest, latest)]
+        covered_from, covered_to = covered
+        windows = []
+        if oldest < covered_from:
+            windows.append((oldest, covered_from))
+        if latest > covered_to:
+            windows.append((covered_to, latest))
+        return windows
+
+    def add_coverage(self, team_id: str, channel_id: str, covered_from: float, covered_to: float) -> bool:
+        """Record that every message between covered_from and covered_to is archived
+
+        A window that doesn't overlap or touch the channel's coverage isn't
+        recorded, since nothing is known about the gap between the two.
+
+        Returns:
+            bool: Whether the coverage now includes the window
+        """
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "insert into coverage (team_id, channel_id, covered_from, covered_to) values (?, ?, ?, ?) "
+                "on conflict (team_id, channel_id) do update set "
+                "covered_from = min(covered_from, excluded.covered_from), covered_to = max(covered_to, excluded.covered_to) "
+                "where excluded.covered_from <= covered_to and excluded.covered_to >= covered_from",
+                (team_id, channel_id, covered_from, covered_to),
+            )
+        return cursor.rowcount == 1
+
+    def user_messages(self, team_id: str, channel_id: str, user_id: str, oldest: float = None, latest: float = None, batch_size: int = 500):
+        """Yield a user's archived messages in a channel as (ts, text), oldest first, batch_size rows in memory at a time"""
+        # ts strings are fixed width, so they compare in time order
+        cursor = self._connect().execute(
+            "select ts, text from messages where team_id = ? and channel_id = ? and user_id = ? and ts > ? and ts < ? order by ts",
+            (team_id, channel_id, user_id, f"{oldest or 0:017.6f}", f"{latest or time.time() + 1:017.6f}"),
+        )
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive() -> CheckInArchive:
+    """The check-in archive shared by the web app and scripts"""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            _archive = CheckInArchive()
+        return _archive
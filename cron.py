@@ -1,69 +1,69 @@
 import logging
-import requests
+import time
 from datetime import datetime, timedelta
 from slack_bolt import App
 from slack_bolt.oauth.oauth_settings import OAuthSettings
-from slack_sdk.oauth.installation_store import FileInstallationStore
-from slack_sdk.oauth.state_store import FileOAuthStateStore
 from slack_sdk.errors import SlackApiError
 import tokens
-from workspace_store import get_workspace_info, update_announcement_timestamp, update_announcement_tag, get_always_include_users
+from installation_stores import build_installation_store
+from state_stores import build_state_store
+from workspace_store import get_workspace_info, update_announcement_timestamp, get_always_include_users, refresh_team_metadata
+from slack_clients import SlackClientPool, log_api_call_summary
+from announcements import get_pt_time, build_announcement_message, build_intro_message
+from tracing import span, traced
+from user_directory import get_user_directory
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-# Initialize the Bolt app with the same settings as app.py
-oauth_settings = OAuthSettings(
-    client_id=tokens.client_id,
-    client_secret=tokens.client_secret,
-    scopes=[
-        "channels:join",
-        "channels:manage",
-        "channels:read",
-        "channels:history",
-        "channels:write.invites",
-        "chat:write",
-        "files:write",
-        "groups:history",
-        "groups:read",
-        "groups:write",
-        "groups:write.invites",
-        "im:history",
-        "reactions:read",
-        "reactions:write",
-        "users:read",
-        "team:read"
-    ],
-    installation_store=FileInstallationStore(base_dir="./data/installations"),
-    state_store=FileOAuthStateStore(expiration_seconds=600, base_dir="./data/states")
-)
+_app = None
+_client_pool = None
 
-app = App(
-    signing_secret=tokens.client_signing_secret,
-    oauth_settings=oauth_settings
-)
+def get_app():
+    """Build the Bolt app with the same settings as app.py the first time it's needed
 
-# Month-specific emojis for signup messages
-MONTH_EMOJIS = {
-    "January": ":snowflake:",  # Snowflake for winter
-    "February": ":heart:",  # Hearts for Valentine's Day
-    "March": ":four_leaf_clover:",  # Four leaf clover for St. Patrick's Day
-    "April": ":cherry_blossom:",  # Cherry blossom for spring
-    "May": ":tulip:",  # Tulip for spring flowers
-    "June": ":sunny:",  # Sunny for summer
-    "July": ":beach_with_umbrella:",  # Beach umbrella for summer vacation
-    "August": ":palm_tree:",  # Palm tree for summer
-    "September": ":fallen_leaf:",  # Fallen leaf for autumn
-    "October": ":jack_o_lantern:",  # Jack o'lantern for Halloween
-    "November": ":maple_leaf:",  # Maple leaf for fall
-    "December": ":christmas_tree:"  # Christmas tree for holidays
-}
-
-def get_pt_time():
-    """Get current time in PT (UTC-8, ignoring daylight savings)"""
-    return datetime.utcnow() - timedelta(hours=8)
+    Kept out of import time so that importing cron doesn't construct a second
+    App, installation store and state store.
+    """
+    global _app
+    if _app is None:
+        oauth_settings = OAuthSettings(
+            client_id=tokens.client_id,
+            client_secret=tokens.client_secret,
+            scopes=[
+                "channels:join",
+                "channels:manage",
+                "channels:read",
+                "channels:history",
+                "channels:write.invites",
+                "chat:write",
+                "files:write",
+                "groups:history",
+                "groups:read",
+                "groups:write",
+                "groups:write.invites",
+                "im:history",
+                "reactions:read",
+                "reactions:write",
+                "users:read",
+                "team:read"
+            ],
+            installation_store=build_installation_store(),
+            state_store=build_state_store()
+        )
+        _app = App(
+            signing_secret=tokens.client_signing_secret,
+            oauth_settings=oauth_settings
+        )
+    return _app
+
+def get_client_pool():
+    global _client_pool
+    if _client_pool is None:
+        _client_pool = SlackClientPool(get_app().installation_store)
+    return _client_pool
 
 def is_last_day_of_month():
     """Check if today is the last day of the month"""
@@ -80,62 +80,14 @@ def is_last_day_of_month():
     # Return True if today is the last day of the month
     return today.day == last_day.day
 
-def build_announcement_message(workspace_info: dict):
-    """Build the announcement message for the monthly signup"""
-    
-    # Get the next month
-    now = get_pt_time()
-    next_month = (now.replace(day=1) + timedelta(days=32)).replace(day=1)
-    next_month_name = next_month.strftime("%B")
-    
-    # Get the month-specific emoji
-    month_emoji = MONTH_EMOJIS.get(next_month_name, ":calendar:")  # Default to calendar if month not found
-    
-    # Get the custom announcement text
-    custom_text = workspace_info.get("custom_announcement_text", "")
-    if not custom_text:
-        custom_text = ""
-
-    # Get the tag type
-    tag_type = workspace_info.get("announcement_tag", "channel")
-    if not tag_type:
-        tag_type = "channel"
-        update_announcement_tag(workspace_info["team_id"], tag_type)
-    # Create the message
-    message = f"It's almost {next_month_name}! {month_emoji} <!{tag_type}> Please react to this message if you want to opt in for {next_month_name}. {custom_text}\n\n:sun_with_face: If you would like to try daily checkins\n:star2: If you would like to do weekly checkins (in the same channel)"
-    
-    return message
-
-def build_intro_message(users: list, month: str, admins: list = None):
-    """Build the intro message for the checkin channels"""
-    users_text = " ".join([f"<@{user}>" for user in users])
-    
-    # Build admin mentions text
-    admin_text = ""
-    if admins:
-        admin_mentions = " ".join([f"<@{admin}>" for admin in admins])
-        admin_text = f"* This group is administered by {admin_mentions}. Feel free to message them with any questions or concerns."
-    
-    message = (
-        f"Welcome to {month}! {MONTH_EMOJIS[month]} {users_text}\n\n"
-        f"Let's do introductions here in thread. You can be as brief or long as you like. Share any of: who you might mention in your check ins, what's been on your mind lately, or what you'd like to get done in the short or long term. (pasting your intro from a previous month is fine too!)\n\n"
-        f"General info about this group:\n"
-        f"* The aim is to create a supportive group of close-knit friends, not to make people feel bad about their productivity level\n"
-        f"* We share our intentions for the day and how our previous day went, often along with a little journalling. The format is casual and flexible, and i'm happy for you to use this group in a way that feels most useful to you. Some people post daily and others weekly.\n"
-        f"* If you don't end up posting anything by the 10th of the month I will bump you out of this month's group, just to make sure nobody feels weird about people reading without posting. I'll send out reminders to people who haven't posted around the 7th.\n"
-        f"* If you want to get the text of all your checkins from a month, message me just the name of the channel, like `#2025-february-1` (but in plain text; the channel should turn into a blue link). Note that ONLY MESSAGES FROM THE PAST 90 DAYS ARE SAVED on our Free Slack plan.\n"
-        f"{admin_text}\n"
-        f"* If you read someone else's message, leave an emoji react! :slightly_smiling_face: I will leave some initial emoji reacts on each message to foster more human to human interaction.\n"
-        f"*While it's OK to share that you know someone through this group, _please keep information you learn about people here confidential_. For many of us this is our diary.*"
-    )
-    return message
-
+@traced("dm_admins")
 def dm_admins(client, workspace_info: dict, message: str):
     """DM admins about the new checkin groups"""
     admins = workspace_info.get("admins", [])
     for admin in admins:
         client.chat_postMessage(channel=admin, text=message)
 
+@traced("get_current_month_channels")
 def get_current_month_channels(client, workspace_info: dict):
     """Get all check-in channels for the current month"""
     channels = []
@@ -156,6 +108,7 @@ def get_current_month_channels(client, workspace_info: dict):
     
     return channels
 
+@traced("get_users_without_posts")
 def get_users_without_posts(client, channel_id: str):
     """Get users who haven't posted and those who only posted intros
     
@@ -165,13 +118,8 @@ def get_users_without_posts(client, channel_id: str):
     try:
         # Get channel members using conversations_members instead of groups_members
         members = client.conversations_members(channel=channel_id)["members"]
-        # Get messages from the last month (use requests to avoid urllib IncompleteRead on large responses)
-        r = requests.get(
-            "https://slack.com/api/conversations.history",
-            params={"channel": channel_id, "limit": 999},
-            headers={"Authorization": f"Bearer {client.token}"},
-        )
-        messages = r.json()["messages"]
+        # Get messages from the last month (the pooled client reads large responses without urllib's IncompleteRead)
+        messages = client.conversations_history(channel=channel_id, limit=999)["messages"]
         # Track who has posted what
         posted_users = set()  # Users who posted in main channel
         thread_only_users = set()  # Users who only posted in threads
@@ -217,6 +165,7 @@ def get_users_without_posts(client, channel_id: str):
         logging.error(f"Error getting user posts: {e}")
         return [], []
 
+@traced("send_reminder")
 def send_reminder(client, user_id: str, channel_id: str, is_intro_only: bool):
     """Send a reminder DM to a user"""
     try:
@@ -232,9 +181,7 @@ def send_reminder(client, user_id: str, channel_id: str, is_intro_only: bool):
         channel_info = client.conversations_info(channel=channel_id)
         channel_name = f"<#{channel_id}>"
         
-        # Get user's info
-        user_info = client.users_info(user=user_id)
-        first_name = user_info["user"]["profile"].get("first_name", "there")  # Use "there" as fallback
+        first_name = get_user_directory().first_name(workspace_info["team_id"], user_id, client)  # "there" if unknown
         
         if is_intro_only:
             message = f"Hi {first_name}, I noticed you've posted an intro in {channel_name} but haven't shared a check-in yet. Are you still planning to participate in check in groups this month? If so, post something (it can be short!) in the next couple days. If not, no worries - you're always welcome back in a future month. :)"
@@ -256,6 +203,7 @@ def send_reminder(client, user_id: str, channel_id: str, is_intro_only: bool):
         logging.exception(e)  # Log the full stack trace
         dm_admins(client, workspace_info, error_message)
 
+@traced("kick_inactive_users")
 def kick_inactive_users(client, channel_id: str, no_posts: list):
     """Kick users who haven't posted from the channel"""
     try:
@@ -273,9 +221,7 @@ def kick_inactive_users(client, channel_id: str, no_posts: list):
                 continue
                 
             try:
-                # Get user's info for the message
-                user_info = client.users_info(user=user_id)
-                first_name = user_info["user"]["profile"].get("first_name", "there")
+                first_name = get_user_directory().first_name(workspace_info["team_id"], user_id, client)
 
                 # Kick the user
                 client.conversations_kick(
@@ -305,6 +251,7 @@ def kick_inactive_users(client, channel_id: str, no_posts: list):
         logging.exception(e)  # Log the full stack trace
         dm_admins(client, workspace_info, error_message)
 
+@traced("post_monthly_signup")
 def post_monthly_signup(client, workspace_info: dict):
     """Post the monthly signup message to the announcement channel"""
     try:
@@ -349,6 +296,7 @@ def post_monthly_signup(client, workspace_info: dict):
         logging.exception(e)  # Log the full stack trace
         dm_admins(client, workspace_info, error_message)
 
+@traced("post_signup_close")
 def post_signup_close(client, workspace_info: dict):
     """Post a message to the announcement channel that signups are now closed"""
     try:
@@ -510,6 +458,7 @@ def get_active_users_from_current_month(client, workspace_info: dict):
         logging.exception(e)  # Log the full stack trace
         raise
 
+@traced("make_new_checkin_groups")
 def make_new_checkin_groups(client, workspace_info: dict):
     """Make new checkin groups for the current month"""
     # Get the announcement channel
@@ -1022,11 +971,9 @@ def run_api_diagnostics(client, workspace_id):
             
         # 4. Check workspace settings
         try:
-            admin_users = []
-            users_list = client.users_list()
-            for user in users_list["members"]:
-                if user.get("is_admin", False):
-                    admin_users.append(user.get("name", "unknown") + " (" + user.get("id", "unknown") + ")")
+            directory = get_user_directory()
+            directory.ensure_loaded(workspace_id, client)
+            admin_users = [f"{user['name']} ({user['user_id']})" for user in directory.workspace_admins(workspace_id)]
             
             logging.info("Workspace admins: {}".format(", ".join(admin_users)))
         except Exception as e:
@@ -1039,18 +986,14 @@ def run_api_diagnostics(client, workspace_id):
             
     logging.info("-------- API DIAGNOSTICS COMPLETE --------")
 
+@traced("add_late_signups_to_groups")
 def add_late_signups_to_groups(client, workspace_info: dict):
     """Add users who reacted late to existing check-in groups"""
     
     # Get workspace identifier for logging
     workspace_id = workspace_info.get("team_id", "unknown")
-    workspace_name = None
-    try:
-        team_info = client.team_info()
-        workspace_name = team_info["team"]["name"]
-        workspace_identifier = f"{workspace_name} ({workspace_id})"
-    except Exception:
-        workspace_identifier = f"workspace {workspace_id}"
+    workspace_name = workspace_info.get("team_name")
+    workspace_identifier = f"{workspace_name} ({workspace_id})" if workspace_name else f"workspace {workspace_id}"
     
     # Get the announcement channel
     announcement_channel = workspace_info.get("announcement_channel")
@@ -1137,12 +1080,7 @@ def add_late_signups_to_groups(client, workspace_info: dict):
             
             # Look for the welcome message in this channel
             try:
-                r = requests.get(
-                    "https://slack.com/api/conversations.history",
-                    params={"channel": channel["id"], "limit": 50},
-                    headers={"Authorization": f"Bearer {client.token}"},
-                )
-                history = r.json()
+                history = client.conversations_history(channel=channel["id"], limit=50)
                 for message in history.get("messages", []):
                     # Check if it's a welcome message sent by the bot
                     if (message.get("text", "").startswith("Welcome to") and 
@@ -1295,6 +1233,7 @@ def add_late_signups_to_groups(client, workspace_info: dict):
 
 if __name__ == "__main__":
     logging.info("Cron job started")
+    cron_start = time.perf_counter()
     current_day = get_pt_time().day
     logging.info(f"Current day: {current_day} (Pacific time)")
     
@@ -1302,80 +1241,86 @@ if __name__ == "__main__":
     workspaces = get_workspace_info()
     
     for workspace_id, workspace_info in workspaces.items():
-        try:
-            # Get installation for this workspace
-            installation = app.installation_store.find_installation(
-                team_id=workspace_id,
-                enterprise_id=None,
-                is_enterprise_install=False
-            )
-            if not installation:
-                logging.error(f"No installation found for workspace {workspace_id}")
-                continue
-            
-            # Create client from installation's bot token
-            client = app.client
-            client.token = installation.bot_token
+        with span("cron_workspace", team=workspace_id, day=current_day):
+            client = None
+            try:
+                # Get a client with this workspace's bot token
+                client = get_client_pool().get_client(workspace_id)
+                if not client:
+                    continue
             
-            # Run API diagnostics for this workspace
-            # run_api_diagnostics(client, workspace_id)
+                # Run API diagnostics for this workspace
+                # run_api_diagnostics(client, workspace_id)
+
+                # Workspaces added before team metadata was stored get it once
+                if "domain" not in workspace_info:
+                    refresh_team_metadata(workspace_id, client)
             
-            # Regular processing continues below...
+                # Regular processing continues below...
             
-            # On the 25th, post the monthly signup message
-            if current_day == 25:
-                post_monthly_signup(client, workspace_info)
-            # On the 2nd, add late signups to existing groups
-            elif current_day == 1 or current_day == 2 or current_day == 3 or current_day == 4:
-                add_late_signups_to_groups(client, workspace_info)
-                if current_day == 4:
-                    post_signup_close(client, workspace_info)
-            elif current_day == 7 or current_day == 11:
-                # Get current month's channels
-                channels = get_current_month_channels(client, workspace_info)
+                # On the 25th, post the monthly signup message
+                if current_day == 25:
+                    post_monthly_signup(client, workspace_info)
+                # On the 2nd, add late signups to existing groups
+                elif current_day == 1 or current_day == 2 or current_day == 3 or current_day == 4:
+                    add_late_signups_to_groups(client, workspace_info)
+                    if current_day == 4:
+                        post_signup_close(client, workspace_info)
+                elif current_day == 7 or current_day == 11:
+                    # Get current month's channels
+                    channels = get_current_month_channels(client, workspace_info)
+                    # Names for reminders and kicks come from the directory instead of a users.info call each.
+                    # If users.list fails, first_name falls back to users.info for each user.
+                    try:
+                        get_user_directory().ensure_loaded(workspace_id, client)
+                    except Exception as e:
+                        logging.error(f"Error loading user directory for workspace {workspace_id}: {repr(e)}")
                 
-                # Track total actions for summary
-                total_reminders = 0
-                total_intro_reminders = 0
-                total_kicks = 0
+                    # Track total actions for summary
+                    total_reminders = 0
+                    total_intro_reminders = 0
+                    total_kicks = 0
                 
-                for channel in channels:
-                    no_posts, only_intro = get_users_without_posts(client, channel["id"])
-                    # On the 7th, send reminders
-                    if current_day == 7:
-                        for user in no_posts:
-                            send_reminder(client, user, channel["id"], False)
-                            total_reminders += 1
+                    for channel in channels:
+                        no_posts, only_intro = get_users_without_posts(client, channel["id"])
+                        # On the 7th, send reminders
+                        if current_day == 7:
+                            for user in no_posts:
+                                send_reminder(client, user, channel["id"], False)
+                                total_reminders += 1
                             
-                        for user in only_intro:
-                            send_reminder(client, user, channel["id"], True)
-                            total_intro_reminders += 1
+                            for user in only_intro:
+                                send_reminder(client, user, channel["id"], True)
+                                total_intro_reminders += 1
                             
-                        # Send summary of reminders
-                        summary = f"Reminder Summary for {channel['name']}:\n"
-                        summary += f"- {total_reminders} users received no-posts reminders\n"
-                        summary += f"- {total_intro_reminders} users received intro-only reminders"
-                        dm_admins(client, workspace_info, summary)
+                            # Send summary of reminders
+                            summary = f"Reminder Summary for {channel['name']}:\n"
+                            summary += f"- {total_reminders} users received no-posts reminders\n"
+                            summary += f"- {total_intro_reminders} users received intro-only reminders"
+                            dm_admins(client, workspace_info, summary)
                 
-                    # On the 11th, kick inactive users
-                    elif current_day == 11:
-                        kick_inactive_users(client, channel["id"], no_posts)
-                        total_kicks += len(no_posts)
+                        # On the 11th, kick inactive users
+                        elif current_day == 11:
+                            kick_inactive_users(client, channel["id"], no_posts)
+                            total_kicks += len(no_posts)
                         
-                        # Send summary of kicks
-                        summary = f"Kick Summary for {channel['name']}:\n"
-                        summary += f"- {total_kicks} users were kicked for inactivity"
-                        dm_admins(client, workspace_info, summary)
-            # Create new check-in groups on the last day of the month instead of the 1st of next month
-            elif is_last_day_of_month():
-                make_new_checkin_groups(client, workspace_info)
-        except Exception as e:
-            error_message = f"Error processing workspace {workspace_id}: {e}"
-            logging.error(error_message)
-            logging.exception(e)  # Log the full stack trace
-            # Try to notify admins if possible
-            try:
-                if client and workspace_info and "admins" in workspace_info:
-                    dm_admins(client, workspace_info, error_message)
-            except Exception as notify_error:
-                logging.error(f"Failed to notify admins about error: {notify_error}")
+                            # Send summary of kicks
+                            summary = f"Kick Summary for {channel['name']}:\n"
+                            summary += f"- {total_kicks} users were kicked for inactivity"
+                            dm_admins(client, workspace_info, summary)
+                # Create new check-in groups on the last day of the month instead of the 1st of next month
+                elif is_last_day_of_month():
+                    make_new_checkin_groups(client, workspace_info)
+            except Exception as e:
+                error_message = f"Error processing workspace {workspace_id}: {e}"
+                logging.error(error_message)
+                logging.exception(e)  # Log the full stack trace
+                # Try to notify admins if possible
+                try:
+                    if client and workspace_info and "admins" in workspace_info:
+                        dm_admins(client, workspace_info, error_message)
+                except Exception as notify_error:
+                    logging.error(f"Failed to notify admins about error: {notify_error}")
+
+    log_api_call_summary()
+    logging.info(f"Cron job finished in {time.perf_counter() - cron_start:.1f}s")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Compare Slack API calls and wall time of check-in exports by page size and date range
+
+Usage: python export_benchmark.py [--messages 5000] [--slack-latency 0.05] [--rate-limit 0.0]
+
+Serves a channel of --messages messages from mock_slack.py on a spare port,
+then exports one user's check-ins the way get_check_ins used to (10 messages
+a page), with large pages, with large pages for only the last 30 days, and
+from an empty local archive (see checkin_archive.py) twice. Exports from the
+archive are streamed to the file, the others built in memory first; peak MiB
+is what Python allocated during the export, mock server included.
+--rate-limit answers that fraction of calls with 429 and Retry-After: 1.
+"""
+import argparse
+import logging
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import ThreadingHTTPServer
+import requests
+from slack_sdk import WebClient
+from checkin_archive import CheckInArchive
+from exports import HISTORY_PAGE_SIZE, fetch_check_ins, iter_archived_check_ins
+from export_writers import readable_date, write_check_ins
+from mock_slack import MockState, make_handler
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+def start_mock(state: MockState) -> str:
+    # The port is only used for file upload URLs, which exports to the mock don't need
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state, 0))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def run_export(mock_url: str, state: MockState, page_size: int, oldest: float = None, archive: CheckInArchive = None) -> tuple:
+    """(history calls, seconds, entries, peak MiB allocated) for one export, written to a file"""
+    requests.post(f"{mock_url}/_mock/reset")
+    client = WebClient(token="xoxb-benchmark", base_url=f"{mock_url}/api/")
+    tracemalloc.start()
+    start = time.perf_counter()
+    with tempfile.TemporaryFile("w+", encoding="utf-8", newline="") as file:
+        if archive:
+            check_ins = iter_archived_check_ins(client, "T0BENCHMARK", "C0BENCHMARK", "U0LOADTEST", oldest=oldest, archive=archive)
+            entries = write_check_ins(file, check_ins)
+        else:
+            # The whole export in memory, then joined into one string, like get_check_ins used to
+            check_ins = fetch_check_ins(client, "C0BENCHMARK", "U0LOADTEST", oldest=oldest, page_size=page_size)
+            file.write("\n\n".join(f"{readable_date(ts)}\n\n{text}" for ts, text, is_reply in check_ins))
+            entries = len(check_ins)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return state.calls.get("conversations.history", 0), seconds, entries, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--slack-latency", type=float, default=0.05)
+    parser.add_argument("--rate-limit", type=float, default=0.0)
+    args = parser.parse_args()
+
+    state = MockState(args.slack_latency, 0, args.rate_limit, args.messages)
+    mock_url = start_mock(state)
+    archive = CheckInArchive(f"{tempfile.mkdtemp()}/checkins.db")
+    runs = [
+        ("limit=10 (before)", 10, None, None),
+        (f"limit={HISTORY_PAGE_SIZE}", HISTORY_PAGE_SIZE, None, None),
+        (f"limit={HISTORY_PAGE_SIZE}, last 30 days", HISTORY_PAGE_SIZE, time.time() - 30 * 24 * 3600, None),
+        ("archive, first export", HISTORY_PAGE_SIZE, None, archive),
+        ("archive, next export", HISTORY_PAGE_SIZE, None, archive),
+    ]
+    for name, page_size, oldest, run_archive in runs:
+        calls, seconds, entries, peak = run_export(mock_url, state, page_size, oldest, run_archive)
+        per_thousand = 1000 / args.messages
+        logging.info("{:<30} {:>5} calls, {:>7.2f}s, {} entries, {:.1f} MiB peak; per 1,000 channel messages: {:.1f} calls, {:.2f}s".format(
+            name, calls, seconds, entries, peak, calls * per_thousand, seconds * per_thousand))
+
+if __name__ == "__main__":
+    main()
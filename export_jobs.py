@@ -0,0 +1,273 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from sqlite_connections import sqlite_connection
+
+EXPORT_JOBS_DATABASE = "./data/export_jobs.db"
+# Files a job has written so far, e.g. the channels of a bundle, kept until it's done
+EXPORT_JOBS_DIRECTORY = "./data/exports"
+# Export threads in each process that submits or resumes jobs
+EXPORT_WORKERS = 2
+MAX_RUNNING_JOBS_PER_USER = 1
+MAX_QUEUED_JOBS_PER_USER = 3
+POLL_INTERVAL_SECONDS = 5
+HEARTBEAT_INTERVAL_SECONDS = 15
+# A running job whose process hasn't sent a heartbeat for this long is assumed dead and resumed
+STALE_AFTER_SECONDS = 90
+MAX_ATTEMPTS = 3
+PROGRESS_INTERVAL_SECONDS = 10
+
+
+class ExportJob:
+    """A claimed export: what to export, how far it got and where to tell the user"""
+
+    def __init__(self, queue, row: sqlite3.Row):
+        self.queue = queue
+        self.id = row["id"]
+        self.team_id = row["team_id"]
+        self.user_id = row["user_id"]
+        self.channel_id = row["channel_id"]
+        self.params = json.loads(row["params"])
+        self.checkpoint = json.loads(row["checkpoint"] or "{}")
+        self.progress_ts = row["progress_ts"]
+        self.attempts = row["attempts"]
+        self._progress_at = 0.0
+
+    @property
+    def directory(self) -> str:
+        path = os.path.join(EXPORT_JOBS_DIRECTORY, str(self.id))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def save_checkpoint(self, **values):
+        """Remember how far the job got, so a resumed job carries on from there"""
+        self.checkpoint.update(values)
+        self.queue.save_checkpoint(self.id, self.checkpoint)
+
+    def report_progress(self, client, text: str, force: bool = False):
+        """Edit the job's progress message to text, at most every PROGRESS_INTERVAL_SECONDS unless forced"""
+        if not force and time.monotonic() - self._progress_at < PROGRESS_INTERVAL_SECONDS:
+            return
+        self._progress_at = time.monotonic()
+        try:
+            if self.progress_ts:
+                client.chat_update(channel=self.channel_id, ts=self.progress_ts, text=text)
+            else:
+                self.progress_ts = client.chat_postMessage(channel=self.channel_id, text=text)["ts"]
+                self.queue.set_progress_ts(self.id, self.progress_ts)
+        except Exception as e:
+            logging.error(f"Error posting progress of export job {self.id}: {repr(e)}")
+
+
+class ExportJobQueue:
+    """Exports waiting for, or being run by, the export threads of any process
+
+    Jobs are claimed in order, skipping users who already have
+    MAX_RUNNING_JOBS_PER_USER running. Running jobs send heartbeats; one that
+    stops (its worker was restarted or crashed) is claimed again and resumes
+    from its last checkpoint, up to MAX_ATTEMPTS times. Safe to share between
+    threads and gunicorn workers.
+    """
+
+    def __init__(self, database: str = EXPORT_JOBS_DATABASE):
+        self.database = database
+        self._local = threading.local()
+        Path(database).parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            "create table if not exists export_jobs ("
+            "id integer primary key autoincrement, team_id text not null, user_id text not null, channel_id text not null, "
+            "params text not null, status text not null, checkpoint text, progress_ts text, attempts integer not null default 0, "
+            "heartbeat real, created_at real not null, finished_at real, error text)"
+        )
+        conn.execute("create index if not exists export_jobs_status on export_jobs (status, id)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit, so claim can take the write lock before it reads
+        return sqlite_connection(self._local, self.database, row_factory=sqlite3.Row, isolation_level=None)
+
+    def submit(self, team_id: str, user_id: str, channel_id: str, params: dict, progress_ts: str = None):
+        """Queue an export for a user, whose progress is posted in channel_id
+
+        Returns:
+            int: Job id, or None if the user already has MAX_QUEUED_JOBS_PER_USER waiting
+        """
+        conn = self._connect()
+        conn.execute("begin immediate")
+        try:
+            queued = conn.execute(
+                "select count(*) from export_jobs where team_id = ? and user_id = ? and status = 'queued'", (team_id, user_id)
+            ).fetchone()[0]
+            if queued >= MAX_QUEUED_JOBS_PER_USER:
+                conn.execute("rollback")
+                return None
+            job_id = conn.execute(
+                "insert into export_jobs (team_id, user_id, channel_id, params, status, progress_ts, created_at) values (?, ?, ?, ?, 'queued', ?, ?)",
+                (team_id, user_id, channel_id, json.dumps(params), progress_ts, time.time()),
+            ).lastrowid
+            conn.execute("commit")
+        except Exception:
+            conn.execute("rollback")
+            raise
+        return job_id
+
+    def claim(self):
+        """Start the oldest job that can run, resuming abandoned ones first
+
+        Returns:
+            ExportJob: The job, now running in this process, or None if there is nothing to do
+        """
+        conn = self._connect()
+        now = time.time()
+        conn.execute("begin immediate")
+        try:
+            conn.execute(
+                "update export_jobs set status = 'queued' where status = 'running' and heartbeat < ?", (now - STALE_AFTER_SECONDS,)
+            )
+            conn.execute(
+                "update export_jobs set status = 'failed', finished_at = ?, error = 'too many attempts' where status = 'queued' and attempts >= ?",
+                (now, MAX_ATTEMPTS),
+            )
+            row = conn.execute(
+                "select * from export_jobs as job where status = 'queued' and ("
+                "select count(*) from export_jobs as other where other.status = 'running' "
+                "and other.team_id = job.team_id and other.user_id = job.user_id) < ? "
+                "order by attempts desc, id limit 1",
+                (MAX_RUNNING_JOBS_PER_USER,),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "update export_jobs set status = 'running', attempts = attempts + 1, heartbeat = ? where id = ?", (now, row["id"])
+                )
+            conn.execute("commit")
+        except Exception:
+            conn.execute("rollback")
+            raise
+        if row is None:
+            return None
+        job = ExportJob(self, row)
+        job.attempts += 1
+        return job
+
+    def heartbeat(self, job_ids: list):
+        if job_ids:
+            self._connect().execute(
+                f"update export_jobs set heartbeat = ? where status = 'running' and id in ({', '.join('?' * len(job_ids))})",
+                (time.time(), *job_ids),
+            )
+
+    def save_checkpoint(self, job_id: int, checkpoint: dict):
+        self._connect().execute(
+            "update export_jobs set checkpoint = ?, heartbeat = ? where id = ?", (json.dumps(checkpoint), time.time(), job_id)
+        )
+
+    def set_progress_ts(self, job_id: int, progress_ts: str):
+        self._connect().execute("update export_jobs set progress_ts = ? where id = ?", (progress_ts, job_id))
+
+    def finish(self, job_id: int, error: str = None):
+        self._connect().execute(
+            "update export_jobs set status = ?, finished_at = ?, error = ? where id = ?",
+            ("failed" if error else "done", time.time(), error, job_id),
+        )
+        shutil.rmtree(os.path.join(EXPORT_JOBS_DIRECTORY, str(job_id)), ignore_errors=True)
+
+    def failed_jobs_to_report(self) -> list:
+        """Jobs that ran out of attempts, whose users haven't been told yet; marks them told"""
+        conn = self._connect()
+        rows = conn.execute("select * from export_jobs where status = 'failed' and error = 'too many attempts'").fetchall()
+        jobs = []
+        for row in rows:
+            # Another thread or process may have taken it first
+            cursor = conn.execute("update export_jobs set error = 'too many attempts, reported' where id = ? and error = 'too many attempts'", (row["id"],))
+            if cursor.rowcount == 1:
+                jobs.append(ExportJob(self, row))
+        return jobs
+
+    def queued_count(self) -> int:
+        return self._connect().execute("select count(*) from export_jobs where status = 'queued'").fetchone()[0]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+_workers_pid = None
+_running_job_ids = set()
+_running_job_ids_lock = threading.Lock()
+_wake_up = threading.Event()
+
+
+def get_export_queue() -> ExportJobQueue:
+    """The export job queue shared by the web app and scripts"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = ExportJobQueue()
+        return _queue
+
+
+def start_export_workers(run_job, on_gave_up=None, workers: int = EXPORT_WORKERS):
+    """Run queued export jobs in background threads of this process, once per process
+
+    Args:
+        run_job: Called with each claimed ExportJob; the job is done when it returns and failed if it raises
+        on_gave_up: Called with each job that failed MAX_ATTEMPTS times, to tell its user
+    """
+    global _workers_pid
+    with _queue_lock:
+        if _workers_pid == os.getpid():
+            return
+        _workers_pid = os.getpid()
+    for i in range(workers):
+        threading.Thread(target=_work_forever, args=(run_job, on_gave_up), name=f"export-worker-{i}", daemon=True).start()
+    threading.Thread(target=_heartbeat_forever, name="export-heartbeat", daemon=True).start()
+
+
+def wake_export_workers():
+    """Have this process's export threads check for jobs now instead of at their next poll"""
+    _wake_up.set()
+
+
+def _work_forever(run_job, on_gave_up):
+    queue = get_export_queue()
+    while True:
+        try:
+            job = queue.claim()
+            if on_gave_up:
+                for failed_job in queue.failed_jobs_to_report():
+                    on_gave_up(failed_job)
+        except Exception as e:
+            logging.error(f"Error claiming export job: {repr(e)}")
+            job = None
+        if job is None:
+            _wake_up.wait(POLL_INTERVAL_SECONDS)
+            _wake_up.clear()
+            continue
+        with _running_job_ids_lock:
+            _running_job_ids.add(job.id)
+        start = time.perf_counter()
+        error = None
+        try:
+            run_job(job)
+        except Exception as e:
+            logging.error(f"Export job {job.id} failed: {repr(e)}")
+            error = repr(e)
+        finally:
+            with _running_job_ids_lock:
+                _running_job_ids.discard(job.id)
+        queue.finish(job.id, error)
+        logging.info(f"Export job {job.id} for {job.user_id} finished in {time.perf_counter() - start:.2f}s (attempt {job.attempts})")
+
+
+def _heartbeat_forever():
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL_SECONDS)
+        with _running_job_ids_lock:
+            job_ids = list(_running_job_ids)
+        try:
+            get_export_queue().heartbeat(job_ids)
+        except Exception as e:
+            logging.error(f"Error sending export job heartbeats: {repr(e)}")
@@ -0,0 +1,61 @@
+import csv
+import json
+import re
+from datetime import datetime
+
+# File formats check-ins can be exported in, by file extension
+EXPORT_FORMATS = ("txt", "md", "jsonl", "csv")
+FORMAT_NAMES = {"text": "txt", "markdown": "md", "json": "jsonl"}
+
+
+def parse_export_format(text: str) -> str:
+    """File format asked for in a DM like "#check-ins-2024-01 as csv", or "txt" """
+    text = re.sub(r"<#[^>]*>", "", text).lower()
+    match = re.search(r"\b(?:as|in)\s+(txt|text|md|markdown|jsonl|json|csv)\b", text)
+    if not match:
+        return "txt"
+    return FORMAT_NAMES.get(match.group(1), match.group(1))
+
+
+def readable_date(ts: str) -> str:
+    return datetime.fromtimestamp(int(ts.split(".")[0])).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def entry_date(ts: str, is_reply: bool) -> str:
+    return f"{readable_date(ts)}{' (thread reply)' if is_reply else ''}"
+
+
+def write_check_ins(file, check_ins, export_format: str = "txt", title: str = "") -> int:
+    """Write check-ins to an open text file as they come, so memory use doesn't grow with their number
+
+    Args:
+        file: Text file opened with newline="" (csv writes its own line endings)
+        check_ins: Iterable of (ts, text, is_reply), oldest first
+        export_format: One of EXPORT_FORMATS
+        title: Heading of Markdown files
+
+    Returns:
+        int: Number of check-ins written
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format {export_format}")
+    count = 0
+    if export_format == "csv":
+        writer = csv.writer(file)
+        writer.writerow(["date", "ts", "thread_reply", "text"])
+    elif export_format == "md" and title:
+        file.write(f"# {title}\n\n")
+    for ts, text, is_reply in check_ins:
+        if export_format == "txt":
+            # Blank lines between dates and entries, like exports have always looked
+            if count:
+                file.write("\n\n")
+            file.write(f"{entry_date(ts, is_reply)}\n\n{text}")
+        elif export_format == "md":
+            file.write(f"## {entry_date(ts, is_reply)}\n\n{text}\n\n")
+        elif export_format == "jsonl":
+            file.write(json.dumps({"date": readable_date(ts), "ts": ts, "thread_reply": is_reply, "text": text}) + "\n")
+        else:
+            writer.writerow([readable_date(ts), ts, is_reply, text])
+        count += 1
+    return count
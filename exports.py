@@ -0,0 +1,323 @@
+import contextlib
+import logging
+import os
+import re
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, time, timedelta
+from slack_sdk.errors import SlackApiError
+from slack_clients import RateLimiter, call_with_rate_limit_retries, get_rate_limiter
+from checkin_archive import CheckInArchive, get_archive
+from export_writers import write_check_ins
+
+# Exports of a user's check-ins from a channel, requested by DM (see respond_to_dm in app.py)
+
+# The most messages conversations.history returns in one page
+HISTORY_PAGE_SIZE = 999
+
+DATE_PATTERN = r"(\d{4}-\d{2}-\d{2})"
+MONTH_PATTERN = r"(\d{4})-(\d{2})(?!-\d)"
+
+# Channels of a bundle exported at once; a workspace's exports share one rate limiter
+BUNDLE_CONCURRENCY = 4
+# conversations.history and conversations.replies are Tier 3, about 50 calls a minute
+HISTORY_CALLS_PER_MINUTE = 50
+
+
+def parse_date_range(text: str) -> tuple:
+    """Dates limiting an export, from a DM like "#check-ins-2024 from 2024-01-01 to 2024-03-31"
+
+    "from"/"since" set the first day and "to"/"until" the last one; two bare
+    dates are a range and one bare date is a single day. Days start at local
+    midnight, like the dates in the exported file.
+
+    Returns:
+        tuple: (oldest, latest) Unix timestamps for conversations.history, either can be None
+
+    Raises:
+        ValueError: If a date doesn't exist, like 2024-02-30
+    """
+    # Leave out channel mentions, whose names can look like dates
+    text = re.sub(r"<#[^>]*>", "", text).lower()
+    start = re.search(r"\b(?:from|since)\s+" + DATE_PATTERN, text)
+    end = re.search(r"\b(?:to|until)\s+" + DATE_PATTERN, text)
+    if start or end:
+        first, last = start and start.group(1), end and end.group(1)
+    else:
+        dates = re.findall(DATE_PATTERN, text)
+        if not dates:
+            return None, None
+        first, last = dates[0], dates[1] if len(dates) > 1 else dates[0]
+    oldest = _day_start(first) if first else None
+    latest = _day_start(last, days_after=1) if last else None
+    return oldest, latest
+
+
+def describe_date_range(oldest: float = None, latest: float = None) -> str:
+    """Dates of an export for messages to the user, e.g. " from 2024-01-01 to 2024-03-31", or "" for all time"""
+    text = ""
+    if oldest is not None:
+        text += f" from {datetime.fromtimestamp(oldest).date().isoformat()}"
+    if latest is not None:
+        # latest is the start of the day after the last one
+        text += f" to {(datetime.fromtimestamp(latest) - timedelta(days=1)).date().isoformat()}"
+    return text
+
+
+def _day_start(day: str, days_after: int = 0) -> float:
+    return datetime.combine(date.fromisoformat(day) + timedelta(days=days_after), time()).timestamp()
+
+
+def iter_history(client, channel_id: str, oldest: float = None, latest: float = None, page_size: int = HISTORY_PAGE_SIZE, limiter: RateLimiter = None, cursor: str = None, on_page=None):
+    """Yield each page of messages in a channel between oldest and latest, newest first
+
+    Starts from cursor if given. on_page(next_cursor) is called once each page
+    has been handled, with None after the last one, e.g. to checkpoint an export.
+    """
+    window = {}
+    if oldest is not None:
+        window["oldest"] = f"{oldest:.6f}"
+    if latest is not None:
+        window["latest"] = f"{latest:.6f}"
+    while True:
+        message_data = call_with_rate_limit_retries(
+            client.conversations_history,
+            channel=channel_id,
+            limiter=limiter,
+            limit=page_size,
+            cursor=cursor,
+            **window,
+        )
+        yield message_data["messages"]
+        cursor = message_data.get("response_metadata", {}).get("next_cursor")
+        if not message_data.get("has_more") or not cursor:
+            cursor = None
+        if on_page:
+            on_page(cursor)
+        if not cursor:
+            break
+
+
+def parse_messages(messages, user):
+    """Yield a user's messages from a page of history as (ts, text, is_reply)"""
+    # threaded replies are not included in conversation history by default
+    for message in messages:
+        if message.get("user") == user:
+            if "subtype" not in message.keys() or message["subtype"] != "channel_join":
+                yield message["ts"], message["text"], False
+
+
+def fetch_check_ins(client, channel_id: str, user_id: str, oldest: float = None, latest: float = None, page_size: int = HISTORY_PAGE_SIZE) -> list:
+    """A user's messages in a channel as (ts, text, is_reply), oldest first, straight from Slack"""
+    check_ins = []
+    for messages in iter_history(client, channel_id, oldest, latest, page_size):
+        check_ins.extend(parse_messages(messages, user_id))
+    # put entries in chronological order
+    check_ins.reverse()
+    return check_ins
+
+
+def backfill_archive(client, team_id: str, channel_id: str, oldest: float = None, latest: float = None, archive: CheckInArchive = None, job=None):
+    """Fetch the history between oldest and latest the archive doesn't cover yet, for every user in the channel
+
+    With an ExportJob (see export_jobs.py), the history cursor is checkpointed
+    after every page, and a resumed job finishes the window it was reading first.
+    """
+    archive = archive or get_archive()
+    resumed = job.checkpoint.get("history") if job else None
+    try:
+        if resumed:
+            _backfill_window(client, team_id, channel_id, *resumed["window"], archive, job, resumed["cursor"], resumed["messages"])
+        for window_oldest, window_latest in archive.missing_windows(team_id, channel_id, oldest, latest):
+            _backfill_window(client, team_id, channel_id, window_oldest, window_latest, archive, job)
+    except SlackApiError as e:
+        if archive.coverage(team_id, channel_id) is None:
+            raise
+        # Better an export missing the newest messages than none at all
+        logging.warning(f"Exporting archived messages only for {channel_id}, history failed: {repr(e)}")
+
+
+def _backfill_window(client, team_id: str, channel_id: str, window_oldest: float, window_latest: float, archive: CheckInArchive, job=None, cursor: str = None, read: int = 0):
+    def checkpoint(next_cursor):
+        if job:
+            job.save_checkpoint(history={"window": [window_oldest, window_latest], "cursor": next_cursor, "messages": read} if next_cursor else None)
+            job.report_progress(client, f"Still working on your export: I've read {read:,} messages from <#{channel_id}> so far.")
+
+    for messages in iter_history(client, channel_id, window_oldest, window_latest, cursor=cursor, on_page=checkpoint):
+        archive.record_messages(team_id, channel_id, messages)
+        read += len(messages)
+    archive.add_coverage(team_id, channel_id, window_oldest, window_latest)
+
+
+def iter_archived_check_ins(client, team_id: str, channel_id: str, user_id: str, oldest: float = None, latest: float = None, archive: CheckInArchive = None, job=None):
+    """Like fetch_check_ins, but yields check-ins one at a time from the local archive, after backfilling it"""
+    archive = archive or get_archive()
+    backfill_archive(client, team_id, channel_id, oldest, latest, archive, job)
+    for ts, text in archive.user_messages(team_id, channel_id, user_id, oldest, latest):
+        yield ts, text, False
+
+
+def extract_channels(text: str) -> list:
+    """IDs of the channels mentioned in a DM, in order, without repeats"""
+    return list(dict.fromkeys(re.findall(r"<#([A-Z0-9]+)(?:\|[^>]*)?>", text)))
+
+
+def parse_month_range(text: str) -> list:
+    """Months to export every check-in channel of, from a DM like "months 2024-01 to 2024-12" or "year 2024"
+
+    Returns:
+        list: (year, month) tuples, oldest first; empty if the DM doesn't ask for months
+
+    Raises:
+        ValueError: If a month doesn't exist or the range ends before it starts
+    """
+    text = re.sub(r"<#[^>]*>", "", text).lower()
+    year = re.search(r"\byear\s+(\d{4})\b", text)
+    match = re.search(r"\bmonths?\s+" + MONTH_PATTERN + r"(?:\s+(?:to|until|through)\s+" + MONTH_PATTERN + ")?", text)
+    if year:
+        first, last = (int(year.group(1)), 1), (int(year.group(1)), 12)
+    elif match:
+        first = (int(match.group(1)), int(match.group(2)))
+        last = (int(match.group(3)), int(match.group(4))) if match.group(3) else first
+    else:
+        return []
+    if not (1 <= first[1] <= 12 and 1 <= last[1] <= 12) or last < first:
+        raise ValueError(f"Invalid month range {first} to {last}")
+    months = []
+    year, month = first
+    while (year, month) <= last:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def month_channel_prefixes(channel_format: str, year: int, month: int) -> tuple:
+    """Start of the names of a month's check-in channels, with the month as a name and as a number"""
+    base = channel_format.replace("[year]", str(year))
+    prefixes = (
+        base.replace("[month]", date(year, month, 1).strftime("%B").lower()),
+        base.replace("[month]", f"{month:02d}"),
+    )
+    # Channels are numbered when a month has several groups
+    return tuple(prefix.split("[number]")[0] for prefix in prefixes)
+
+
+def find_month_channels(client, channel_format: str, months: list) -> list:
+    """Check-in channels the bot is in for any of months, archived ones included, sorted by name"""
+    prefixes = tuple(prefix for year, month in months for prefix in month_channel_prefixes(channel_format, year, month))
+    channels = []
+    cursor = None
+    while True:
+        response = client.conversations_list(types="private_channel", limit=1000, cursor=cursor)
+        channels.extend(channel for channel in response["channels"] if channel["name"].startswith(prefixes))
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            break
+    return sorted(channels, key=lambda channel: channel["name"])
+
+
+def iter_thread_replies(client, channel_id: str, thread_ts: str, limiter: RateLimiter = None):
+    """Yield each page of replies in a thread, without its parent message"""
+    cursor = None
+    while True:
+        response = call_with_rate_limit_retries(
+            client.conversations_replies,
+            limiter=limiter,
+            channel=channel_id,
+            ts=thread_ts,
+            limit=HISTORY_PAGE_SIZE,
+            cursor=cursor,
+        )
+        yield [message for message in response["messages"] if message["ts"] != thread_ts]
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not response.get("has_more") or not cursor:
+            break
+
+
+def user_replied(message: dict, user_id: str) -> bool:
+    """Whether user_id may have replied in the thread under message; reply_users only lists a few repliers"""
+    if not message.get("reply_count"):
+        return False
+    reply_users = message.get("reply_users", [])
+    return user_id in reply_users or message.get("reply_users_count", 0) > len(reply_users)
+
+
+def collect_channel_check_ins(client, team_id: str, channel_id: str, user_id: str, oldest: float = None, latest: float = None, history_limiter: RateLimiter = None, replies_limiter: RateLimiter = None) -> list:
+    """A user's messages and thread replies in a channel as (ts, text, is_reply), oldest first
+
+    Unlike iter_archived_check_ins this reads the whole window from Slack,
+    because finding the user's replies needs the reply_users of every thread,
+    which the archive doesn't keep. The history is archived on the way.
+    """
+    archive = get_archive()
+    now = datetime.now().timestamp()
+    covered_to = min(latest or now, now)
+    check_ins = []
+    threads = []
+    for messages in iter_history(client, channel_id, oldest, covered_to, limiter=history_limiter):
+        archive.record_messages(team_id, channel_id, messages)
+        check_ins.extend(parse_messages(messages, user_id))
+        threads.extend(message["ts"] for message in messages if user_replied(message, user_id))
+    # Not recorded if the window is apart from the archive's coverage; backfill_archive fetches the gap when an export needs it
+    archive.add_coverage(team_id, channel_id, oldest or 0.0, covered_to)
+    for thread_ts in threads:
+        for replies in iter_thread_replies(client, channel_id, thread_ts, replies_limiter):
+            check_ins.extend(
+                (reply["ts"], reply["text"], True) for reply in replies
+                if reply.get("user") == user_id and (oldest or 0) < float(reply["ts"]) < covered_to
+            )
+    return sorted(check_ins, key=lambda check_in: float(check_in[0]))
+
+
+def export_bundle(client, team_id: str, user_id: str, channels: list, path: str, oldest: float = None, latest: float = None, on_channel_done=None, export_format: str = "txt", job=None) -> int:
+    """Write a zip of a user's check-ins in several channels to path, one file per channel
+
+    Channels are read BUNDLE_CONCURRENCY at a time, sharing the workspace's
+    rate limiters, and each one's file is written as soon as it is done, then
+    they are zipped. on_channel_done(channel, check_ins, error) is called as
+    each one finishes; channels that fail are left out of the zip. With an
+    ExportJob, files are kept in the job's directory and finished channels are
+    checkpointed, so a resumed job skips them.
+
+    Args:
+        channels: Channel dicts with an "id" and, optionally, a "name"
+
+    Returns:
+        int: Number of check-ins in the zip
+    """
+    # Slack rate limits each method separately
+    history_limiter = get_rate_limiter(f"{team_id}:conversations.history", HISTORY_CALLS_PER_MINUTE)
+    replies_limiter = get_rate_limiter(f"{team_id}:conversations.replies", HISTORY_CALLS_PER_MINUTE)
+    # channel id -> [file name, number of check-ins] of finished channels
+    finished = dict(job.checkpoint.get("channels", {})) if job else {}
+
+    def export_channel(channel):
+        if "name" not in channel:
+            channel = call_with_rate_limit_retries(client.conversations_info, channel=channel["id"])["channel"]
+        return channel, collect_channel_check_ins(client, team_id, channel["id"], user_id, oldest, latest, history_limiter, replies_limiter)
+
+    with contextlib.ExitStack() as stack:
+        directory = job.directory if job else stack.enter_context(tempfile.TemporaryDirectory())
+        executor = stack.enter_context(ThreadPoolExecutor(max_workers=BUNDLE_CONCURRENCY))
+        futures = {executor.submit(export_channel, channel): channel for channel in channels if channel["id"] not in finished}
+        for future in as_completed(futures):
+            try:
+                channel, check_ins = future.result()
+            except Exception as e:
+                logging.error(f"Error exporting {futures[future]['id']} for {user_id}: {repr(e)}")
+                if on_channel_done:
+                    on_channel_done(futures[future], None, e)
+                continue
+            filename = f"{channel['name']}_check-ins.{export_format}"
+            with open(os.path.join(directory, filename), "w", encoding="utf-8", newline="") as file:
+                finished[channel["id"]] = [filename, write_check_ins(file, check_ins, export_format, title=f"{channel['name']} entries")]
+            if job:
+                job.save_checkpoint(channels=finished)
+            if on_channel_done:
+                on_channel_done(channel, check_ins, None)
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as bundle:
+            for channel in channels:
+                if channel["id"] in finished and finished[channel["id"]][1]:
+                    bundle.write(os.path.join(directory, finished[channel["id"]][0]), finished[channel["id"]][0])
+    return sum(count for filename, count in finished.values())
@@ -0,0 +1,40 @@
+import glob
+import os
+
+# Loaded automatically by gunicorn when started from this directory; bind,
+# workers and timeout are set in check-in-bot.service. See warmup.py.
+
+# Import the app once in the master so workers share its memory and start warm
+preload_app = True
+
+# Workers write their metrics here so /metrics can add them up (see metrics.py).
+# This has to be set before the app, and prometheus_client, are imported.
+METRICS_DIR = os.path.abspath("./data/prometheus")
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", METRICS_DIR)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+# Start from zero; values left by the previous run's workers would be summed in.
+# Only prometheus_client's own files are deleted, in case the directory is shared.
+for path in glob.glob(os.path.join(os.environ["PROMETHEUS_MULTIPROC_DIR"], "*.db")):
+    os.remove(path)
+
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before any worker is forked
+    import warmup
+    warmup.warm_shared_caches()
+
+
+def post_fork(server, worker):
+    import warmup
+    warmup.reopen_clients()
+
+
+def post_worker_init(worker):
+    # Runs in the worker before it starts accepting connections
+    import warmup
+    warmup.warm_worker()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
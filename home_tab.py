@@ -1,32 +1,167 @@
 import logging
+import threading
 import traceback
 from datetime import datetime
+from slack_sdk.errors import SlackApiError
 from slack_sdk.models.blocks import SectionBlock, DividerBlock
 from slack_sdk.models.blocks.basic_components import MarkdownTextObject
 from workspace_store import ensure_workspace_exists, update_channel_format, get_always_include_users, get_workspace_info, add_emoji_optout_user, remove_emoji_optout_user, get_emoji_optout_users
-from cron import build_announcement_message
+from announcements import build_announcement_message, get_pt_time
+from user_directory import get_user_directory
+from metrics import record_cache_lookup, timed
+from tracing import span
+from profiling import profiled
 
-def get_home_view(user_id: str, team_id: str, team_name: str, client, get_workspace_info):
-    """Create the home tab view"""    
+# Rendered home views by (team, role), kept with the home_view_version they
+# were rendered at. Apart from the user's role, a view depends on stored
+# workspace settings and, through the admin's announcement preview, on the
+# current month, so users with the same role share one.
+_home_view_cache = {}
+_home_view_cache_lock = threading.Lock()
+
+def home_view_role(user_id: str, workspace_info: dict) -> tuple:
+    """What about a user changes their home view: (is admin, is always included, has opted out of emojis)"""
+    return (
+        user_id in workspace_info.get("admins", []),
+        user_id in workspace_info.get("always_include_users", []),
+        user_id in workspace_info.get("emoji_optout_users", []),
+    )
+
+def home_view_version(workspace_info: dict) -> tuple:
+    """What a cached view must have been rendered at to still be current: (settings_version, announcement month)"""
+    return (workspace_info.get("settings_version", 0), get_pt_time().strftime("%Y-%m"))
+
+def get_cached_home_view(team_id: str, role: tuple, version: tuple):
+    """The cached view for this role, or None if there isn't one for this version
+
+    Views are shared between users, so callers must not modify them.
+    """
+    cached = _home_view_cache.get((team_id, role))
+    hit = cached is not None and cached[0] == version
+    record_cache_lookup("home_views", hit)
+    return cached[1] if hit else None
+
+def cache_home_view(team_id: str, role: tuple, version: tuple, view: dict):
+    with _home_view_cache_lock:
+        _home_view_cache[(team_id, role)] = (version, view)
+
+def get_home_view(user_id: str, team_id: str, client, get_workspace_info):
+    """Create the home tab view, or reuse one rendered since the workspace settings or month last changed"""
     # Ensure workspace exists in storage
     ensure_workspace_exists(team_id, client)
     
     # Get workspace info from the event context
     workspace_info = get_workspace_info(team_id)
+    if not workspace_info:
+        return build_home_view(user_id, workspace_info, [])
+    role = home_view_role(user_id, workspace_info)
+    version = home_view_version(workspace_info)
+    view = get_cached_home_view(team_id, role, version)
+    if view is not None:
+        return view
     
+    # Leave out admins who have since been deactivated
+    directory = get_user_directory()
+    admin_ids = [admin_id for admin_id in workspace_info["admins"] if not directory.is_deleted(team_id, admin_id)]
+    view = build_home_view(user_id, workspace_info, admin_ids)
+    cache_home_view(team_id, role, version, view)
+    return view
+
+# Home tab publishes that arrive within this many seconds of the last one for
+# the same user are coalesced into a single publish once the window closes
+PUBLISH_WINDOW_SECONDS = 1.0
+
+class HomeTabPublisher:
+    """Renders and publishes home tabs, at most once per window per user
+
+    The first request for a user is published right away. Requests arriving
+    while a publish is running or within PUBLISH_WINDOW_SECONDS of it are
+    collapsed into one more publish of the latest state when the window ends.
+    Publishes pass the hash of the view they expect to replace, so if another
+    worker published in between, Slack rejects ours with hash_conflict and
+    the stale render is thrown away and rendered again instead.
+    """
+
+    def __init__(self, window: float = PUBLISH_WINDOW_SECONDS):
+        self.window = window
+        self._lock = threading.Lock()
+        # (team, user) -> hash of the view this process last published, while its window is open
+        self._open = {}
+        # (team, user) -> latest (client, view hash) waiting for the window to close
+        self._pending = {}
+
+    def publish(self, client, user_id: str, team_id: str, view_hash: str = None):
+        """Publish the user's home tab now, or once the current window closes
+
+        Args:
+            view_hash: Hash of the view the user has now, from the event or action payload
+        """
+        key = (team_id, user_id)
+        with self._lock:
+            if key in self._open:
+                self._pending[key] = (client, view_hash)
+                return
+            self._open[key] = None
+        self._publish(key, client, view_hash)
+
+    def _publish(self, key: tuple, client, view_hash: str):
+        team_id, user_id = key
+        try:
+            published_hash = publish_home_view(client, user_id, team_id, view_hash)
+        except Exception as e:
+            logging.error(f"Error publishing home tab for {user_id}: {repr(e)}")
+            published_hash = None
+        with self._lock:
+            self._open[key] = published_hash
+        timer = threading.Timer(self.window, self._close_window, args=(key,))
+        timer.daemon = True
+        timer.start()
+
+    def _close_window(self, key: tuple):
+        with self._lock:
+            pending = self._pending.pop(key, None)
+            if pending is None:
+                del self._open[key]
+                return
+            # What this process published is newer than the hash in the payload that asked for a publish
+            client, view_hash = pending
+            view_hash = self._open[key] or view_hash
+        self._publish(key, client, view_hash)
+
+def publish_home_view(client, user_id: str, team_id: str, view_hash: str = None):
+    """Render the home tab and publish it if it still replaces the view with view_hash
+
+    Returns:
+        The hash of the published view, for the next publish
+    """
+    with span("render_home_view") as render_span:
+        view = get_home_view(user_id, team_id, client, get_workspace_info)
+        render_span.set(blocks=len(view.get("blocks", [])))
+    try:
+        result = client.views_publish(user_id=user_id, view=view, hash=view_hash)
+    except SlackApiError as e:
+        if e.response.get("error") != "hash_conflict":
+            raise
+        # Another publish got there first, so this render may be out of date
+        logging.info(f"Home tab for {user_id} changed since it was rendered, rendering again")
+        view = get_home_view(user_id, team_id, client, get_workspace_info)
+        result = client.views_publish(user_id=user_id, view=view)
+    return result.get("view", {}).get("hash")
+
+home_tab_publisher = HomeTabPublisher()
+
+def build_home_view(user_id: str, workspace_info: dict, admin_ids: list) -> dict:
+    """Render the home tab blocks from stored workspace info
+
+    Args:
+        user_id: The user the home tab is for
+        workspace_info: Stored info for the user's workspace
+        admin_ids: Administrators to list, already checked to still exist in Slack
+    """
     admin_text = ""
-    incompatible_text = ""
-    announcement_text = ""
     
     if workspace_info and workspace_info["admins"] and len(workspace_info["admins"]) > 0:
-        admin_usernames = []
-        for admin_id in workspace_info["admins"]:
-            try:
-                # Get user info from Slack
-                user_info = client.users_info(user=admin_id)
-                admin_usernames.append(f"<@{admin_id}>")
-            except Exception as e:
-                logging.error(f"Error getting user info: {repr(e)}")
+        admin_usernames = [f"<@{admin_id}>" for admin_id in admin_ids]
         admin_text = "\n\n*Administrators:*\n" + ", ".join(admin_usernames)
     else:
         admin_text = "\n\n*Administrators:*\nNo administrators found. You can become an administrator by messaging 'king me' to the check-in bot."
@@ -133,7 +268,9 @@ def register_home_tab_handlers(app):
     """Register all home tab related event handlers"""
 
     @app.event("app_home_opened")
-    def update_home_tab(client, event, logger):
+    @timed("update_home_tab")
+    @profiled
+    def update_home_tab(client, context, event, logger):
         """Handle app home opened events"""
         try:
             # Check the event type
@@ -141,15 +278,8 @@ def register_home_tab_handlers(app):
                 return
             logger.info(f"Publishing home view for user {event['user']}")
 
-            # Get team_id from the client's context
-            team_info = client.team_info()
-            team_id = team_info["team"]["id"]
-            team_name = team_info["team"]["name"]
-
-            result = client.views_publish(
-                user_id=event["user"],
-                view=get_home_view(event["user"], team_id, team_name, client, app.get_workspace_info)
-            )
+            with span("home_tab", user=event["user"], team=context.team_id):
+                home_tab_publisher.publish(client, event["user"], context.team_id, event.get("view", {}).get("hash"))
         except Exception as e:
             logger.error(f"Error publishing home tab: {str(e)}")
             logger.error(f"Full error details:\n{traceback.format_exc()}")
@@ -168,12 +298,7 @@ def register_home_tab_handlers(app):
         else:
             add_emoji_optout_user(team_id, user_id)
 
-        team_info = client.team_info()
-        team_name = team_info["team"]["name"]
-        client.views_publish(
-            user_id=user_id,
-            view=get_home_view(user_id, team_id, team_name, client, get_workspace_info)
-        )
+        home_tab_publisher.publish(client, user_id, team_id, body.get("view", {}).get("hash"))
 
 def build_admin_home(workspace_info: dict, blocks: list) -> dict:
     """Build the admin home tab view"""
@@ -295,9 +420,10 @@ def build_admin_home(workspace_info: dict, blocks: list) -> dict:
     if last_announcement and "channel" in last_announcement and "ts" in last_announcement:
         channel_id = last_announcement["channel"]
         timestamp = last_announcement["ts"]
-        # Format the permalink URL
-        workspace_domain = workspace_info.get("domain", "slack")
-        permalink = f"https://{workspace_domain}.slack.com/archives/{channel_id}/p{timestamp.replace('.', '')}"
+        # Format the permalink URL; slack.com redirects to the workspace if its domain isn't known yet
+        workspace_domain = workspace_info.get("domain")
+        host = f"{workspace_domain}.slack.com" if workspace_domain else "slack.com"
+        permalink = f"https://{host}/archives/{channel_id}/p{timestamp.replace('.', '')}"
         last_announcement_text = f"*Last Announcement:*\n<{permalink}|View last announcement message>"
     else:
         last_announcement_text = "*Last Announcement:*\nNo last announcement message set."
@@ -325,6 +451,20 @@ def build_admin_home(workspace_info: dict, blocks: list) -> dict:
         }
     })
 
+    # Add emoji reaction model tier setting
+    model_tier = workspace_info.get("model_tier") or "balanced"
+    model_tier_text = f"*Emoji Reaction Model Tier:* {model_tier}\n" + \
+                      "`fast` is quickest and cheapest, `best` always uses the most capable model, and `balanced` picks by message length.\n" + \
+                      "Use `set model tier [fast|balanced|best]` to change this setting."
+
+    blocks.append({
+        "type": "section",
+        "text": {
+            "type": "mrkdwn",
+            "text": model_tier_text
+        }
+    })
+
     return {
         "type": "home",
         "blocks": blocks
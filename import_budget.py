@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""Fail if importing the web app takes longer than the budget
+
+Usage: python import_budget.py [--module wsgi] [--budget 3.0] [--runs 3]
+
+Each run imports the module in a fresh interpreter, like a new gunicorn worker,
+and the fastest run is compared against the budget so one slow run doesn't fail
+the check. Exits 1 if the budget is exceeded or the import pulls in cron.py.
+Needs tokens.py, like the app itself.
+"""
+import argparse
+import logging
+import subprocess
+import sys
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+# Modules the web app must not import, because they have import-time side effects
+FORBIDDEN_MODULES = ["cron"]
+
+MEASURE = """
+import sys, time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+print("forbidden:" + ",".join(m for m in {forbidden!r} if m in sys.modules))
+"""
+
+def measure_import(module: str) -> tuple:
+    """Import a module in a fresh interpreter
+
+    Returns:
+        tuple: (seconds, list of forbidden modules that were imported, -X importtime output)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", MEASURE.format(module=module, forbidden=FORBIDDEN_MODULES)],
+        capture_output=True, text=True, check=True,
+    )
+    seconds, forbidden = result.stdout.splitlines()[-2:]
+    return float(seconds), [m for m in forbidden[len("forbidden:"):].split(",") if m], result.stderr
+
+def slowest_imports(importtime_output: str, max_depth: int = 2, count: int = 10) -> list:
+    """Imports up to max_depth levels below the measured module, sorted by cumulative microseconds"""
+    imports = []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # -X importtime indents each level of nesting by two spaces
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if cumulative.strip().isdigit() and 0 < depth <= max_depth:
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="wsgi")
+    parser.add_argument("--budget", type=float, default=3.0, help="Seconds")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    runs = [measure_import(args.module) for _ in range(args.runs)]
+    seconds, forbidden, importtime_output = min(runs, key=lambda run: run[0])
+    for cumulative, name in slowest_imports(importtime_output):
+        logging.info("{:>8.0f} ms  {}".format(cumulative / 1000, name))
+
+    failed = False
+    if forbidden:
+        logging.error("import {} pulled in {}".format(args.module, ", ".join(forbidden)))
+        failed = True
+    if seconds > args.budget:
+        logging.error("import {} took {:.2f}s, over the {:.2f}s budget".format(args.module, seconds, args.budget))
+        failed = True
+    else:
+        logging.info("import {} took {:.2f}s (budget {:.2f}s)".format(args.module, seconds, args.budget))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
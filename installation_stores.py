@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+import importlib
+import json
+import logging
+import sys
+import threading
+import time
+from pathlib import Path
+from slack_sdk.oauth.installation_store import FileInstallationStore, InstallationStore, Installation, Bot
+from slack_sdk.oauth.installation_store.async_installation_store import AsyncInstallationStore
+from slack_sdk.oauth.installation_store.sqlite3 import SQLite3InstallationStore
+from metrics import record_cache_lookup
+
+INSTALLATIONS_DIR = "./data/installations"
+INSTALLATIONS_DATABASE = "./data/installations.db"
+
+# How long found installations are kept in memory. Other workers only see an
+# uninstall, reinstall or rotated token once their cached entry expires, so
+# this is kept short; a busy workspace still reads its installation from disk
+# only a couple of times a minute.
+POSITIVE_TTL_SECONDS = 30
+# How long "not installed" is remembered, so events from unknown teams don't hit disk every time
+NEGATIVE_TTL_SECONDS = 30
+
+
+class CachedInstallationStore(InstallationStore, AsyncInstallationStore):
+    """Memory cache with expiry in front of another installation store
+
+    Lookups that find nothing are cached too. Saving or deleting anything for
+    a workspace drops that workspace's cached entries, which covers Bolt's
+    app_uninstalled / tokens_revoked listeners, and bumps its generation, so
+    a lookup that started before the change doesn't cache what it read.
+    """
+
+    def __init__(self, underlying: InstallationStore, positive_ttl: float = POSITIVE_TTL_SECONDS, negative_ttl: float = NEGATIVE_TTL_SECONDS):
+        self.underlying = underlying
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self._cache = {}
+        # (enterprise_id, team_id) -> times its entries were invalidated; clear() bumps _epoch instead
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def logger(self):
+        return self.underlying.logger
+
+    def _cached(self, key: tuple, load):
+        now = time.monotonic()
+        workspace = (key[1], key[2])
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                record_cache_lookup("installations", True)
+                return entry[1]
+            self.misses += 1
+            generation = (self._epoch, self._generations.get(workspace, 0))
+        record_cache_lookup("installations", False)
+        value = load()
+        ttl = self.positive_ttl if value is not None else self.negative_ttl
+        with self._lock:
+            # Not cached if the workspace was saved or deleted while loading, as value may be from before that
+            if generation == (self._epoch, self._generations.get(workspace, 0)):
+                self._cache[key] = (now + ttl, value)
+        return value
+
+    def invalidate(self, enterprise_id: str = None, team_id: str = None):
+        """Drop every cached lookup for a workspace / org"""
+        with self._lock:
+            workspace = (enterprise_id, team_id)
+            self._generations[workspace] = self._generations.get(workspace, 0) + 1
+            for key in [k for k in self._cache if k[1] == enterprise_id and k[2] == team_id]:
+                del self._cache[key]
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._cache.clear()
+
+    def save(self, installation: Installation):
+        self.underlying.save(installation)
+        self.invalidate(installation.enterprise_id, installation.team_id)
+        if installation.is_enterprise_install:
+            self.invalidate(installation.enterprise_id, None)
+
+    def save_bot(self, bot: Bot):
+        self.underlying.save_bot(bot)
+        self.invalidate(bot.enterprise_id, bot.team_id)
+
+    def find_bot(self, *, enterprise_id, team_id, is_enterprise_install=False):
+        return self._cached(
+            ("bot", enterprise_id, team_id, None, is_enterprise_install),
+            lambda: self.underlying.find_bot(
+                enterprise_id=enterprise_id,
+                team_id=team_id,
+                is_enterprise_install=is_enterprise_install,
+            ),
+        )
+
+    def find_installation(self, *, enterprise_id, team_id, user_id=None, is_enterprise_install=False):
+        return self._cached(
+            ("installation", enterprise_id, team_id, user_id, is_enterprise_install),
+            lambda: self.underlying.find_installation(
+                enterprise_id=enterprise_id,
+                team_id=team_id,
+                user_id=user_id,
+                is_enterprise_install=is_enterprise_install,
+            ),
+        )
+
+    def delete_bot(self, *, enterprise_id, team_id):
+        self.underlying.delete_bot(enterprise_id=enterprise_id, team_id=team_id)
+        self.invalidate(enterprise_id, team_id)
+
+    def delete_installation(self, *, enterprise_id, team_id, user_id=None):
+        self.underlying.delete_installation(enterprise_id=enterprise_id, team_id=team_id, user_id=user_id)
+        self.invalidate(enterprise_id, team_id)
+
+    def delete_all(self, *, enterprise_id, team_id):
+        self.underlying.delete_all(enterprise_id=enterprise_id, team_id=team_id)
+        self.invalidate(enterprise_id, team_id)
+
+    # The file and SQLite stores only touch local disk, so the async versions just call the sync ones
+
+    async def async_save(self, installation: Installation):
+        self.save(installation)
+
+    async def async_save_bot(self, bot: Bot):
+        self.save_bot(bot)
+
+    async def async_find_bot(self, *, enterprise_id, team_id, is_enterprise_install=False):
+        return self.find_bot(enterprise_id=enterprise_id, team_id=team_id, is_enterprise_install=is_enterprise_install)
+
+    async def async_find_installation(self, *, enterprise_id, team_id, user_id=None, is_enterprise_install=False):
+        return self.find_installation(enterprise_id=enterprise_id, team_id=team_id, user_id=user_id, is_enterprise_install=is_enterprise_install)
+
+    async def async_delete_bot(self, *, enterprise_id, team_id):
+        self.delete_bot(enterprise_id=enterprise_id, team_id=team_id)
+
+    async def async_delete_installation(self, *, enterprise_id, team_id, user_id=None):
+        self.delete_installation(enterprise_id=enterprise_id, team_id=team_id, user_id=user_id)
+
+    async def async_delete_all(self, *, enterprise_id, team_id):
+        self.delete_all(enterprise_id=enterprise_id, team_id=team_id)
+
+
+def build_installation_store() -> CachedInstallationStore:
+    """Build the cached installation store configured in tokens.py
+
+    Set installation_store_backend = "sqlite" in tokens.py to keep installations
+    in data/installations.db instead of one file per workspace; run
+    `python installation_stores.py migrate` first to copy existing ones over.
+    """
+    tokens = importlib.import_module("tokens")
+    if getattr(tokens, "installation_store_backend", "file") == "sqlite":
+        underlying = SQLite3InstallationStore(database=INSTALLATIONS_DATABASE, client_id=tokens.client_id)
+    else:
+        underlying = FileInstallationStore(base_dir=INSTALLATIONS_DIR)
+    return CachedInstallationStore(underlying)
+
+
+def migrate_file_installations(source_dir: str, target: InstallationStore) -> int:
+    """Copy the latest installation of every workspace from a FileInstallationStore directory
+
+    Returns:
+        int: Number of installations copied
+    """
+    copied = 0
+    for installer_path in sorted(Path(source_dir).glob("*/installer-latest")):
+        with open(installer_path) as f:
+            target.save(Installation(**json.load(f)))
+        copied += 1
+        logging.info(f"Copied installation {installer_path.parent.name}")
+    return copied
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        print("Usage: python installation_stores.py migrate")
+        sys.exit(1)
+    tokens = importlib.import_module("tokens")
+    sqlite_store = SQLite3InstallationStore(database=INSTALLATIONS_DATABASE, client_id=tokens.client_id)
+    count = migrate_file_installations(INSTALLATIONS_DIR, sqlite_store)
+    logging.info(f"Copied {count} installations to {INSTALLATIONS_DATABASE}")
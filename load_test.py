@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""Measure how many Slack events per second a running check-in-bot process sustains
+
+Usage: python load_test.py URL --team TEAM_ID --channel CHANNEL_ID [options]
+
+Start one server process, e.g. `gunicorn --workers 1 wsgi:application` or
+`gunicorn -k uvicorn.workers.UvicornWorker --workers 1 asgi:application`, then
+point this at its /slack/events URL. Events are signed with the app's signing
+secret and use TEAM_ID, which must have an installation in ./data/installations.
+
+--kind ignored sends channel_join messages, which the bot drops without calling
+Slack or Claude, so only framework and store overhead is measured. --kind
+checkin sends ordinary check-ins that take the full reaction path; only use it
+against a test workspace. --replay FILE sends the messages in a JSONL file of
+recorded events (one Slack event, or events API envelope, per line) instead.
+
+To run offline, point the bot at mock_slack.py (see its docstring) and pass
+--mock http://127.0.0.1:3999 to also report end-to-end latency, from sending
+an event to its first reaction reaching the mock:
+
+    python mock_slack.py --seed-installation T0LOADTEST
+    python mock_slack.py &
+    python load_test.py http://127.0.0.1:3000/slack/events --team T0LOADTEST --channel C0LOADTEST \
+        --kind checkin --rate 20 --events 500 --mock http://127.0.0.1:3999
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+SAMPLE_CHECK_IN = "Yesterday: went for a run, finished the quarterly report\nToday: groceries, call mom, ~clean the garage~"
+
+_last_ts = 0
+_ts_lock = threading.Lock()
+
+def next_ts(now: float) -> str:
+    """Message timestamp that's unique within this run, so reactions can be matched to events"""
+    global _last_ts
+    with _ts_lock:
+        _last_ts = max(int(now * 1_000_000), _last_ts + 1)
+        return f"{_last_ts // 1_000_000}.{_last_ts % 1_000_000:06d}"
+
+def build_event(team_id: str, channel_id: str, user_id: str, kind: str, text: str = None, subtype: str = None) -> dict:
+    """Build an events API payload for a channel message"""
+    now = time.time()
+    event = {
+        "type": "message",
+        "channel": channel_id,
+        "channel_type": "group",
+        "user": user_id,
+        "text": text if text is not None else SAMPLE_CHECK_IN,
+        "ts": next_ts(now),
+        "team": team_id,
+    }
+    if subtype:
+        event["subtype"] = subtype
+    if kind == "ignored":
+        event["subtype"] = "channel_join"
+        event["text"] = f"<@{user_id}> has joined the channel"
+    return {
+        "token": "load-test",
+        "team_id": team_id,
+        "api_app_id": "A0LOADTEST",
+        "event": event,
+        "type": "event_callback",
+        "event_id": f"Ev{uuid.uuid4().hex[:10].upper()}",
+        "event_time": int(now),
+    }
+
+def sign_request(signing_secret: str, body: str) -> dict:
+    """Headers Slack would send with this body"""
+    timestamp = str(int(time.time()))
+    basestring = f"v0:{timestamp}:{body}".encode()
+    signature = "v0=" + hmac.new(signing_secret.encode(), basestring, hashlib.sha256).hexdigest()
+    return {
+        "Content-Type": "application/json",
+        "X-Slack-Request-Timestamp": timestamp,
+        "X-Slack-Signature": signature,
+    }
+
+def load_recorded_events(path: str) -> list:
+    """Message events from a JSONL file of recorded Slack events or events API envelopes"""
+    events = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                event = record.get("event", record)
+                if event.get("type", "message") == "message" and "text" in event:
+                    events.append(event)
+    return events
+
+def run_load(url: str, signing_secret: str, payloads: list, concurrency: int, rate: float = None) -> dict:
+    """POST payloads to url from concurrency threads, optionally paced to rate events/second
+
+    Returns:
+        dict: elapsed seconds, per-request ack latencies, error counts by status
+        and the time each acknowledged message was sent, keyed by "channel:ts"
+    """
+    sessions = threading.local()
+    latencies = []
+    errors = {}
+    sent_at = {}
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def send(i, payload):
+        if rate:
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        body = json.dumps(payload)
+        sent_wall = time.time()
+        sent = time.perf_counter()
+        try:
+            response = sessions.session.post(url, data=body, headers=sign_request(signing_secret, body), timeout=30)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        latency = time.perf_counter() - sent
+        with lock:
+            if status == 200:
+                latencies.append(latency)
+                event = payload["event"]
+                sent_at[f"{event['channel']}:{event['ts']}"] = sent_wall
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for i, payload in enumerate(payloads):
+            executor.submit(send, i, payload)
+    return {"elapsed": time.perf_counter() - start, "latencies": latencies, "errors": errors, "sent_at": sent_at}
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[int(fraction * (len(values) - 1))]
+
+def log_results(results: dict, total: int):
+    latencies = results["latencies"]
+    logging.info("Sent {} events in {:.2f}s: {:.1f} events/second acknowledged".format(
+        total, results["elapsed"], len(latencies) / results["elapsed"]))
+    if latencies:
+        logging.info("Ack latency: p50 {:.0f} ms, p95 {:.0f} ms, p99 {:.0f} ms, max {:.0f} ms".format(
+            percentile(latencies, 0.5) * 1000, percentile(latencies, 0.95) * 1000,
+            percentile(latencies, 0.99) * 1000, max(latencies) * 1000))
+        logging.info("Mean ack latency {:.0f} ms".format(statistics.mean(latencies) * 1000))
+    if results["errors"]:
+        failed = sum(results["errors"].values())
+        logging.info("Errors: {} of {} events ({:.1%}): {}".format(failed, total, failed / total,
+            ", ".join("{} x{}".format(k, v) for k, v in results["errors"].items())))
+
+def log_reaction_latency(mock_url: str, sent_at: dict, settle: float):
+    """Log how long acknowledged messages took to get their first reaction on the mock Slack API"""
+    deadline = time.time() + settle
+    while True:
+        first_reactions = requests.get(f"{mock_url}/_mock/reactions", timeout=10).json()
+        reacted = [first_reactions[key] - sent for key, sent in sent_at.items() if key in first_reactions]
+        if len(reacted) == len(sent_at) or time.time() >= deadline:
+            break
+        time.sleep(0.5)
+    logging.info("{} of {} acknowledged messages got a reaction ({:.1%})".format(
+        len(reacted), len(sent_at), len(reacted) / len(sent_at) if sent_at else 0))
+    if reacted:
+        logging.info("End-to-end reaction latency: p50 {:.0f} ms, p95 {:.0f} ms, p99 {:.0f} ms, max {:.0f} ms".format(
+            percentile(reacted, 0.5) * 1000, percentile(reacted, 0.95) * 1000,
+            percentile(reacted, 0.99) * 1000, max(reacted) * 1000))
+    stats = requests.get(f"{mock_url}/_mock/stats", timeout=10).json()
+    logging.info("Calls to the mock: {}".format(", ".join(f"{method} x{count}" for method, count in sorted(stats.items()))))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url", help="events URL, e.g. http://127.0.0.1:3000/slack/events")
+    parser.add_argument("--team", required=True, help="installed team ID to send events as")
+    parser.add_argument("--channel", required=True, help="channel ID the messages are posted in")
+    parser.add_argument("--user", default="U0LOADTEST", help="user ID the messages come from")
+    parser.add_argument("--kind", choices=["ignored", "checkin"], default="ignored")
+    parser.add_argument("--events", type=int, default=500, help="number of events to send")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight at once")
+    parser.add_argument("--rate", type=float, default=None, help="target events/second (default: as fast as possible)")
+    parser.add_argument("--signing-secret", default=None, help="defaults to client_signing_secret in tokens.py")
+    parser.add_argument("--replay", metavar="FILE", help="JSONL file of recorded events to send, repeated to make up --events")
+    parser.add_argument("--mock", metavar="URL", help="mock_slack.py base URL, to report end-to-end reaction latency")
+    parser.add_argument("--settle", type=float, default=15, help="seconds to wait for the last reactions with --mock")
+    args = parser.parse_args()
+
+    signing_secret = args.signing_secret
+    if not signing_secret:
+        import tokens
+        signing_secret = tokens.client_signing_secret
+
+    if args.replay:
+        recorded = load_recorded_events(args.replay)
+        if not recorded:
+            logging.error("No message events in {}".format(args.replay))
+            return
+        # Keep each recorded message's text and subtype, sent as if new in the load test channel
+        payloads = [
+            build_event(args.team, args.channel, event.get("user", args.user), "checkin", event["text"], event.get("subtype"))
+            for event in (recorded[i % len(recorded)] for i in range(args.events))
+        ]
+        kind = "replayed"
+    else:
+        payloads = [build_event(args.team, args.channel, args.user, args.kind) for _ in range(args.events)]
+        kind = args.kind
+    if args.mock:
+        requests.post(f"{args.mock}/_mock/reset", timeout=10)
+    logging.info("Sending {} {} events to {} with concurrency {}".format(args.events, kind, args.url, args.concurrency))
+    results = run_load(args.url, signing_secret, payloads, args.concurrency, args.rate)
+    log_results(results, args.events)
+    if args.mock:
+        log_reaction_latency(args.mock, results["sent_at"], args.settle)
+
+if __name__ == "__main__":
+    main()
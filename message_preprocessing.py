@@ -0,0 +1,92 @@
+import html
+import re
+
+# Messages longer than this are truncated before being sent to Claude
+DEFAULT_MAX_CHARS = 4000
+# Share of the character budget kept from the start of a long message; the rest comes from the end
+HEAD_FRACTION = 0.7
+TRUNCATION_MARKER = "\n[...]\n"
+
+CODE_BLOCK_PATTERN = re.compile(r"```.*?```", re.DOTALL)
+USER_MENTION_PATTERN = re.compile(r"<@[A-Z0-9]+(?:\|[^>]*)?>")
+CHANNEL_MENTION_PATTERN = re.compile(r"<#[A-Z0-9]+(?:\|([^>]*))?>")
+SPECIAL_MENTION_PATTERN = re.compile(r"<![^>]*>")
+LABELED_LINK_PATTERN = re.compile(r"<(?:https?|mailto):[^|>]+\|([^>]+)>")
+BARE_LINK_PATTERN = re.compile(r"<(?:https?://)?([^/|>:]+)[^|>]*>")
+# Slack only strikes through ~text~ whose opening ~ follows a non-word character and
+# precedes a non-space, and whose closing ~ follows a non-space and precedes a non-word
+# character, so "ran ~5km and ~3 miles" is left alone
+STRIKETHROUGH_LINE_PATTERN = re.compile(r"^\s*(?:[-*•]\s*)?~(?=[^\s~])[^~\n]*?(?<=[^\s~])~\s*$")
+STRIKETHROUGH_SPAN_PATTERN = re.compile(r"(?<![\w~])~(?=[^\s~])[^~\n]*?(?<=[^\s~])~(?![\w~])")
+BOLD_PATTERN = re.compile(r"\*([^*\n]+)\*")
+SPACES_PATTERN = re.compile(r"[ \t]+")
+BLANK_LINES_PATTERN = re.compile(r"\n{3,}")
+
+
+def strip_markup(text: str) -> str:
+    """Replace Slack markup, mentions and links with short plain-text equivalents"""
+    text = CODE_BLOCK_PATTERN.sub("[code]", text)
+    text = USER_MENTION_PATTERN.sub("@someone", text)
+    text = CHANNEL_MENTION_PATTERN.sub(lambda m: f"#{m.group(1)}" if m.group(1) else "#channel", text)
+    text = SPECIAL_MENTION_PATTERN.sub("", text)
+    text = LABELED_LINK_PATTERN.sub(r"\1", text)
+    # Keep only the domain of bare links, it's usually enough to pick an emoji
+    text = BARE_LINK_PATTERN.sub(r"\1", text)
+    text = BOLD_PATTERN.sub(r"\1", text)
+    return html.unescape(text)
+
+
+def drop_struck_through(text: str) -> str:
+    """Remove ~struck through~ tasks, which the emoji prompt says to ignore"""
+    lines = [line for line in text.split("\n") if not STRIKETHROUGH_LINE_PATTERN.match(line)]
+    return STRIKETHROUGH_SPAN_PATTERN.sub("", "\n".join(lines))
+
+
+def collapse_whitespace(text: str) -> str:
+    """Collapse runs of spaces and blank lines"""
+    lines = [SPACES_PATTERN.sub(" ", line).strip() for line in text.split("\n")]
+    return BLANK_LINES_PATTERN.sub("\n\n", "\n".join(lines)).strip()
+
+
+def truncate_head_tail(text: str, max_chars: int = DEFAULT_MAX_CHARS) -> str:
+    """Cap text length, keeping the start and end of the message
+
+    Cuts are moved back to the nearest line break when there is one, so whole
+    lines (usually whole tasks) are kept.
+    """
+    if len(text) <= max_chars:
+        return text
+    budget = max_chars - len(TRUNCATION_MARKER)
+    head_chars = int(budget * HEAD_FRACTION)
+    tail_chars = budget - head_chars
+
+    head = text[:head_chars]
+    if "\n" in head:
+        head = head[:head.rindex("\n")]
+    tail = text[-tail_chars:]
+    if "\n" in tail:
+        tail = tail[tail.index("\n") + 1:]
+    return head.rstrip() + TRUNCATION_MARKER + tail.lstrip()
+
+
+def preprocess_check_in(text: str, max_chars: int = DEFAULT_MAX_CHARS) -> str:
+    """Condense a check-in message before it is sent to Claude for emojis
+
+    Args:
+        text: Raw Slack message text
+        max_chars: Maximum length of the returned text
+
+    Returns:
+        str: Cleaned text, or an empty string if nothing worth reacting to is left
+    """
+    if not text:
+        return ""
+    text = strip_markup(text)
+    text = drop_struck_through(text)
+    text = collapse_whitespace(text)
+    return truncate_head_tail(text, max_chars)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about 4 characters per token for English text)"""
+    return (len(text) + 3) // 4
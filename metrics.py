@@ -0,0 +1,208 @@
+import functools
+import logging
+import os
+import threading
+import time
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST, REGISTRY
+from prometheus_client import multiprocess
+
+# In-process Prometheus metrics, served by wsgi.py at /metrics.
+#
+# Under gunicorn, gunicorn.conf.py sets PROMETHEUS_MULTIPROC_DIR before the app
+# is imported, so every worker writes its values to memory-mapped files there
+# and a scrape of any worker returns the sum over all of them. Without it (e.g.
+# `python wsgi.py`) only the current process is reported.
+
+# How often each worker records the length of its queues
+QUEUE_SAMPLE_SECONDS = 5
+
+EVENTS = Counter(
+    "checkin_bot_slack_events_total",
+    "Requests from Slack by event or payload type",
+    ["type"],
+)
+EVENTS_DROPPED = Counter(
+    "checkin_bot_events_dropped_total",
+    "Events acknowledged without running a listener, by reason",
+    ["reason"],
+)
+HANDLER_SECONDS = Histogram(
+    "checkin_bot_handler_seconds",
+    "Time spent in Bolt listeners",
+    ["handler"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64),
+)
+HANDLER_ERRORS = Counter(
+    "checkin_bot_handler_errors_total",
+    "Listeners that raised instead of returning",
+    ["handler"],
+)
+QUEUE_DEPTH = Gauge(
+    "checkin_bot_queue_depth",
+    "Work waiting to be picked up, summed over live workers",
+    ["queue"],
+    multiprocess_mode="livesum",
+)
+SLACK_API_CALLS = Counter(
+    "checkin_bot_slack_api_calls_total",
+    "Slack Web API calls by result: ok, a Slack error code or an exception name",
+    ["method", "team", "result"],
+)
+SLACK_API_SECONDS = Histogram(
+    "checkin_bot_slack_api_seconds",
+    "Slack Web API call latency, including WebClient's own retries",
+    ["method", "team"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16),
+)
+SLACK_API_RETRY_AFTER = Histogram(
+    "checkin_bot_slack_api_retry_after_seconds",
+    "Retry-After sent with rate limited (429) Slack responses",
+    ["method", "team"],
+    buckets=(1, 2, 5, 10, 30, 60, 120, 300),
+)
+MODEL_CALLS = Counter(
+    "checkin_bot_model_calls_total",
+    "Claude calls for emoji reactions by model and result: ok or error",
+    ["model", "result"],
+)
+MODEL_SECONDS = Histogram(
+    "checkin_bot_model_seconds",
+    "Claude call latency by model",
+    ["model"],
+    buckets=(0.25, 0.5, 1, 2, 4, 6, 8, 12, 16, 32),
+)
+MODEL_TOKENS = Counter(
+    "checkin_bot_model_tokens_total",
+    "Tokens sent to and received from Claude by model",
+    ["model", "direction"],
+)
+MODEL_COST = Counter(
+    "checkin_bot_model_cost_usd_total",
+    "Estimated cost of Claude calls in USD, from model_routing.MODEL_PRICES",
+    ["model"],
+)
+MODEL_IN_FLIGHT = Gauge(
+    "checkin_bot_model_in_flight",
+    "Claude calls waiting for a response, summed over live workers",
+    ["model"],
+    multiprocess_mode="livesum",
+)
+CACHE_LOOKUPS = Counter(
+    "checkin_bot_cache_lookups_total",
+    "Cache lookups by result; hit rate is hit / (hit + miss)",
+    ["cache", "result"],
+)
+
+_queues = {}
+_sampler_pid = None
+_sampler_lock = threading.Lock()
+
+
+def event_type(body: dict) -> str:
+    """Label for a request body: the event type for Events API requests, else the payload type"""
+    if body.get("type") == "event_callback":
+        return body.get("event", {}).get("type", "unknown")
+    return body.get("type") or ("slash_command" if "command" in body else "unknown")
+
+
+def record_event(body: dict):
+    EVENTS.labels(event_type(body)).inc()
+
+
+def record_dropped_event(reason: str):
+    EVENTS_DROPPED.labels(reason).inc()
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_slack_api_call(method: str, team: str, seconds: float, result: str, retry_after: float = None):
+    team = team or "none"
+    SLACK_API_CALLS.labels(method, team, result).inc()
+    SLACK_API_SECONDS.labels(method, team).observe(seconds)
+    if retry_after is not None:
+        SLACK_API_RETRY_AFTER.labels(method, team).observe(retry_after)
+
+
+def record_model_call_started(model: str):
+    MODEL_IN_FLIGHT.labels(model).inc()
+
+
+def record_model_call(model: str, seconds: float, error: bool, input_tokens: int, output_tokens: int, cost: float):
+    MODEL_IN_FLIGHT.labels(model).dec()
+    MODEL_CALLS.labels(model, "error" if error else "ok").inc()
+    MODEL_SECONDS.labels(model).observe(seconds)
+    MODEL_TOKENS.labels(model, "input").inc(input_tokens)
+    MODEL_TOKENS.labels(model, "output").inc(output_tokens)
+    MODEL_COST.labels(model).inc(cost)
+
+
+def timed(handler: str):
+    """Decorator recording a listener's latency and errors
+
+    functools.wraps keeps the argument names Bolt uses to pick what to pass in.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.labels(handler).inc()
+                raise
+            finally:
+                HANDLER_SECONDS.labels(handler).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def register_queue(name: str, depth):
+    """Report depth(), the number of items waiting in a queue, as checkin_bot_queue_depth{queue=name}"""
+    _queues[name] = depth
+
+
+def sample_queues():
+    for name, depth in _queues.items():
+        try:
+            QUEUE_DEPTH.labels(name).set(depth())
+        except Exception as e:
+            logging.error(f"Error sampling queue {name}: {repr(e)}")
+
+
+def start_queue_sampler():
+    """Sample queue depths in the background in this process"""
+    global _sampler_pid
+    with _sampler_lock:
+        if _sampler_pid == os.getpid():
+            return
+        _sampler_pid = os.getpid()
+    threading.Thread(target=_sample_forever, name="queue-sampler", daemon=True).start()
+
+
+def _sample_forever():
+    while True:
+        sample_queues()
+        time.sleep(QUEUE_SAMPLE_SECONDS)
+
+
+def render_metrics() -> tuple:
+    """Current metrics in the Prometheus text format
+
+    Returns:
+        tuple: (body, content type)
+    """
+    sample_queues()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead(pid: int):
+    """Drop a stopped worker's live gauges so they aren't summed any more"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
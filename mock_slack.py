@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""Mock Slack Web API and Anthropic Messages API for running the bot offline
+
+Usage: python mock_slack.py [--port 3999] [--slack-latency 0.05] [--claude-latency 0.8]
+                            [--rate-limit 0.0] [--history-messages 0] [--seed-installation T0LOADTEST]
+
+Point the bot at it in tokens.py, then start the bot and run load_test.py:
+
+    slack_api_url = "http://127.0.0.1:3999/api/"
+    anthropic_base_url = "http://127.0.0.1:3999"
+
+Only use this with a development checkout: the bot saves the fake workspace
+in data/workspaces.pickle like any other. --seed-installation saves a fake bot
+installation for a team so events from it are authorized.
+
+Slack methods the bot uses return canned, successful responses; other methods
+return ok with no data. views.publish keeps a hash per user and answers
+hash_conflict to publishes with an out of date one. reactions.add calls are
+recorded, and GET /_mock/reactions returns when the first reaction reached
+each message, for end-to-end latency. GET /_mock/stats returns call counts by
+method. With --history-messages, every channel has that many messages, some
+with thread replies, and conversations.list returns check-in channels for the
+last three months.
+"""
+import argparse
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+MOCK_EMOJIS = ":tada: :muscle: :sunny: :coffee:"
+
+
+class MockState:
+    def __init__(self, slack_latency: float, claude_latency: float, rate_limit: float, history_messages: int = 0):
+        self.slack_latency = slack_latency
+        self.claude_latency = claude_latency
+        self.rate_limit = rate_limit
+        self.history = build_history(history_messages)
+        self.threads = build_threads(self.history)
+        # Check-in channels for the last three months, when there is history to export
+        self.channels = build_month_channels(3) if history_messages else []
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.first_reactions = {}
+        self.view_hashes = {}
+
+    def record_call(self, method: str):
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+
+    def record_reaction(self, channel: str, timestamp: str):
+        with self.lock:
+            self.first_reactions.setdefault(f"{channel}:{timestamp}", time.time())
+
+    def reset(self):
+        with self.lock:
+            self.calls.clear()
+            self.first_reactions.clear()
+            self.view_hashes.clear()
+
+    def publish_view(self, user_id: str, expected_hash: str):
+        """New hash of the user's home view, or None if expected_hash is out of date"""
+        with self.lock:
+            if expected_hash and expected_hash != self.view_hashes.get(user_id, expected_hash):
+                return None
+            self.view_hashes[user_id] = uuid.uuid4().hex
+            return self.view_hashes[user_id]
+
+
+def build_history(count: int, user: str = "U0LOADTEST") -> list:
+    """count messages an hour apart ending now, newest first; every third one is from user"""
+    now = time.time()
+    return [
+        {"type": "message", "user": user if i % 3 == 0 else f"U0OTHER{i % 7}", "ts": f"{now - i * 3600:.6f}", "text": f"Check-in number {count - i}"}
+        for i in range(count)
+    ]
+
+
+def build_threads(history: list, user: str = "U0LOADTEST") -> dict:
+    """Replies by ts of their parent: every 30th message has one from user and one from someone else"""
+    threads = {}
+    for i, message in enumerate(history):
+        if i % 30 == 0:
+            parent_ts = float(message["ts"])
+            threads[message["ts"]] = [
+                {"type": "message", "user": user, "ts": f"{parent_ts + 60:.6f}", "thread_ts": message["ts"], "text": f"Reply to {message['text']}"},
+                {"type": "message", "user": "U0OTHER1", "ts": f"{parent_ts + 120:.6f}", "thread_ts": message["ts"], "text": "Nice!"},
+            ]
+            message.update(thread_ts=message["ts"], reply_count=2, reply_users_count=2, reply_users=[user, "U0OTHER1"])
+    return threads
+
+
+def build_month_channels(months: int) -> list:
+    """Channels named like the default channel_format for this month and the ones before it"""
+    year, month = time.localtime().tm_year, time.localtime().tm_mon
+    channels = []
+    for i in range(months):
+        channels.append({"id": f"C0MONTH{year}{month:02d}", "name": f"check-ins-{year}-{month:02d}", "is_private": True})
+        year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+    return channels
+
+
+def history_page(history: list, params: dict) -> dict:
+    """A conversations.history page of the mock channel, honoring limit, cursor, oldest and latest"""
+    oldest = float(params.get("oldest") or 0)
+    latest = float(params.get("latest") or time.time() + 1)
+    messages = [m for m in history if oldest < float(m["ts"]) < latest]
+    limit = min(int(params.get("limit") or 100), 999)
+    offset = int(params.get("cursor") or 0)
+    page = messages[offset:offset + limit]
+    has_more = offset + limit < len(messages)
+    return {"ok": True, "messages": page, "has_more": has_more,
+            "response_metadata": {"next_cursor": str(offset + limit) if has_more else ""}}
+
+
+def slack_response(state: MockState, method: str, params: dict, port: int) -> dict:
+    """Canned successful response for a Slack Web API method"""
+    team_id = params.get("team_id", "T0LOADTEST")
+    channel = params.get("channel", "C0LOADTEST")
+    if method == "auth.test":
+        return {"ok": True, "url": "https://mock.slack.com/", "team": "Mock Team", "user": "check-in-bot",
+                "team_id": team_id, "user_id": "U0MOCKBOT", "bot_id": "B0MOCKBOT", "is_enterprise_install": False}
+    if method == "team.info":
+        return {"ok": True, "team": {"id": team_id, "name": "Mock Team", "domain": "mock", "enterprise_id": None}}
+    if method == "users.info":
+        user = params.get("user", "U0LOADTEST")
+        return {"ok": True, "user": {"id": user, "name": user.lower(), "real_name": f"User {user}", "is_bot": False,
+                                     "profile": {"display_name": user.lower(), "real_name": f"User {user}"}}}
+    if method == "users.list":
+        return {"ok": True, "members": [], "response_metadata": {"next_cursor": ""}}
+    if method == "conversations.replies" and params.get("ts") in state.threads:
+        return {"ok": True, "messages": state.threads[params["ts"]], "has_more": False}
+    if method == "conversations.replies":
+        # Parent of a thread: the welcome message asking for intros
+        return {"ok": True, "messages": [{"ts": params.get("ts", "0"), "text": "Welcome to January! :snowflake: <@U0LOADTEST>"}], "has_more": False}
+    if method == "conversations.list":
+        return {"ok": True, "channels": state.channels, "response_metadata": {"next_cursor": ""}}
+    if method == "users.conversations":
+        return {"ok": True, "channels": [], "response_metadata": {"next_cursor": ""}}
+    if method == "conversations.members":
+        return {"ok": True, "members": [], "response_metadata": {"next_cursor": ""}}
+    if method in ("conversations.info", "conversations.create", "conversations.join", "conversations.invite"):
+        return {"ok": True, "channel": {"id": channel if method != "conversations.create" else f"C{uuid.uuid4().hex[:10].upper()}",
+                                        "name": params.get("name", f"mock-{channel.lower()}"), "is_private": False}}
+    if method in ("chat.postMessage", "chat.postEphemeral", "chat.update"):
+        return {"ok": True, "channel": channel, "ts": f"{time.time():.6f}", "message": {"text": params.get("text", "")}}
+    if method == "reactions.get":
+        return {"ok": True, "type": "message", "message": {"reactions": []}}
+    if method == "files.getUploadURLExternal":
+        return {"ok": True, "upload_url": f"http://127.0.0.1:{port}/_mock/upload", "file_id": f"F{uuid.uuid4().hex[:10].upper()}"}
+    if method == "files.completeUploadExternal":
+        return {"ok": True, "files": [{"id": "F0MOCK", "title": "mock"}]}
+    return {"ok": True}
+
+
+def claude_response(request: dict) -> dict:
+    """Canned Messages API response with a few emojis"""
+    input_chars = sum(len(m.get("content", "")) if isinstance(m.get("content"), str) else 0 for m in request.get("messages", []))
+    return {
+        "id": f"msg_{uuid.uuid4().hex[:24]}",
+        "type": "message",
+        "role": "assistant",
+        "model": request.get("model", "mock"),
+        "content": [{"type": "text", "text": MOCK_EMOJIS}],
+        "stop_reason": "end_turn",
+        "stop_sequence": None,
+        "usage": {"input_tokens": (len(request.get("system", "")) + input_chars) // 4, "output_tokens": 12},
+    }
+
+
+def make_handler(state: MockState, port: int):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status: int, body: dict, headers: dict = None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _read_params(self) -> dict:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode()
+            params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params.update(json.loads(body or "{}"))
+            else:
+                params.update({k: v[0] for k, v in parse_qs(body).items()})
+            return params
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/_mock/reactions":
+                with state.lock:
+                    self._send_json(200, dict(state.first_reactions))
+            elif path == "/_mock/stats":
+                with state.lock:
+                    self._send_json(200, dict(state.calls))
+            elif path == "/v1/models":
+                self._send_json(200, {"data": [], "has_more": False, "first_id": None, "last_id": None})
+            elif path.startswith("/api/"):
+                self._handle_slack(path[len("/api/"):], self._read_params())
+            else:
+                self._send_json(404, {"error": "not_found"})
+
+        def do_POST(self):
+            path = urlparse(self.path).path
+            if path == "/_mock/reset":
+                self._read_params()
+                state.reset()
+                self._send_json(200, {"ok": True})
+            elif path == "/_mock/upload":
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                self._send_json(200, {"ok": True})
+            elif path == "/v1/messages":
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                state.record_call("anthropic.messages")
+                time.sleep(state.claude_latency)
+                self._send_json(200, claude_response(request))
+            elif path.startswith("/api/"):
+                self._handle_slack(path[len("/api/"):], self._read_params())
+            else:
+                self._send_json(404, {"error": "not_found"})
+
+        def _handle_slack(self, method: str, params: dict):
+            state.record_call(method)
+            time.sleep(state.slack_latency)
+            if state.rate_limit and random.random() < state.rate_limit:
+                self._send_json(429, {"ok": False, "error": "ratelimited"}, {"Retry-After": "1"})
+                return
+            if method == "reactions.add":
+                state.record_reaction(params.get("channel", ""), params.get("timestamp", ""))
+            if method == "conversations.history":
+                self._send_json(200, history_page(state.history, params))
+                return
+            if method == "views.publish":
+                view_hash = state.publish_view(params.get("user_id", ""), params.get("hash"))
+                if view_hash is None:
+                    self._send_json(200, {"ok": False, "error": "hash_conflict"})
+                    return
+                self._send_json(200, {"ok": True, "view": {"id": f"V{uuid.uuid4().hex[:10].upper()}", "hash": view_hash}})
+                return
+            self._send_json(200, slack_response(state, method, params, port))
+
+        def log_message(self, format, *args):
+            pass
+
+    return MockHandler
+
+
+def seed_installation(team_id: str):
+    """Save a fake bot installation for team_id in the bot's installation store"""
+    from slack_sdk.oauth.installation_store import Installation
+    from installation_stores import build_installation_store
+    build_installation_store().save(Installation(
+        app_id="A0MOCKAPP",
+        team_id=team_id,
+        team_name="Mock Team",
+        bot_token=f"xoxb-mock-{team_id}",
+        bot_id="B0MOCKBOT",
+        bot_user_id="U0MOCKBOT",
+        bot_scopes=["chat:write", "reactions:write"],
+        user_id="U0MOCKADMIN",
+        installed_at=time.time(),
+    ))
+    logging.info(f"Saved a mock installation for {team_id}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=3999)
+    parser.add_argument("--slack-latency", type=float, default=0.05, help="seconds added to every Slack call")
+    parser.add_argument("--claude-latency", type=float, default=0.8, help="seconds added to every Claude call")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="fraction of Slack calls answered with 429")
+    parser.add_argument("--history-messages", type=int, default=0, help="messages in every channel's history, for export benchmarks")
+    parser.add_argument("--seed-installation", metavar="TEAM_ID", help="save a mock installation for TEAM_ID and exit")
+    args = parser.parse_args()
+
+    if args.seed_installation:
+        seed_installation(args.seed_installation)
+        return
+
+    state = MockState(args.slack_latency, args.claude_latency, args.rate_limit, args.history_messages)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(state, args.port))
+    server.daemon_threads = True
+    logging.info(f"Mock Slack API at http://127.0.0.1:{args.port}/api/, mock Claude at http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from message_preprocessing import estimate_tokens
+from metrics import record_model_call, record_model_call_started
+
+EMOJI_SYSTEM_PROMPT = "You are an emoji assistant. You respond to all messages with a single line representing four unique emojis, formatted for Slack. The emojis should represent things mentioned in the messages, with only zero or one emojis representing sentiment. Note that text surrounded by ~ or where the line starts or ends with a negative emoji like :no_pedestrians: or :heavy_multiplication_x: means that the task mentioned there was not completed - please exclude these lines from your emoji output. If the messages express deep sadness or high stress or mention anything related to death of people or animals, please use :people_hugging: to express comfort instead of something more specific for that part of the text. For example if someone's relative died please react with a hug instead of with an emoji representing the relative or death. Also, please use ungendered emojis, for example, :cook: is preferred over :female-cook: or :male-cook:"
+
+DEFAULT_MODEL = "claude-sonnet-4-6"
+FAST_MODEL = "claude-haiku-4-5"
+
+# USD per million input / output tokens
+MODEL_PRICES = {
+    "claude-haiku-4-5": (1.0, 5.0),
+    "claude-sonnet-4-6": (3.0, 15.0),
+}
+
+# Workspace model tiers, set by admins with `set model tier [fast|balanced|best]`
+MODEL_TIERS = ["fast", "balanced", "best"]
+DEFAULT_MODEL_TIER = "balanced"
+
+# Balanced tier: messages shorter than this go to the fast model
+SHORT_MESSAGE_TOKENS = 60
+# Balanced tier: fall back to the fast model when the default model is this slow or this busy
+LATENCY_BUDGET_SECONDS = 6.0
+MAX_IN_FLIGHT = 4
+# Weight of the newest sample in the moving latency average
+LATENCY_SMOOTHING = 0.2
+# A latency average with no sample for this long is ignored. Degraded traffic
+# goes to the fast model, so the default model's average would otherwise never
+# get another sample and the worker would never route back to it.
+LATENCY_STALE_SECONDS = 60
+
+_lock = threading.Lock()
+_model_stats = {}
+
+
+def _stats_for(model: str) -> dict:
+    if model not in _model_stats:
+        _model_stats[model] = {
+            "calls": 0,
+            "errors": 0,
+            "in_flight": 0,
+            "latency_total": 0.0,
+            "latency_avg": None,
+            "latency_sampled_at": None,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cost": 0.0,
+        }
+    return _model_stats[model]
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    """Cost in USD of a call with the given token usage"""
+    input_price, output_price = MODEL_PRICES.get(model, MODEL_PRICES[DEFAULT_MODEL])
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def is_degraded(model: str) -> bool:
+    """Whether recent calls to this model are too slow or too many are in flight"""
+    with _lock:
+        stats = _stats_for(model)
+        latency_avg = None if _latency_is_stale(stats) else stats["latency_avg"]
+        in_flight = stats["in_flight"]
+    return in_flight >= MAX_IN_FLIGHT or (latency_avg is not None and latency_avg > LATENCY_BUDGET_SECONDS)
+
+
+def _latency_is_stale(stats: dict) -> bool:
+    sampled_at = stats["latency_sampled_at"]
+    return sampled_at is None or time.monotonic() - sampled_at > LATENCY_STALE_SECONDS
+
+
+def choose_model(text: str, model_tier: str = None) -> str:
+    """Pick which Claude model to ask for emojis
+
+    Args:
+        text: The preprocessed message text
+        model_tier: Workspace model tier, one of MODEL_TIERS
+
+    Returns:
+        str: Model name
+    """
+    tier = model_tier or DEFAULT_MODEL_TIER
+    if tier == "fast":
+        return FAST_MODEL
+    if tier == "best":
+        return DEFAULT_MODEL
+    if estimate_tokens(text) < SHORT_MESSAGE_TOKENS:
+        return FAST_MODEL
+    if is_degraded(DEFAULT_MODEL):
+        logging.info(f"{DEFAULT_MODEL} is slow or busy, routing to {FAST_MODEL}")
+        return FAST_MODEL
+    return DEFAULT_MODEL
+
+
+@contextmanager
+def track_model_call(model: str):
+    """Record latency, in-flight count and errors for a model call
+
+    Yields a dict; set its "input_tokens" and "output_tokens" keys from the
+    response usage so the call's cost is accounted for. Besides the stats
+    routing uses, the call is reported at /metrics.
+    """
+    usage = {"input_tokens": 0, "output_tokens": 0}
+    with _lock:
+        _stats_for(model)["in_flight"] += 1
+    record_model_call_started(model)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield usage
+    except Exception:
+        error = True
+        with _lock:
+            _stats_for(model)["errors"] += 1
+        raise
+    finally:
+        latency = time.perf_counter() - start
+        cost = estimate_cost(model, usage["input_tokens"], usage["output_tokens"])
+        record_model_call(model, latency, error, usage["input_tokens"], usage["output_tokens"], cost)
+        with _lock:
+            stats = _stats_for(model)
+            stats["in_flight"] -= 1
+            stats["calls"] += 1
+            stats["latency_total"] += latency
+            # After a quiet spell the first sample starts a new average, so one slow period isn't held against the model
+            if stats["latency_avg"] is None or _latency_is_stale(stats):
+                stats["latency_avg"] = latency
+            else:
+                stats["latency_avg"] += LATENCY_SMOOTHING * (latency - stats["latency_avg"])
+            stats["latency_sampled_at"] = time.monotonic()
+            stats["input_tokens"] += usage["input_tokens"]
+            stats["output_tokens"] += usage["output_tokens"]
+            stats["cost"] += cost
+
+
+def get_model_stats() -> dict:
+    """Snapshot of per-model call counts, latency, tokens and cost"""
+    with _lock:
+        return {model: dict(stats) for model, stats in _model_stats.items()}
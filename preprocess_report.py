@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Report how much message preprocessing saves on a recorded corpus of check-ins
+
+Usage: python preprocess_report.py CORPUS.jsonl [--live]
+
+Each line of the corpus is a Slack event payload (either the full envelope with
+an "event" key or just the event). With --live, every message is also sent to
+Claude both raw and preprocessed so real input tokens and latency are compared.
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import time
+from message_preprocessing import preprocess_check_in, estimate_tokens
+from model_routing import DEFAULT_MODEL, EMOJI_SYSTEM_PROMPT
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+def load_corpus(path: str) -> list:
+    """Load message texts from a JSONL file of recorded Slack events"""
+    texts = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            event = record.get("event", record)
+            if event.get("text"):
+                texts.append(event["text"])
+    return texts
+
+def time_model_call(ai_client, text: str) -> tuple:
+    """Send text to Claude the same way get_emojis does
+
+    Returns:
+        tuple: (input_tokens, seconds)
+    """
+    start = time.perf_counter()
+    message = ai_client.messages.create(
+        model=DEFAULT_MODEL,
+        max_tokens=200,
+        system=EMOJI_SYSTEM_PROMPT,
+        messages=[{"role": "user", "content": text}],
+    )
+    return message.usage.input_tokens, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", help="JSONL file of recorded Slack message events")
+    parser.add_argument("--live", action="store_true", help="call Claude to measure real tokens and latency")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.corpus)
+    if not texts:
+        logging.error("No messages with text found in {}".format(args.corpus))
+        sys.exit(1)
+
+    ai_client = None
+    if args.live:
+        from anthropic import Anthropic
+        import tokens
+        ai_client = Anthropic(api_key=tokens.anthropic_key)
+
+    raw_tokens = 0
+    processed_tokens = 0
+    skipped = 0
+    preprocess_seconds = []
+    latency_deltas = []
+    for i, text in enumerate(texts):
+        start = time.perf_counter()
+        processed = preprocess_check_in(text)
+        preprocess_seconds.append(time.perf_counter() - start)
+
+        if ai_client:
+            raw_count, raw_latency = time_model_call(ai_client, text)
+            if processed:
+                processed_count, processed_latency = time_model_call(ai_client, processed)
+            else:
+                processed_count, processed_latency = 0, 0.0
+            latency_deltas.append(processed_latency - raw_latency)
+            logging.info("message {}: {} -> {} tokens, latency {:+.0f} ms".format(
+                i, raw_count, processed_count, (processed_latency - raw_latency) * 1000))
+        else:
+            raw_count = estimate_tokens(text)
+            processed_count = estimate_tokens(processed)
+
+        raw_tokens += raw_count
+        processed_tokens += processed_count
+        if not processed:
+            skipped += 1
+
+    saved = raw_tokens - processed_tokens
+    logging.info("Messages: {} ({} would skip the model call entirely)".format(len(texts), skipped))
+    logging.info("{} input tokens: {} raw, {} preprocessed, {} saved ({:.1f}%)".format(
+        "Measured" if ai_client else "Estimated",
+        raw_tokens, processed_tokens, saved, 100.0 * saved / raw_tokens if raw_tokens else 0.0))
+    logging.info("Preprocessing cost per message: mean {:.3f} ms, max {:.3f} ms".format(
+        statistics.mean(preprocess_seconds) * 1000, max(preprocess_seconds) * 1000))
+    if latency_deltas:
+        logging.info("Model latency change per message: mean {:+.0f} ms, median {:+.0f} ms".format(
+            statistics.mean(latency_deltas) * 1000, statistics.median(latency_deltas) * 1000))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import cProfile
+import functools
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+# On-demand profiling of this worker, started by an admin with a DM command
+# (see handle_admin_request in app.py). While a session is running, events
+# handled by functions decorated with @profiled are run under cProfile and
+# allocations are traced with tracemalloc. When the session has seen enough
+# events or time runs out, the results are written to data/profiles and a
+# summary is sent to the admin who started it.
+
+PROFILES_DIR = "./data/profiles"
+MAX_EVENTS = 1000
+MAX_SECONDS = 600
+TRACEMALLOC_FRAMES = 5
+SUMMARY_LINES = 15
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class ProfilingSession:
+    def __init__(self, client, channel: str, max_events: int = None, max_seconds: float = None):
+        self.client = client
+        self.channel = channel
+        self.max_events = max_events
+        self.max_seconds = max_seconds
+        self.events = 0
+        self.skipped = 0
+        self.started = time.time()
+        self.stats = None
+        # cProfile can only profile one thread at a time (3.12+ refuses a
+        # second active profiler), so events that overlap a profiled one are
+        # run normally and counted as skipped
+        self.profile_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.timer = None
+        # Tracing someone else started (e.g. PYTHONTRACEMALLOC) is left running when the session ends
+        self.started_tracing = not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.start_snapshot = tracemalloc.take_snapshot()
+
+    def add_profile(self, profile: cProfile.Profile):
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.events += 1
+            return self.max_events is not None and self.events >= self.max_events
+
+
+def get_session():
+    return _session
+
+
+def start_profiling(client, channel: str, max_events: int = None, max_seconds: float = None) -> tuple:
+    """Start profiling the next max_events events or max_seconds seconds in this worker
+
+    Returns:
+        tuple: (success, message for the admin)
+    """
+    global _session
+    if max_events is not None and not 0 < max_events <= MAX_EVENTS:
+        return False, f"Number of events must be between 1 and {MAX_EVENTS}"
+    if max_seconds is not None and not 0 < max_seconds <= MAX_SECONDS:
+        return False, f"Number of seconds must be between 1 and {MAX_SECONDS}"
+    with _session_lock:
+        if _session is not None:
+            return False, "Profiling is already running in this worker. Send `profile stop` to end it."
+        _session = ProfilingSession(client, channel, max_events, max_seconds)
+        # Also end the session on time when no events come in
+        _session.timer = threading.Timer(max_seconds or MAX_SECONDS, stop_profiling)
+        _session.timer.daemon = True
+        _session.timer.start()
+    if max_events is not None:
+        what = f"the next {max_events} events"
+    else:
+        what = f"{max_seconds:g} seconds"
+    return True, f"Profiling {what} in worker {os.getpid()}. I'll send you the results when it's done."
+
+
+def stop_profiling():
+    """End the running session, if any, and send its results to the admin who started it"""
+    global _session
+    with _session_lock:
+        session = _session
+        _session = None
+    if session is None:
+        return
+    session.timer.cancel()
+    try:
+        summary = write_results(session)
+    except Exception as e:
+        logging.error(f"Error writing profiling results: {repr(e)}")
+        summary = f"Profiling finished but the results couldn't be written: {repr(e)}"
+    finally:
+        if session.started_tracing:
+            tracemalloc.stop()
+    try:
+        session.client.chat_postMessage(channel=session.channel, text=summary)
+    except Exception as e:
+        logging.error(f"Error sending profiling results: {repr(e)}")
+
+
+def write_results(session: ProfilingSession) -> str:
+    """Write the .prof and tracemalloc snapshot files and return a summary of both"""
+    end_snapshot = tracemalloc.take_snapshot()
+    Path(PROFILES_DIR).mkdir(parents=True, exist_ok=True)
+    base = os.path.join(PROFILES_DIR, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+    end_snapshot.dump(f"{base}.snapshot")
+
+    elapsed = time.time() - session.started
+    lines = [f"Profiled {session.events} events over {elapsed:.0f}s in worker {os.getpid()} ({session.skipped} overlapping events not profiled)."]
+    if session.stats is not None:
+        session.stats.dump_stats(f"{base}.prof")
+        lines.append(f"Top functions by cumulative time (`{base}.prof`):")
+        lines.append("```\n" + "\n".join(top_functions(session.stats)) + "\n```")
+    lines.append(f"Top allocation sites since profiling started (`{base}.snapshot`):")
+    lines.append("```\n" + "\n".join(top_allocations(session.start_snapshot, end_snapshot)) + "\n```")
+    return "\n".join(lines)
+
+
+def top_functions(stats: pstats.Stats, count: int = SUMMARY_LINES) -> list:
+    """One line per function: cumulative seconds, calls and location"""
+    rows = []
+    for (filename, line, name), (_, calls, _, cumulative, _) in stats.stats.items():
+        rows.append((cumulative, calls, f"{name} ({os.path.basename(filename)}:{line})"))
+    rows.sort(reverse=True)
+    return [f"{cumulative:8.3f}s {calls:>7} {where}" for cumulative, calls, where in rows[:count]]
+
+
+def top_allocations(start_snapshot, end_snapshot, count: int = SUMMARY_LINES) -> list:
+    """Lines of code whose allocations grew the most between the snapshots"""
+    # Leave out the profiler's own bookkeeping
+    filters = [tracemalloc.Filter(False, module.__file__) for module in (tracemalloc, cProfile, pstats)]
+    filters.append(tracemalloc.Filter(False, __file__))
+    differences = end_snapshot.filter_traces(filters).compare_to(start_snapshot.filter_traces(filters), "lineno")
+    lines = []
+    for difference in differences[:count]:
+        frame = difference.traceback[0]
+        lines.append(f"{difference.size_diff / 1024:+9.1f} KiB {difference.count_diff:+7} blocks {os.path.basename(frame.filename)}:{frame.lineno}")
+    return lines
+
+
+def profiled(func):
+    """Decorator running a listener under the profiler while a session is active
+
+    functools.wraps keeps the argument names Bolt uses to pick what to pass in.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session = _session
+        if session is None:
+            return func(*args, **kwargs)
+        if session.max_seconds is not None and time.time() - session.started >= session.max_seconds:
+            stop_profiling()
+            return func(*args, **kwargs)
+        if not session.profile_lock.acquire(blocking=False):
+            session.skipped += 1
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            session.profile_lock.release()
+            if session.add_profile(profile):
+                stop_profiling()
+    return wrapper
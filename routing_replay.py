@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Replay recorded check-ins through the model routing policy and compare latency and cost
+
+Usage: python routing_replay.py CORPUS.jsonl [--tier fast|balanced|best] [--dry-run]
+
+Each line of the corpus is a recorded Slack event payload (the full envelope or
+just the event). Every message is sent to Claude twice: once with the current
+behaviour (DEFAULT_MODEL for everything) and once with the model the routing
+policy picks. With --dry-run no calls are made and cost is estimated from
+message length alone.
+"""
+import argparse
+import logging
+import statistics
+import sys
+import time
+from message_preprocessing import preprocess_check_in, estimate_tokens
+from model_routing import DEFAULT_MODEL, EMOJI_SYSTEM_PROMPT, MODEL_TIERS, choose_model, estimate_cost, track_model_call
+from preprocess_report import load_corpus
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+# Typical length of the single line of emojis Claude replies with
+ESTIMATED_OUTPUT_TOKENS = 25
+
+def call_model(ai_client, model: str, text: str) -> tuple:
+    """Ask a model for emojis the same way get_emojis does
+
+    Returns:
+        tuple: (seconds, cost)
+    """
+    start = time.perf_counter()
+    with track_model_call(model) as usage:
+        message = ai_client.messages.create(
+            model=model,
+            max_tokens=200,
+            system=EMOJI_SYSTEM_PROMPT,
+            messages=[{"role": "user", "content": text}],
+        )
+        usage["input_tokens"] = message.usage.input_tokens
+        usage["output_tokens"] = message.usage.output_tokens
+    cost = estimate_cost(model, message.usage.input_tokens, message.usage.output_tokens)
+    return time.perf_counter() - start, cost
+
+def summarize(name: str, latencies: list, costs: list):
+    if latencies:
+        latencies = sorted(latencies)
+        p95 = latencies[int(0.95 * (len(latencies) - 1))]
+        logging.info("{}: mean {:.0f} ms, p95 {:.0f} ms, total cost ${:.4f}".format(
+            name, statistics.mean(latencies) * 1000, p95 * 1000, sum(costs)))
+    else:
+        logging.info("{}: estimated total cost ${:.4f}".format(name, sum(costs)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("corpus", help="JSONL file of recorded Slack message events")
+    parser.add_argument("--tier", choices=MODEL_TIERS, default=None, help="workspace model tier to simulate")
+    parser.add_argument("--dry-run", action="store_true", help="estimate cost without calling Claude")
+    args = parser.parse_args()
+
+    texts = [text for text in (preprocess_check_in(t) for t in load_corpus(args.corpus)) if text]
+    if not texts:
+        logging.error("No messages with text found in {}".format(args.corpus))
+        sys.exit(1)
+
+    ai_client = None
+    if not args.dry_run:
+        from anthropic import Anthropic
+        import tokens
+        ai_client = Anthropic(api_key=tokens.anthropic_key)
+
+    system_tokens = estimate_tokens(EMOJI_SYSTEM_PROMPT)
+    model_counts = {}
+    baseline_latencies, baseline_costs = [], []
+    routed_latencies, routed_costs = [], []
+    for text in texts:
+        model = choose_model(text, args.tier)
+        model_counts[model] = model_counts.get(model, 0) + 1
+        if ai_client:
+            latency, cost = call_model(ai_client, DEFAULT_MODEL, text)
+            baseline_latencies.append(latency)
+            baseline_costs.append(cost)
+            latency, cost = call_model(ai_client, model, text)
+            routed_latencies.append(latency)
+            routed_costs.append(cost)
+        else:
+            input_tokens = system_tokens + estimate_tokens(text)
+            baseline_costs.append(estimate_cost(DEFAULT_MODEL, input_tokens, ESTIMATED_OUTPUT_TOKENS))
+            routed_costs.append(estimate_cost(model, input_tokens, ESTIMATED_OUTPUT_TOKENS))
+
+    logging.info("Replayed {} messages, routed to: {}".format(
+        len(texts), ", ".join("{} x{}".format(model, count) for model, count in sorted(model_counts.items()))))
+    summarize("Baseline ({} only)".format(DEFAULT_MODEL), baseline_latencies, baseline_costs)
+    summarize("Routed (tier {})".format(args.tier or "default"), routed_latencies, routed_costs)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Compare Slack call latency of the stock WebClient and the pooled keep-alive client
+
+Usage: python slack_client_benchmark.py WORKSPACE_ID [--calls N] [--method auth.test]
+
+Only read-only methods should be used. Total cron runtime is logged at the end
+of every cron.py run ("Cron job finished in ...") for before/after comparison.
+"""
+import argparse
+import logging
+import statistics
+import time
+from slack_sdk import WebClient
+from slack_sdk.oauth.installation_store import FileInstallationStore
+from slack_clients import PooledWebClient
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+def time_calls(client, method: str, calls: int) -> list:
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        client.api_call(method)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def log_latencies(name: str, latencies: list):
+    latencies = sorted(latencies)
+    logging.info("{}: total {:.2f}s, mean {:.0f} ms, p50 {:.0f} ms, p95 {:.0f} ms".format(
+        name, sum(latencies), statistics.mean(latencies) * 1000,
+        latencies[len(latencies) // 2] * 1000, latencies[int(0.95 * (len(latencies) - 1))] * 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("workspace_id")
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--method", default="auth.test")
+    parser.add_argument("--base-url", default="https://slack.com/api/")
+    args = parser.parse_args()
+
+    installation = FileInstallationStore(base_dir="./data/installations").find_installation(
+        team_id=args.workspace_id,
+        enterprise_id=None,
+        is_enterprise_install=False
+    )
+    if not installation:
+        logging.error("No installation found for workspace {}".format(args.workspace_id))
+        return
+
+    for name, client_class in [("WebClient (new connection per call)", WebClient), ("PooledWebClient (keep-alive)", PooledWebClient)]:
+        client = client_class(token=installation.bot_token, base_url=args.base_url)
+        log_latencies(name, time_calls(client, args.method, args.calls))
+
+if __name__ == "__main__":
+    main()
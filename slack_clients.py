@@ -0,0 +1,326 @@
+import http.client
+import io
+import logging
+import os
+import threading
+import time
+from urllib.error import HTTPError
+import requests
+from requests.adapters import HTTPAdapter
+from slack_sdk import WebClient
+from slack_sdk.errors import SlackApiError
+from metrics import record_slack_api_call
+from tracing import span
+
+# Connections kept open per thread, per host
+POOL_MAXSIZE = 10
+
+_thread_local = threading.local()
+
+
+def get_http_session() -> requests.Session:
+    """Get this thread's HTTP session, which keeps connections to Slack alive between calls
+
+    requests.Session isn't guaranteed to be thread safe, so each thread gets its
+    own. Sessions are shared by all workspace clients since the token is only a header.
+    """
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _thread_local.session = session
+    return session
+
+
+def reset_http_sessions():
+    """Forget every thread's HTTP session so new connections are opened
+
+    Call this in a forked process so it doesn't share sockets with its parent.
+    """
+    global _thread_local
+    _thread_local = threading.local()
+
+
+# Per (method, team) call stats for this process, summarized at the end of a cron run
+_api_stats = {}
+_api_stats_lock = threading.Lock()
+
+
+def record_api_call(method: str, team_id: str, seconds: float, result: str, retry_after: float = None):
+    """Record one Slack API call in /metrics and in this process's summary"""
+    record_slack_api_call(method, team_id, seconds, result, retry_after)
+    with _api_stats_lock:
+        stats = _api_stats.setdefault((method, team_id), {
+            "calls": 0,
+            "seconds": 0.0,
+            "max_seconds": 0.0,
+            "errors": {},
+            "retry_after": [],
+        })
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        if result != "ok":
+            stats["errors"][result] = stats["errors"].get(result, 0) + 1
+        if retry_after is not None:
+            stats["retry_after"].append(retry_after)
+
+
+def get_api_call_stats() -> dict:
+    """Snapshot of call stats keyed by (method, team_id)"""
+    with _api_stats_lock:
+        return {key: dict(stats, errors=dict(stats["errors"]), retry_after=list(stats["retry_after"])) for key, stats in _api_stats.items()}
+
+
+def log_api_call_summary(top: int = 15):
+    """Log which Slack methods and workspaces took the most time, failed or were rate limited"""
+    by_method = {}
+    by_team = {}
+    for (method, team_id), stats in get_api_call_stats().items():
+        for totals, key in [(by_method, method), (by_team, team_id)]:
+            total = totals.setdefault(key, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "errors": {}, "retry_after": []})
+            total["calls"] += stats["calls"]
+            total["seconds"] += stats["seconds"]
+            total["max_seconds"] = max(total["max_seconds"], stats["max_seconds"])
+            for error, count in stats["errors"].items():
+                total["errors"][error] = total["errors"].get(error, 0) + count
+            total["retry_after"] += stats["retry_after"]
+    if not by_method:
+        return
+    logging.info("Slack API calls by method (slowest total first):")
+    for method, total in sorted(by_method.items(), key=lambda item: -item[1]["seconds"])[:top]:
+        logging.info(_format_api_stats(method, total))
+    logging.info("Slack API calls by workspace:")
+    for team_id, total in sorted(by_team.items(), key=lambda item: -item[1]["seconds"]):
+        logging.info(_format_api_stats(team_id, total))
+
+
+def _format_api_stats(name: str, stats: dict) -> str:
+    line = "  {}: {} calls, {:.2f}s total, {:.0f} ms mean, {:.0f} ms max".format(
+        name, stats["calls"], stats["seconds"], stats["seconds"] / stats["calls"] * 1000, stats["max_seconds"] * 1000)
+    if stats["errors"]:
+        line += ", errors " + ", ".join(f"{error} x{count}" for error, count in sorted(stats["errors"].items()))
+    if stats["retry_after"]:
+        line += ", rate limited {} times (Retry-After up to {:.0f}s)".format(len(stats["retry_after"]), max(stats["retry_after"]))
+    return line
+
+
+def _retry_after(response) -> float:
+    headers = response.headers or {}
+    value = headers.get("Retry-After", headers.get("retry-after"))
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Spaces out calls made by several threads, e.g. one workspace's history calls during an export
+
+    Allows bursts of up to burst calls, then calls_per_minute. A 429 pauses every
+    thread using the limiter for as long as Retry-After says, not just the one
+    that got it.
+    """
+
+    def __init__(self, calls_per_minute: float, burst: int = 5):
+        self.interval = 60.0 / calls_per_minute
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until another call is allowed"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) / self.interval)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = max(self._paused_until - now, (1 - self._tokens) * self.interval)
+            time.sleep(delay)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(name: str, calls_per_minute: float) -> RateLimiter:
+    """The process's rate limiter called name, e.g. one workspace's history calls"""
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(name)
+        if limiter is None:
+            limiter = _rate_limiters[name] = RateLimiter(calls_per_minute)
+        return limiter
+
+
+def call_with_rate_limit_retries(method, max_retries: int = 5, limiter: RateLimiter = None, **kwargs):
+    """Call a WebClient method, waiting out 429 responses for as long as Retry-After says
+
+    For loops of many calls to the same method, like paging through history,
+    where WebClient would otherwise give up on the first rate limited call.
+    With a limiter, every call waits its turn and a 429 pauses the limiter.
+    """
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.wait()
+        try:
+            return method(**kwargs)
+        except SlackApiError as e:
+            if e.response.status_code != 429 or attempt == max_retries:
+                raise
+            delay = _retry_after(e.response) or 1.0
+            logging.warning(f"Rate limited, retrying in {delay:.0f}s ({attempt + 1}/{max_retries})")
+            if limiter:
+                limiter.pause(delay)
+            else:
+                time.sleep(delay)
+
+
+def upload_file(client, path: str, channel: str, title: str, initial_comment: str = None, filename: str = None):
+    """Share a file on disk in a channel, sending it in chunks instead of reading it into memory
+
+    Does what client.files_upload_v2(file=path) does, which reads the whole file
+    first: get an upload URL, send the file to it, then complete the upload.
+    """
+    filename = filename or os.path.basename(path)
+    upload = client.files_getUploadURLExternal(filename=filename, length=os.path.getsize(path))
+    with open(path, "rb") as file:
+        response = get_http_session().post(
+            upload["upload_url"],
+            data=file,
+            headers={"Content-Type": "application/octet-stream"},
+            timeout=client.timeout,
+        )
+    response.raise_for_status()
+    return client.files_completeUploadExternal(
+        files=[{"id": upload["file_id"], "title": title}],
+        channel_id=channel,
+        initial_comment=initial_comment,
+    )
+
+
+class InstrumentedWebClient(WebClient):
+    """WebClient that records latency, errors and rate limits of every call
+
+    Every Web API method goes through api_call, so this covers client.chat_postMessage
+    and friends as well as api_call itself.
+    """
+
+    def api_call(self, api_method: str, **kwargs):
+        team_id = self.default_params.get("team_id")
+        start = time.perf_counter()
+        result = "ok"
+        retry_after = None
+        with span(f"slack.{api_method}", team=team_id) as call_span:
+            try:
+                return super().api_call(api_method, **kwargs)
+            except SlackApiError as e:
+                result = e.response.get("error") or f"http_{e.response.status_code}"
+                if e.response.status_code == 429:
+                    retry_after = _retry_after(e.response)
+                    call_span.set(retry_after=retry_after)
+                raise
+            except Exception as e:
+                result = type(e).__name__
+                raise
+            finally:
+                record_api_call(api_method, team_id, time.perf_counter() - start, result, retry_after)
+
+
+def instrument_client(client: WebClient) -> InstrumentedWebClient:
+    """Copy of a WebClient (e.g. the one Bolt creates for each request) that records its calls"""
+    return InstrumentedWebClient(
+        token=client.token,
+        base_url=client.base_url,
+        timeout=client.timeout,
+        ssl=client.ssl,
+        proxy=client.proxy,
+        headers=client.headers,
+        team_id=client.default_params.get("team_id"),
+        logger=client.logger,
+        retry_handlers=client.retry_handlers,
+    )
+
+
+class PooledWebClient(InstrumentedWebClient):
+    """WebClient that sends requests over a persistent, gzip-enabled requests session
+
+    The stock WebClient opens a new TLS connection with urllib for every call.
+    Only the transport is replaced; retries, rate limit handling and response
+    parsing are still done by WebClient. Clients given a custom ssl context
+    keep the stock transport, since requests can't take an SSLContext.
+    """
+
+    # Overrides a private BaseClient method, checked against slack_sdk 3.45.0;
+    # see _perform_urllib_http_request in slack_sdk/web/base_client.py when upgrading
+    def _perform_urllib_http_request_internal(self, url, req):
+        if not url.lower().startswith("http") or self.ssl is not None:
+            return super()._perform_urllib_http_request_internal(url, req)
+        response = get_http_session().post(
+            url,
+            data=req.data,
+            headers={name: str(value) for name, value in req.header_items()},
+            timeout=self.timeout,
+            proxies={"http": self.proxy, "https": self.proxy} if self.proxy else None,
+        )
+        if response.status_code >= 400:
+            # WebClient's retry handlers (e.g. for 429 Retry-After) expect urllib's HTTPError
+            headers = http.client.HTTPMessage()
+            for name, value in response.headers.items():
+                headers[name] = value
+            raise HTTPError(url, response.status_code, response.reason, headers, io.BytesIO(response.content))
+        if response.headers.get("Content-Type", "").startswith("application/gzip"):
+            return {"status": response.status_code, "headers": response.headers, "body": response.content}
+        return {"status": response.status_code, "headers": response.headers, "body": response.text}
+
+
+class SlackClientPool:
+    """One PooledWebClient per workspace, created from its installation's bot token
+
+    Replaces setting app.client.token for each workspace in turn, which isn't
+    safe once more than one thread uses the client. The installation is looked
+    up on every call (the store caches it), so a workspace's client is
+    replaced when its token is rotated or reinstalled and dropped when the
+    app is uninstalled, even in a pool that lives as long as a web worker.
+    """
+
+    def __init__(self, installation_store, base_url: str = WebClient.BASE_URL):
+        self._installation_store = installation_store
+        self._base_url = base_url
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, team_id: str):
+        """Get the client for a workspace, or None if the app isn't installed there"""
+        installation = self._installation_store.find_installation(
+            team_id=team_id,
+            enterprise_id=None,
+            is_enterprise_install=False
+        )
+        if not installation or not installation.bot_token:
+            logging.error(f"No installation found for workspace {team_id}")
+            self.forget(team_id)
+            return None
+
+        with self._lock:
+            client = self._clients.get(team_id)
+            if client is None or client.token != installation.bot_token:
+                client = PooledWebClient(token=installation.bot_token, team_id=team_id, base_url=self._base_url)
+                self._clients[team_id] = client
+        return client
+
+    def forget(self, team_id: str):
+        """Drop a workspace's client, e.g. after its tokens are revoked"""
+        with self._lock:
+            self._clients.pop(team_id, None)
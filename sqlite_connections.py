@@ -0,0 +1,28 @@
+import os
+import sqlite3
+
+# The SQLite stores (OAuth states, users, the check-in archive, export jobs)
+# are used from several threads of several gunicorn workers. sqlite3
+# connections can't be shared between threads, and one inherited through a
+# fork must not be used by the child, so each store keeps one connection per
+# thread and process in a threading.local and gets it from here.
+
+
+def sqlite_connection(local, database: str, row_factory=None, **connect_kwargs) -> sqlite3.Connection:
+    """This thread's connection to database, opened in WAL mode the first time it's asked for in this process
+
+    Args:
+        local: The store's threading.local, where the connection is kept
+        database: Path of the database file
+        row_factory: Set on new connections, e.g. sqlite3.Row
+        connect_kwargs: Passed to sqlite3.connect, e.g. isolation_level=None for autocommit
+    """
+    conn = getattr(local, "conn", None)
+    if conn is None or getattr(local, "pid", None) != os.getpid():
+        conn = sqlite3.connect(database, **{"timeout": 10, **connect_kwargs})
+        conn.execute("pragma journal_mode=wal")
+        if row_factory is not None:
+            conn.row_factory = row_factory
+        local.conn = conn
+        local.pid = os.getpid()
+    return conn
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Compare OAuth state issue + consume latency as stale states pile up
+
+Usage: python state_store_benchmark.py [--rounds N] [--backlogs 0,1000,10000,100000]
+
+Runs in a temporary directory, so it doesn't touch ./data.
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from slack_sdk.oauth.state_store import FileOAuthStateStore
+from state_stores import SQLiteOAuthStateStore
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+def add_stale_file_states(base_dir: str, count: int):
+    os.makedirs(base_dir, exist_ok=True)
+    stale = str(time.time() - 3600)
+    for i in range(count):
+        with open(os.path.join(base_dir, f"stale-{i}"), "w") as f:
+            f.write(stale)
+
+def add_stale_sqlite_states(database: str, count: int):
+    with sqlite3.connect(database) as conn:
+        conn.executemany(
+            "insert into oauth_states (state, expires_at) values (?, ?)",
+            ((f"stale-{i}", time.time() - 3600) for i in range(count)),
+        )
+
+def time_install_flow(store, rounds: int) -> float:
+    """Mean seconds for one issue + consume, as in one OAuth install"""
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        state = store.issue()
+        if not store.consume(state):
+            raise RuntimeError("State was not accepted")
+        latencies.append(time.perf_counter() - start)
+    return statistics.mean(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--backlogs", default="0,1000,10000,100000")
+    args = parser.parse_args()
+
+    for backlog in [int(b) for b in args.backlogs.split(",")]:
+        with tempfile.TemporaryDirectory() as tmp:
+            file_store = FileOAuthStateStore(expiration_seconds=600, base_dir=os.path.join(tmp, "states"))
+            add_stale_file_states(file_store.base_dir, backlog)
+            # No sweeping, to show the cost with the whole backlog still in the table
+            sqlite_store = SQLiteOAuthStateStore(database=os.path.join(tmp, "states.db"), sweep_interval=3600, legacy_dir=None)
+            sqlite_store._ensure_sweeper = lambda: None
+            add_stale_sqlite_states(sqlite_store.database, backlog)
+            logging.info("{:>7} stale states: file store {:.3f} ms, sqlite store {:.3f} ms per install".format(
+                backlog, time_install_flow(file_store, args.rounds) * 1000, time_install_flow(sqlite_store, args.rounds) * 1000))
+            start = time.perf_counter()
+            deleted = sqlite_store.sweep()
+            logging.info("{:>7} stale states: sqlite sweep deleted {} in {:.1f} ms, {} state files left on disk".format(
+                backlog, deleted, (time.perf_counter() - start) * 1000, len(os.listdir(file_store.base_dir))))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from uuid import uuid4
+from slack_sdk.oauth.state_store import OAuthStateStore
+from slack_sdk.oauth.state_store.async_state_store import AsyncOAuthStateStore
+from sqlite_connections import sqlite_connection
+
+STATES_DATABASE = "./data/states.db"
+# Where FileOAuthStateStore used to write one file per install attempt
+LEGACY_STATES_DIR = "./data/states"
+STATE_EXPIRATION_SECONDS = 600
+SWEEP_INTERVAL_SECONDS = 300
+
+
+class SQLiteOAuthStateStore(OAuthStateStore, AsyncOAuthStateStore):
+    """OAuth state store in one SQLite table indexed by expiry
+
+    consume is a single primary-key delete, and a background thread deletes
+    expired states, so the install flow costs the same however many abandoned
+    install attempts have piled up. Safe to share between threads and gunicorn
+    workers.
+    """
+
+    def __init__(self, database: str = STATES_DATABASE, expiration_seconds: int = STATE_EXPIRATION_SECONDS, sweep_interval: float = SWEEP_INTERVAL_SECONDS, legacy_dir: str = LEGACY_STATES_DIR):
+        self.database = database
+        self.expiration_seconds = expiration_seconds
+        self.sweep_interval = sweep_interval
+        self.legacy_dir = legacy_dir
+        self._logger = logging.getLogger(__name__)
+        self._local = threading.local()
+        self._sweeper = None
+        self._sweeper_pid = None
+        self._sweeper_lock = threading.Lock()
+        Path(database).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("create table if not exists oauth_states (state text primary key, expires_at real not null)")
+            conn.execute("create index if not exists oauth_states_expires_at on oauth_states (expires_at)")
+
+    @property
+    def logger(self):
+        return self._logger
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite_connection(self._local, self.database)
+
+    def issue(self, *args, **kwargs) -> str:
+        self._ensure_sweeper()
+        state = str(uuid4())
+        with self._connect() as conn:
+            conn.execute(
+                "insert into oauth_states (state, expires_at) values (?, ?)",
+                (state, time.time() + self.expiration_seconds),
+            )
+        return state
+
+    def consume(self, state: str) -> bool:
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "delete from oauth_states where state = ? and expires_at > ?",
+                (state, time.time()),
+            )
+        if cursor.rowcount != 1:
+            self.logger.warning(f"Invalid or expired OAuth state: {state}")
+            return False
+        return True
+
+    async def async_issue(self, *args, **kwargs) -> str:
+        return self.issue(*args, **kwargs)
+
+    async def async_consume(self, state: str) -> bool:
+        return self.consume(state)
+
+    def sweep(self) -> int:
+        """Delete expired states
+
+        Returns:
+            int: Number of states deleted
+        """
+        with self._connect() as conn:
+            cursor = conn.execute("delete from oauth_states where expires_at <= ?", (time.time(),))
+        return cursor.rowcount
+
+    def _ensure_sweeper(self):
+        # Started lazily so it runs in the process that serves requests, not a
+        # gunicorn master that forked before any install attempt
+        with self._sweeper_lock:
+            if self._sweeper is not None and self._sweeper_pid == os.getpid():
+                return
+            self._sweeper = threading.Thread(target=self._sweep_forever, name="oauth-state-sweeper", daemon=True)
+            self._sweeper_pid = os.getpid()
+            self._sweeper.start()
+
+    def _sweep_forever(self):
+        if self.legacy_dir:
+            purge_legacy_states(self.legacy_dir, self.expiration_seconds)
+        while True:
+            try:
+                deleted = self.sweep()
+                if deleted:
+                    self.logger.info(f"Deleted {deleted} expired OAuth states")
+            except Exception as e:
+                self.logger.error(f"Error deleting expired OAuth states: {repr(e)}")
+            time.sleep(self.sweep_interval)
+
+
+def purge_legacy_states(base_dir: str, expiration_seconds: int = STATE_EXPIRATION_SECONDS) -> int:
+    """Delete expired state files left behind by FileOAuthStateStore
+
+    Returns:
+        int: Number of files deleted
+    """
+    path = Path(base_dir)
+    if not path.is_dir():
+        return 0
+    cutoff = time.time() - expiration_seconds
+    deleted = 0
+    for state_file in path.iterdir():
+        try:
+            if state_file.is_file() and state_file.stat().st_mtime < cutoff:
+                state_file.unlink()
+                deleted += 1
+        except OSError as e:
+            logging.error(f"Error deleting expired state file {state_file}: {repr(e)}")
+    if deleted:
+        logging.info(f"Deleted {deleted} expired state files from {base_dir}")
+    return deleted
+
+
+def build_state_store() -> SQLiteOAuthStateStore:
+    """Build the OAuth state store shared by the web app and scripts"""
+    return SQLiteOAuthStateStore()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Receive OTLP/HTTP JSON traces and write them to one rotating JSONL file
+
+Usage: python trace_collector.py [--port 4318] [--path ./data/traces/traces.jsonl]
+
+A stand-in for an OpenTelemetry collector: set trace_exporter = "otlp" in
+tokens.py and every gunicorn worker sends its traces here, so only this
+process writes and rotates the file. Lines have the same format as the ones
+the "jsonl" exporter writes.
+"""
+import argparse
+import json
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tracing import JsonlExporter, TRACE_FILE
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+def _attribute_value(value: dict):
+    if "intValue" in value:
+        return int(value["intValue"])
+    for key in ("stringValue", "doubleValue", "boolValue"):
+        if key in value:
+            return value[key]
+    return None
+
+def from_otlp(payload: dict) -> list:
+    """Flatten an OTLP/HTTP JSON export request into span dicts"""
+    spans = []
+    for resource_spans in payload.get("resourceSpans", []):
+        resource = {a["key"]: _attribute_value(a["value"]) for a in resource_spans.get("resource", {}).get("attributes", [])}
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for otlp_span in scope_spans.get("spans", []):
+                start_ns = int(otlp_span["startTimeUnixNano"])
+                record = {
+                    "trace_id": otlp_span["traceId"],
+                    "span_id": otlp_span["spanId"],
+                    "parent_id": otlp_span.get("parentSpanId"),
+                    "name": otlp_span["name"],
+                    "start": start_ns / 1e9,
+                    "duration_ms": round((int(otlp_span["endTimeUnixNano"]) - start_ns) / 1e6, 3),
+                    "attributes": {a["key"]: _attribute_value(a["value"]) for a in otlp_span.get("attributes", [])},
+                    "pid": resource.get("process.pid"),
+                }
+                if otlp_span.get("status", {}).get("code") == 2:
+                    record["error"] = otlp_span["status"].get("message", "")
+                spans.append(record)
+    return spans
+
+def make_handler(exporter: JsonlExporter):
+    class CollectorHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != "/v1/traces":
+                self.send_error(404)
+                return
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                exporter.export(from_otlp(payload))
+            except (ValueError, KeyError) as e:
+                self.send_error(400, repr(e))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, format, *args):
+            pass
+
+    return CollectorHandler
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--path", default=TRACE_FILE)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(JsonlExporter(args.path)))
+    logging.info(f"Writing traces sent to http://127.0.0.1:{args.port}/v1/traces to {args.path}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
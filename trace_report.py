@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Show the slowest traces in a trace file as trees of spans
+
+Usage: python trace_report.py [PATH] [--slowest 5] [--name message]
+"""
+import argparse
+import json
+from tracing import TRACE_FILE
+
+def load_traces(path: str) -> dict:
+    """Spans from a JSONL trace file grouped by trace id"""
+    traces = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                traces.setdefault(record["trace_id"], []).append(record)
+    return traces
+
+def print_tree(spans: list):
+    children = {}
+    for record in spans:
+        children.setdefault(record["parent_id"], []).append(record)
+
+    def print_span(record, depth):
+        attributes = " ".join(f"{key}={value}" for key, value in record["attributes"].items())
+        error = f" ERROR {record['error']}" if record.get("error") else ""
+        print(f"{'  ' * depth}{record['duration_ms']:>10.1f} ms  {record['name']} {attributes}{error}")
+        for child in sorted(children.get(record["span_id"], []), key=lambda r: r["start"]):
+            print_span(child, depth + 1)
+
+    for root in children.get(None, []):
+        print_span(root, 0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", nargs="?", default=TRACE_FILE)
+    parser.add_argument("--slowest", type=int, default=5)
+    parser.add_argument("--name", help="Only traces whose outermost span has this name")
+    args = parser.parse_args()
+
+    roots = []
+    for trace_id, spans in load_traces(args.path).items():
+        root = next((s for s in spans if s["parent_id"] is None), None)
+        if root and (args.name is None or root["name"] == args.name):
+            roots.append((root["duration_ms"], trace_id, spans))
+    for duration, trace_id, spans in sorted(roots, key=lambda r: -r[0])[:args.slowest]:
+        print(f"trace {trace_id}")
+        print_tree(spans)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+import atexit
+import contextvars
+import functools
+import importlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+import requests
+
+# Lightweight tracing of the message pipeline, home tab and cron steps.
+#
+# Wrap a stage in `with span("name", team=..., channel=...)`. The outermost span
+# starts a trace; spans opened inside it (in the same thread or asyncio task)
+# become its children. A finished trace is exported if it was sampled, or if
+# it took longer than trace_slow_seconds, so slow events are always kept.
+#
+# Settings in tokens.py, all optional:
+#   trace_sample_rate = 0.1        fraction of traces kept regardless of duration (default 0, off)
+#   trace_slow_seconds = 5         also keep every trace slower than this (default None, off)
+#   trace_exporter = "otlp"        "jsonl" (default) writes data/traces/traces.jsonl;
+#                                  "otlp" posts OTLP/HTTP JSON to trace_otlp_endpoint,
+#                                  e.g. trace_collector.py or an OpenTelemetry collector
+
+tokens = importlib.import_module("tokens")
+
+TRACE_SAMPLE_RATE = getattr(tokens, "trace_sample_rate", 0.0)
+TRACE_SLOW_SECONDS = getattr(tokens, "trace_slow_seconds", None)
+TRACE_EXPORTER = getattr(tokens, "trace_exporter", "jsonl")
+TRACE_OTLP_ENDPOINT = getattr(tokens, "trace_otlp_endpoint", "http://127.0.0.1:4318/v1/traces")
+TRACE_FILE = "./data/traces/traces.jsonl"
+TRACE_FILE_MAX_BYTES = 20 * 1024 * 1024
+TRACE_FILE_BACKUPS = 5
+SERVICE_NAME = "check-in-bot"
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, trace: "Trace", parent: "Span" = None, attributes: dict = None):
+        self.name = name
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start = time.time()
+        self.duration = None
+
+    def set(self, **attributes):
+        """Add attributes only known once the stage has run, e.g. sizes of results"""
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        record = {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+            "pid": os.getpid(),
+        }
+        if self.error:
+            record["error"] = self.error
+        return record
+
+
+class _NoopSpan:
+    """Handed out when tracing is off, so instrumented code doesn't need to check"""
+
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, sampled: bool):
+        self.trace_id = uuid.uuid4().hex
+        self.sampled = sampled
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+
+def tracing_enabled() -> bool:
+    return TRACE_SAMPLE_RATE > 0 or TRACE_SLOW_SECONDS is not None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a stage of work as a span of the current trace, starting one if there isn't one"""
+    parent = _current_span.get()
+    if parent is None:
+        if not tracing_enabled():
+            yield _NOOP_SPAN
+            return
+        trace = Trace(sampled=random.random() < TRACE_SAMPLE_RATE)
+    else:
+        trace = parent.trace
+    current = Span(name, trace, parent, attributes)
+    reset_token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = repr(e)
+        raise
+    finally:
+        current.duration = time.time() - current.start
+        _current_span.reset(reset_token)
+        trace.add(current)
+        if parent is None and (trace.sampled or (TRACE_SLOW_SECONDS is not None and current.duration >= TRACE_SLOW_SECONDS)):
+            get_exporter().export([s.to_dict() for s in trace.spans])
+
+
+def traced(name: str):
+    """Decorator running a function in a span named name"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class JsonlExporter:
+    """Writes one span per line to a size-rotated file
+
+    Each gunicorn worker rotates on its own, so with several workers a rotated
+    file can run over the size limit; use trace_collector.py if that matters.
+    """
+
+    def __init__(self, path: str = TRACE_FILE, max_bytes: int = TRACE_FILE_MAX_BYTES, backups: int = TRACE_FILE_BACKUPS):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._logger = logging.getLogger("check-in-bot.traces")
+        self._logger.propagate = False
+        self._logger.setLevel(logging.INFO)
+        if not self._logger.handlers:
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger.addHandler(handler)
+
+    def export(self, spans: list):
+        for record in spans:
+            self._logger.info(json.dumps(record))
+
+    def flush(self):
+        for handler in self._logger.handlers:
+            handler.flush()
+
+
+class OtlpExporter:
+    """Posts finished traces as OTLP/HTTP JSON from a background thread
+
+    Requests are never slowed down by the collector: traces are queued, sent in
+    batches, and dropped if the queue is full or the collector is down.
+    """
+
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT, batch_size: int = 50, max_queue: int = 1000):
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._worker_pid = None
+        self._lock = threading.Lock()
+
+    def export(self, spans: list):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            logging.warning("Trace queue is full, dropping a trace")
+
+    def _ensure_worker(self):
+        # Started per process, since gunicorn forks after the app is imported
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._send_forever, name="trace-exporter", daemon=True).start()
+
+    def _send_forever(self):
+        while True:
+            batch = self._queue.get()
+            while len(batch) < self.batch_size:
+                try:
+                    batch += self._queue.get(timeout=1)
+                except queue.Empty:
+                    break
+            self._send(batch)
+
+    def _send(self, spans: list):
+        try:
+            requests.post(self.endpoint, json=to_otlp(spans), timeout=5)
+        except Exception as e:
+            logging.warning(f"Error sending {len(spans)} spans to {self.endpoint}: {repr(e)}")
+
+    def flush(self):
+        spans = []
+        while True:
+            try:
+                spans += self._queue.get_nowait()
+            except queue.Empty:
+                break
+        if spans:
+            self._send(spans)
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: list) -> dict:
+    """Span dicts in the OTLP/HTTP JSON trace format"""
+    otlp_spans = []
+    for record in spans:
+        start_ns = int(record["start"] * 1e9)
+        otlp_span = {
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "name": record["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(record["duration_ms"] * 1e6)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in record["attributes"].items()],
+            "status": {"code": 2, "message": record["error"]} if record.get("error") else {"code": 1},
+        }
+        if record["parent_id"]:
+            otlp_span["parentSpanId"] = record["parent_id"]
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": SERVICE_NAME}},
+                {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+            ]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": otlp_spans}],
+        }]
+    }
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = OtlpExporter() if TRACE_EXPORTER == "otlp" else JsonlExporter()
+            atexit.register(_exporter.flush)
+        return _exporter
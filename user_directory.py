@@ -0,0 +1,160 @@
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from sqlite_connections import sqlite_connection
+
+USERS_DATABASE = "./data/users.db"
+# A full users.list reload is only needed when user_change / team_join events
+# could have been missed, e.g. while the bot was down
+DIRECTORY_MAX_AGE_SECONDS = 7 * 24 * 3600
+USERS_LIST_PAGE_SIZE = 1000
+
+USER_COLUMNS = ("user_id", "name", "real_name", "display_name", "first_name", "is_admin", "is_owner", "is_bot", "deleted")
+
+
+def user_row(user: dict) -> tuple:
+    """The fields the bot uses from a Slack user object, in USER_COLUMNS order"""
+    profile = user.get("profile", {})
+    return (
+        user["id"],
+        user.get("name"),
+        user.get("real_name") or profile.get("real_name"),
+        profile.get("display_name"),
+        profile.get("first_name"),
+        int(user.get("is_admin", False)),
+        int(user.get("is_owner", False)),
+        int(user.get("is_bot", False) or user["id"] == "USLACKBOT"),
+        int(user.get("deleted", False)),
+    )
+
+
+class UserDirectory:
+    """Slack users of every workspace in one SQLite table
+
+    Each workspace is bulk-loaded with paginated users.list and kept up to date
+    by the user_change and team_join listeners, so looking up a user's name or
+    admin status is a local read instead of a users.info call. Only the fields
+    in USER_COLUMNS are kept. Safe to share between threads and gunicorn
+    workers.
+    """
+
+    def __init__(self, database: str = USERS_DATABASE, max_age: float = DIRECTORY_MAX_AGE_SECONDS):
+        self.database = database
+        self.max_age = max_age
+        self._local = threading.local()
+        Path(database).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "create table if not exists users ("
+                "team_id text not null, user_id text not null, name text, real_name text, display_name text, first_name text, "
+                "is_admin integer not null, is_owner integer not null, is_bot integer not null, deleted integer not null, "
+                "primary key (team_id, user_id)) without rowid"
+            )
+            conn.execute("create table if not exists directory_loads (team_id text primary key, loaded_at real not null)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite_connection(self._local, self.database, row_factory=sqlite3.Row)
+
+    def load(self, team_id: str, client) -> int:
+        """Replace a workspace's users with a fresh copy from users.list
+
+        Returns:
+            int: Number of users loaded
+        """
+        start = time.perf_counter()
+        rows = []
+        cursor = None
+        while True:
+            response = client.users_list(limit=USERS_LIST_PAGE_SIZE, cursor=cursor)
+            rows.extend(user_row(user) for user in response["members"])
+            cursor = response.get("response_metadata", {}).get("next_cursor")
+            if not cursor:
+                break
+        with self._connect() as conn:
+            conn.execute("delete from users where team_id = ?", (team_id,))
+            conn.executemany(
+                f"insert into users (team_id, {', '.join(USER_COLUMNS)}) values (?, {', '.join('?' * len(USER_COLUMNS))})",
+                [(team_id, *row) for row in rows],
+            )
+            conn.execute("insert or replace into directory_loads (team_id, loaded_at) values (?, ?)", (team_id, time.time()))
+        logging.info(f"Loaded {len(rows)} users for {team_id} in {time.perf_counter() - start:.2f}s")
+        return len(rows)
+
+    def loaded_at(self, team_id: str):
+        row = self._connect().execute("select loaded_at from directory_loads where team_id = ?", (team_id,)).fetchone()
+        return row["loaded_at"] if row else None
+
+    def ensure_loaded(self, team_id: str, client):
+        """Load the workspace's users unless a recent enough copy is already stored"""
+        loaded_at = self.loaded_at(team_id)
+        if loaded_at is None or time.time() - loaded_at > self.max_age:
+            self.load(team_id, client)
+
+    def save_user(self, team_id: str, user: dict) -> bool:
+        """Add or update one user, from a user_change or team_join event
+
+        Returns:
+            bool: Whether the user's admin, owner or deactivated status changed
+        """
+        row = user_row(user)
+        status = dict(zip(USER_COLUMNS, row))
+        with self._connect() as conn:
+            previous = conn.execute(
+                "select is_admin, is_owner, deleted from users where team_id = ? and user_id = ?", (team_id, row[0])
+            ).fetchone()
+            conn.execute(
+                f"insert or replace into users (team_id, {', '.join(USER_COLUMNS)}) values (?, {', '.join('?' * len(USER_COLUMNS))})",
+                (team_id, *row),
+            )
+        if previous is None:
+            return bool(status["is_admin"] or status["is_owner"] or status["deleted"])
+        return tuple(previous) != (status["is_admin"], status["is_owner"], status["deleted"])
+
+    def get_user(self, team_id: str, user_id: str):
+        """Stored fields of a user as a dict, or None if the user isn't in the directory"""
+        row = self._connect().execute("select * from users where team_id = ? and user_id = ?", (team_id, user_id)).fetchone()
+        return dict(row) if row else None
+
+    def get_user_or_fetch(self, team_id: str, user_id: str, client):
+        """Like get_user, but users missing from the directory are looked up with users.info and saved"""
+        user = self.get_user(team_id, user_id)
+        if user is None:
+            self.save_user(team_id, client.users_info(user=user_id)["user"])
+            user = self.get_user(team_id, user_id)
+        return user
+
+    def first_name(self, team_id: str, user_id: str, client, default: str = "there") -> str:
+        try:
+            user = self.get_user_or_fetch(team_id, user_id, client)
+        except Exception as e:
+            logging.error(f"Error getting user info for {user_id}: {repr(e)}")
+            return default
+        return user.get("first_name") or default
+
+    def is_deleted(self, team_id: str, user_id: str) -> bool:
+        """Whether the user is known to be deactivated; users not in the directory are assumed active"""
+        user = self.get_user(team_id, user_id)
+        return bool(user and user["deleted"])
+
+    def workspace_admins(self, team_id: str) -> list:
+        """Active human Slack admins and owners of the workspace"""
+        rows = self._connect().execute(
+            "select * from users where team_id = ? and (is_admin = 1 or is_owner = 1) and is_bot = 0 and deleted = 0",
+            (team_id,),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_user_directory() -> UserDirectory:
+    """The user directory shared by the web app, cron and scripts"""
+    global _directory
+    with _directory_lock:
+        if _directory is None:
+            _directory = UserDirectory()
+        return _directory
@@ -0,0 +1,105 @@
+import importlib
+import logging
+import os
+import threading
+import time
+from anthropic import Anthropic
+from slack_bolt import BoltContext
+from slack_sdk import WebClient
+import app
+from slack_clients import reset_http_sessions
+from metrics import start_queue_sampler
+from export_jobs import start_export_workers
+from workspace_store import get_workspace_info, load_known_team_ids
+
+# Boot sequence for gunicorn workers, driven by the hooks in gunicorn.conf.py:
+#
+# 1. The master imports the app once (preload_app) and fills the caches every
+#    worker needs with warm_shared_caches, so forked workers share that memory.
+# 2. Each worker replaces network clients it inherited with reopen_clients.
+# 3. Each worker opens its connection to Claude with warm_connections, starts
+#    its export threads and marks itself ready before it accepts requests.
+
+tokens = importlib.import_module("tokens")
+
+# Claude is only called for real check-ins, so warming up is worth a short wait at most
+WARMUP_TIMEOUT_SECONDS = 5
+# The master warms workspaces one at a time before forking any worker, so it
+# gives up on the rest after this long; they are authorized on their first event
+SHARED_WARMUP_BUDGET_SECONDS = 30
+
+_ready = threading.Event()
+_shared_caches_warmed = False
+
+
+def is_ready() -> bool:
+    """Whether this process has finished warming up and should get traffic"""
+    return _ready.is_set()
+
+
+def mark_ready():
+    _ready.set()
+
+
+def warm_shared_caches():
+    """Load installations, bot identities and known team ids for every workspace into memory
+
+    Bolt otherwise reads the installation and calls auth.test the first time
+    each workspace sends an event to each worker.
+    """
+    global _shared_caches_warmed
+    start = time.perf_counter()
+    # auth.test calls get a short timeout, so a slow or unreachable Slack can't hold up startup for long
+    client = WebClient(base_url=app.SLACK_API_URL, timeout=WARMUP_TIMEOUT_SECONDS)
+    context = BoltContext(client=client, is_enterprise_install=False, logger=logging.getLogger(__name__))
+    workspace_ids = list(get_workspace_info().keys())
+    load_known_team_ids()
+    authorized = 0
+    for workspace_id in workspace_ids:
+        if time.perf_counter() - start > SHARED_WARMUP_BUDGET_SECONDS:
+            logging.warning(f"Stopped warming up workspaces after {SHARED_WARMUP_BUDGET_SECONDS}s; the rest are authorized on their first event")
+            break
+        try:
+            if app.authorize(context=context, enterprise_id=None, team_id=workspace_id, user_id=None):
+                authorized += 1
+        except Exception as e:
+            logging.warning(f"Could not warm up workspace {workspace_id}: {repr(e)}")
+    _shared_caches_warmed = True
+    logging.info(f"Warmed up {authorized}/{len(workspace_ids)} workspaces in {time.perf_counter() - start:.2f}s")
+
+
+def reopen_clients():
+    """Replace network clients created before this process was forked
+
+    Connections opened by the parent must not be reused by several workers.
+    """
+    app.ai_client = Anthropic(
+        api_key=tokens.anthropic_key,
+        base_url=app.ANTHROPIC_BASE_URL,
+    )
+    reset_http_sessions()
+
+
+def warm_connections():
+    """Open the HTTP connection to Claude so the first check-in doesn't pay for the TLS handshake"""
+    start = time.perf_counter()
+    try:
+        app.ai_client.with_options(timeout=WARMUP_TIMEOUT_SECONDS, max_retries=0).models.list(limit=1)
+        logging.info(f"Connected to Claude in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        logging.warning(f"Could not connect to Claude during warmup: {repr(e)}")
+
+
+def warm_worker():
+    """Get a freshly started worker ready to serve requests"""
+    start = time.perf_counter()
+    if not _shared_caches_warmed:
+        # Not preloaded, so nothing was warmed up before the fork
+        warm_shared_caches()
+    if getattr(tokens, "warmup_connections", True):
+        warm_connections()
+    start_queue_sampler()
+    # Resume export jobs left running by a worker that was restarted
+    start_export_workers(app.run_export_job, app.report_abandoned_export)
+    mark_ready()
+    logging.info(f"Worker {os.getpid()} ready after {time.perf_counter() - start:.2f}s of warmup")
@@ -1,17 +1,40 @@
+import asyncio
+import fcntl
+import functools
 import logging
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 import pickle
 import random
 import re
+from model_routing import MODEL_TIERS
 
-def save_workspace_info(data):
-    """Save workspace data to pickle file"""
+def save_workspace_info(data, team_id: str = None):
+    """Save workspace data to pickle file
+
+    Args:
+        data: Dict of all workspaces with team_ids as keys
+        team_id: The workspace that changed, if any. Its settings_version is
+                bumped so views rendered from the old settings are thrown away.
+    """
+    if team_id in data:
+        data[team_id]["settings_version"] = data[team_id].get("settings_version", 0) + 1
     pickle_path = Path("data/workspaces.pickle")
     pickle_path.parent.mkdir(exist_ok=True)
-    
-    with open(pickle_path, 'wb') as f:
-        pickle.dump(data, f)
+
+    # Write a new file and swap it in, so readers in other workers never see a partial pickle
+    fd, temp_path = tempfile.mkstemp(dir=pickle_path.parent, prefix="workspaces.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(data, f)
+        os.replace(temp_path, pickle_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
 
 def get_workspace_info(team_id: str = None):
     """Get info for one or all workspaces
@@ -38,33 +61,131 @@ def get_workspace_info(team_id: str = None):
         logging.error(f"Error reading workspace info: {repr(e)}")
         return {} if team_id else {}
 
-def ensure_workspace_exists(team_id: str, client=None):
-    """Ensure workspace exists in pickle, create if it doesn't"""
-    data = get_workspace_info()
-    
-    if team_id not in data:
-        team_name = team_id  # Default to team_id if we can't get the real name
-        if client:
-            try:
-                team_info = client.team_info()
-                team_name = team_info["team"]["name"]
-            except Exception as e:
-                logging.error(f"Error getting team info when ensuring workspace exists, setting team name to team id for now: {repr(e)}")
-        logging.info(f"Saving team info for team id {team_id} and name {team_name}")
-        data[team_id] = {
-            "team_id": team_id,
-            "team_name": team_name,
-            "admins": [],
-            "incompatible_pairs": [],
-            "channel_format": "check-ins-[year]-[month]",  # Default format
-            "announcement_channel": None,  # Default to None
-            "installed_at": datetime.now().isoformat()
-        }
-        save_workspace_info(data)
-        logging.info(f"Added workspace info for {team_name} ({team_id})")
-    
-    return data[team_id]
+# Team ids this process has seen in the store. Workspaces are never removed,
+# so once a team is in here ensure_workspace_exists has nothing to do.
+_known_team_ids = set()
+_known_team_ids_loaded = False
+_known_team_ids_lock = threading.Lock()
+
+def load_known_team_ids():
+    """Read every team id in the store into the process-level set of known teams"""
+    global _known_team_ids_loaded
+    team_ids = get_workspace_info().keys()
+    with _known_team_ids_lock:
+        _known_team_ids.update(team_ids)
+        _known_team_ids_loaded = True
+    return len(_known_team_ids)
+
+def is_known_workspace(team_id: str) -> bool:
+    if not _known_team_ids_loaded:
+        load_known_team_ids()
+    return team_id in _known_team_ids
+
+_lock_state = threading.local()
+
+@contextmanager
+def _workspaces_lock():
+    """Exclusive lock shared by every worker process and thread, held for each read-modify-write of the store
+
+    Reentrant within a thread, so a locked function can call another one.
+    """
+    if getattr(_lock_state, "depth", 0):
+        _lock_state.depth += 1
+        try:
+            yield
+        finally:
+            _lock_state.depth -= 1
+        return
+    lock_path = Path("data/workspaces.lock")
+    lock_path.parent.mkdir(exist_ok=True)
+    with open(lock_path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        _lock_state.depth = 1
+        try:
+            yield
+        finally:
+            _lock_state.depth = 0
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _locked(function):
+    """Run a function that changes the store under _workspaces_lock, so concurrent changes aren't lost"""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with _workspaces_lock():
+            return function(*args, **kwargs)
+    return wrapper
+
+def _add_workspace(team_id: str, team_name: str) -> bool:
+    """Save a new workspace with default settings unless another worker already did
+
+    Returns:
+        bool: Whether this call added the workspace
+    """
+    with _workspaces_lock():
+        data = get_workspace_info()
+        added = team_id not in data
+        if added:
+            logging.info(f"Saving team info for team id {team_id} and name {team_name}")
+            data[team_id] = {
+                "team_id": team_id,
+                "team_name": team_name,
+                "admins": [],
+                "incompatible_pairs": [],
+                "channel_format": "check-ins-[year]-[month]",  # Default format
+                "announcement_channel": None,  # Default to None
+                "installed_at": datetime.now().isoformat()
+            }
+            save_workspace_info(data, team_id)
+            logging.info(f"Added workspace info for {team_name} ({team_id})")
+    with _known_team_ids_lock:
+        _known_team_ids.add(team_id)
+    return added
+
+def update_team_metadata(team_id: str, **metadata):
+    """Save Slack's metadata for a workspace that exists in the store
+
+    Args:
+        team_id: The workspace team ID
+        metadata: Any of team_name, domain and enterprise_id
+    """
+    with _workspaces_lock():
+        data = get_workspace_info()
+        if team_id in data:
+            data[team_id].update(metadata)
+            save_workspace_info(data, team_id)
+            logging.info(f"Updated team metadata for {team_id}: {metadata}")
+
+def team_metadata_from_team_info(team: dict) -> dict:
+    """The metadata kept for a workspace, from the team object team.info returns"""
+    return {
+        "team_name": team["name"],
+        "domain": team.get("domain"),
+        "enterprise_id": team.get("enterprise_id"),
+    }
+
+def refresh_team_metadata(team_id: str, client):
+    """Look up a workspace's name, domain and enterprise with client.team_info() and save them"""
+    try:
+        update_team_metadata(team_id, **team_metadata_from_team_info(client.team_info()["team"]))
+    except Exception as e:
+        logging.error(f"Error getting team info for workspace {team_id}: {repr(e)}")
 
+def ensure_workspace_exists(team_id: str, client=None, team_name: str = None):
+    """Ensure workspace exists in pickle, create if it doesn't
+
+    Teams already seen by this process are only checked against an in-memory
+    set. A new team is added once across all workers; if team_name isn't given,
+    the team id is saved as its name and the real one, along with the rest of
+    the team metadata, is looked up with client.team_info() in a background
+    thread.
+    """
+    if is_known_workspace(team_id):
+        return
+    added = _add_workspace(team_id, team_name or team_id)
+    if added and client and not team_name:
+        threading.Thread(target=refresh_team_metadata, args=(team_id, client), name=f"team-info-{team_id}", daemon=True).start()
+
+@_locked
 def update_workspace_admins(team_id: str, admin_ids: list):
     """Update the list of admin users for a workspace
     
@@ -76,9 +197,17 @@ def update_workspace_admins(team_id: str, admin_ids: list):
     
     if team_id in data:
         data[team_id]["admins"] = admin_ids
-        save_workspace_info(data)
+        save_workspace_info(data, team_id)
         logging.info(f"Updated admins for workspace {team_id}: {admin_ids}")
 
+@_locked
+def bump_settings_version(team_id: str):
+    """Throw away views rendered from a workspace's settings, when something else they show changed"""
+    data = get_workspace_info()
+    if team_id in data:
+        save_workspace_info(data, team_id)
+
+@_locked
 def generate_admin_passcode(team_id: str, user_id: str):
     """Generate and store a passcode for admin verification
     
@@ -100,11 +229,12 @@ def generate_admin_passcode(team_id: str, user_id: str):
             "passcode": passcode,
             "timestamp": datetime.now().isoformat()
         }
-        save_workspace_info(data)
+        save_workspace_info(data, team_id)
         logging.info(f"Generated admin passcode for user {user_id} in workspace {team_id}")
         
     return passcode
 
+@_locked
 def verify_admin_passcode(team_id: str, user_id: str, passcode: str) -> bool:
     """Verify a passcode and make user admin if correct"""
     data = get_workspace_info()
@@ -115,11 +245,12 @@ def verify_admin_passcode(team_id: str, user_id: str, passcode: str) -> bool:
             del data[team_id]["pending_admins"][user_id]
             if user_id not in data[team_id]["admins"]:
                 data[team_id]["admins"].append(user_id)
-            save_workspace_info(data)
+            save_workspace_info(data, team_id)
             logging.info(f"User {user_id} verified as admin in workspace {team_id}")
             return True
     return False
 
+@_locked
 def add_incompatible_pair(team_id: str, user1: str, user2: str) -> tuple:
     """Add a pair of users that should be kept apart
 
@@ -148,11 +279,12 @@ def add_incompatible_pair(team_id: str, user1: str, user2: str) -> tuple:
 
     if pair not in data[team_id]["incompatible_pairs"]:
         data[team_id]["incompatible_pairs"].append(pair)
-        save_workspace_info(data)
+        save_workspace_info(data, team_id)
         logging.info(f"Added incompatible pair in workspace {team_id}: {user1} and {user2}")
         return (True, "")
     return (True, "Pair already exists")
 
+@_locked
 def add_compatible_pair(team_id: str, user1: str, user2: str) -> tuple:
     """Add a pair of users that should be kept together
 
@@ -181,11 +313,12 @@ def add_compatible_pair(team_id: str, user1: str, user2: str) -> tuple:
 
     if pair not in data[team_id]["compatible_pairs"]:
         data[team_id]["compatible_pairs"].append(pair)
-        save_workspace_info(data)
+        save_workspace_info(data, team_id)
         logging.info(f"Added compatible pair in workspace {team_id}: {user1} and {user2}")
         return (True, "")
     return (True, "Pair already exists")
 
+@_locked
 def remove_compatible_pair(team_id: str, user1: str, user2: str) -> tuple:
     """Remove a pair of users from the keep-together list
 
@@ -205,11 +338,12 @@ def remove_compatible_pair(team_id: str, user1: str, user2: str) -> tuple:
 
     if "compatible_pairs" in data[team_id] and pair in data[team_id]["compatible_pairs"]:
         data[team_id]["compatible_pairs"].remove(pair)
-        save_workspace_info(data)
+        save_workspace_info(data, team_id)
         logging.info(f"Removed compatible pair in workspace {team_id}: {user1} and {user2}")
         return (True, f"<@{user1}> and <@{user2}> will no longer be kept together")
     return (False, f"<@{user1}> and <@{user2}> are not in the keep-together list")
 
+@_locked
 def remove_incompatible_pair(team_id: str, user1: str, user2: str) -> tuple:
     """Remove a pair of users from the keep-apart list
 
@@ -229,7 +363,7 @@ def remove_incompatible_pair(team_id: str, user1: str, user2: str) -> tuple:
 
     if "incompatible_pairs" in data[team_id] and pair in data[team_id]["incompatible_pairs"]:
         data[team_id]["incompatible_pairs"].remove(pair)
-        save_workspace_info(data)
+        save_workspace_info(data, team_id)
         logging.info(f"Removed incompatible pair in workspace {team_id}: {user1} and {user2}")
         return (True, f"<@{user1}> and <@{user2}> will no longer be kept apart")
     return (False, f"<@{user1}> and <@{user2}> are not in the keep-apart list")
@@ -275,6 +409,7 @@ def validate_channel_format(format_str: str) -> tuple:
             
     return True, ""
 
+@_locked
 def update_channel_format(team_id: str, format_str: str) -> tuple:
     """Update the channel naming format for a workspace
     
@@ -292,12 +427,13 @@ def update_channel_format(team_id: str, format_str: str) -> tuple:
     data = get_workspace_info()
     if team_id in data:
         data[team_id]["channel_format"] = format_str
-        save_workspace_info(data)
+        save_workspace_info(data, team_id)
         logging.info(f"Updated channel format for workspace {team_id}: {format_str}")
         return True, ""
         
     return False, "Workspace not found"
 
+@_locked
 def update_announcement_channel(team_id: str, channel_id: str) -> bool:
     """Update the announcement channel for a workspace
     
@@ -311,11 +447,12 @@ def update_announcement_channel(team_id: str, channel_id: str) -> bool:
     data = get_workspace_info()
     if team_id in data:
         data[team_id]["announcement_channel"] = channel_id
-        save_workspace_info(data)
+        save_workspace_info(data, team_id)
         logging.info(f"Updated announcement channel for workspace {team_id}: {channel_id}")
         return True
     return False
 
+@_locked
 def update_workspace_info(workspace_id: str, updates: dict):
     """Update workspace information"""
     workspaces = get_workspace_info()
@@ -324,7 +461,7 @@ def update_workspace_info(workspace_id: str, updates: dict):
     logging.info(f"updates: {updates}")
     workspaces[workspace_id].update(updates)
     logging.info(f"workspace {workspace_id} after update: {workspaces[workspace_id]}")
-    save_workspace_info(workspaces)
+    save_workspace_info(workspaces, workspace_id)
 
 def update_custom_announcement(workspace_id: str, announcement_text: str):
     """Update the custom announcement text for a workspace"""
@@ -359,6 +496,7 @@ def update_auto_add_setting(workspace_id: str, enabled: bool):
     update_workspace_info(workspace_id, {"auto_add_active_users": enabled})
     return (True, "")
 
+@_locked
 def add_always_include_user(workspace_id: str, user_id: str):
     """Add a user to the 'always include' list for the next month's groups
     
@@ -378,13 +516,14 @@ def add_always_include_user(workspace_id: str, user_id: str):
         # Add user to the list if not already there
         if user_id not in data[workspace_id]["always_include_users"]:
             data[workspace_id]["always_include_users"].append(user_id)
-            save_workspace_info(data)
+            save_workspace_info(data, workspace_id)
             logging.info(f"Added user {user_id} to always include list for workspace {workspace_id}")
             return (True, f"User <@{user_id}> added to the always include list")
         else:
             return (False, f"User <@{user_id}> is already in the always include list")
     return (False, "Workspace not found")
 
+@_locked
 def remove_always_include_user(workspace_id: str, user_id: str):
     """Remove a user from the 'always include' list
     
@@ -399,7 +538,7 @@ def remove_always_include_user(workspace_id: str, user_id: str):
     if workspace_id in data and "always_include_users" in data[workspace_id]:
         if user_id in data[workspace_id]["always_include_users"]:
             data[workspace_id]["always_include_users"].remove(user_id)
-            save_workspace_info(data)
+            save_workspace_info(data, workspace_id)
             logging.info(f"Removed user {user_id} from always include list for workspace {workspace_id}")
             return (True, f"User <@{user_id}> removed from the always include list")
         else:
@@ -420,6 +559,7 @@ def get_always_include_users(workspace_id: str):
         return data[workspace_id].get("always_include_users", [])
     return []
 
+@_locked
 def add_emoji_optout_user(workspace_id: str, user_id: str):
     """Add a user to the emoji reaction opt-out list
 
@@ -437,13 +577,14 @@ def add_emoji_optout_user(workspace_id: str, user_id: str):
 
         if user_id not in data[workspace_id]["emoji_optout_users"]:
             data[workspace_id]["emoji_optout_users"].append(user_id)
-            save_workspace_info(data)
+            save_workspace_info(data, workspace_id)
             logging.info(f"Added user {user_id} to emoji opt-out list for workspace {workspace_id}")
             return (True, f"User <@{user_id}> opted out of emoji reactions")
         else:
             return (False, f"User <@{user_id}> is already opted out of emoji reactions")
     return (False, "Workspace not found")
 
+@_locked
 def remove_emoji_optout_user(workspace_id: str, user_id: str):
     """Remove a user from the emoji reaction opt-out list
 
@@ -458,7 +599,7 @@ def remove_emoji_optout_user(workspace_id: str, user_id: str):
     if workspace_id in data and "emoji_optout_users" in data[workspace_id]:
         if user_id in data[workspace_id]["emoji_optout_users"]:
             data[workspace_id]["emoji_optout_users"].remove(user_id)
-            save_workspace_info(data)
+            save_workspace_info(data, workspace_id)
             logging.info(f"Removed user {user_id} from emoji opt-out list for workspace {workspace_id}")
             return (True, f"User <@{user_id}> opted back in to emoji reactions")
         else:
@@ -477,4 +618,33 @@ def get_emoji_optout_users(workspace_id: str):
     data = get_workspace_info()
     if workspace_id in data:
         return data[workspace_id].get("emoji_optout_users", [])
-    return []
\ No newline at end of file
+    return []
+
+def update_model_tier(workspace_id: str, model_tier: str):
+    """Update which Claude model tier is used for emoji reactions, one of model_routing.MODEL_TIERS"""
+    if model_tier not in MODEL_TIERS:
+        tiers = ", ".join(f"'{tier}'" for tier in MODEL_TIERS[:-1])
+        return (False, f"Model tier must be one of {tiers} or '{MODEL_TIERS[-1]}'")
+    update_workspace_info(workspace_id, {"model_tier": model_tier})
+    return (True, "")
+
+async def async_refresh_team_metadata(team_id: str, client):
+    """Async version of refresh_team_metadata for an AsyncWebClient"""
+    try:
+        team_info = await client.team_info()
+        await asyncio.to_thread(update_team_metadata, team_id, **team_metadata_from_team_info(team_info["team"]))
+    except Exception as e:
+        logging.error(f"Error getting team info for workspace {team_id}: {repr(e)}")
+
+# Keeps a reference to running lookups so they aren't garbage collected
+_team_name_lookups = set()
+
+async def async_ensure_workspace_exists(team_id: str, client):
+    """Async version of ensure_workspace_exists for an AsyncWebClient"""
+    if is_known_workspace(team_id):
+        return
+    added = await asyncio.to_thread(_add_workspace, team_id, team_id)
+    if added:
+        task = asyncio.create_task(async_refresh_team_metadata(team_id, client))
+        _team_name_lookups.add(task)
+        task.add_done_callback(_team_name_lookups.discard)
@@ -1,6 +1,8 @@
 from slack_bolt.adapter.flask import SlackRequestHandler
-from flask import Flask, request
+from flask import Flask, Response, request
 from app import app as bolt_app, get_workspace_info, register_home_tab_handlers
+import warmup
+from metrics import render_metrics
 
 # Initialize Flask app
 flask_app = Flask(__name__)
@@ -18,8 +20,26 @@ handler = SlackRequestHandler(bolt_app)
 def slack_events():
     return handler.handle(request)
 
+@flask_app.route("/healthz", methods=["GET"])
+def healthz():
+    # Answered by any worker that isn't stuck, warmed up or not
+    return "ok\n", 200
+
+@flask_app.route("/readyz", methods=["GET"])
+def readyz():
+    # 503 until gunicorn.conf.py's post_worker_init has warmed up this worker
+    if warmup.is_ready():
+        return "ready\n", 200
+    return "warming up\n", 503
+
+@flask_app.route("/metrics", methods=["GET"])
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 # For Gunicorn
 application = flask_app
 
 if __name__ == "__main__":
+    warmup.warm_worker()
     flask_app.run(port=3000)
\ No newline at end of file